@@ -19,6 +19,10 @@ st.markdown("**Complexidade O(log m * n) → O(1) - 7 Níveis Hierárquicos com
 # Configurações globais
 DB_PATH = "global_hierarchical_router_optimized.db"
 CACHE_SIZE = 10000
+NEARBY_BOX_DEGREES = 2.0  # Vizinhas candidatas: |Δlat| e |Δlng| menores que isto
+NEARBY_MAX_NEIGHBORS = 20  # Vizinhas mais próximas guardadas por cidade
+NEARBY_MAX_DISTANCE_KM = 200.0  # Só se guardam distâncias menores que isto
+NEARBY_BLOCK_PAIRS = 2_000_000  # Pares (cidade, candidata) avaliados de cada vez
 REQUIRED_CSV_COLUMNS = ['city', 'lat', 'lng', 'country', 'id']
 DATA_URL = "https://raw.githubusercontent.com/kasshinokun/Q3_Q4_2025_Public/refs/heads/main/data_world_graphos/worldcities.csv"
 
@@ -63,6 +67,12 @@ def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Wrapper para haversine com cache"""
     return haversine_cached(lat1, lon1, lat2, lon2)
 
+def haversine_array(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Haversine vetorizada (graus -> km) sobre arrays NumPy com broadcasting"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0 * 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
 @lru_cache(maxsize=1000)
 def get_continent(country: str) -> str:
     """Mapeamento país → continente com cache"""
@@ -198,6 +208,10 @@ def create_optimized_database_structure():
         centroid_lng REAL NOT NULL
     );
     
+    CREATE TABLE global(
+        id INTEGER PRIMARY KEY
+    );
+    
     CREATE TABLE hierarchical_edges(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         level TEXT NOT NULL,
@@ -272,105 +286,109 @@ def download_and_load_data():
         st.error(f"Erro ao carregar CSV: {e}")
         return None
 
+def _spherical_centroids(df: pd.DataFrame, group: str) -> pd.DataFrame:
+    """Centróide (lat, lng) de cada grupo pela média dos vetores unitários.
+
+    Ao contrário da média de lat/lng, funciona para grupos que atravessam o
+    antimeridiano (Rússia, Oceania...) ou que se estendem por continentes.
+    """
+    lat, lng = np.radians(df['lat'].to_numpy()), np.radians(df['lng'].to_numpy())
+    sums = pd.DataFrame({
+        group: df[group].to_numpy(),
+        'x': np.cos(lat) * np.cos(lng), 'y': np.cos(lat) * np.sin(lng), 'z': np.sin(lat),
+    }).groupby(group, sort=True)[['x', 'y', 'z']].sum()
+    return pd.DataFrame({
+        'centroid_lat': np.degrees(np.arctan2(sums['z'], np.hypot(sums['x'], sums['y']))),
+        'centroid_lng': np.degrees(np.arctan2(sums['y'], sums['x'])),
+    }, index=sums.index)
+
 def create_optimized_clusters(df: pd.DataFrame, progress_bar, status_text):
-    """Cria clusters em 7 níveis hierárquicos com otimizações"""
+    """Cria clusters em 7 níveis hierárquicos com otimizações.
+
+    Toda a hierarquia é calculada por operações colunares: as chaves de
+    município (grelha de 0.01°) e de estado (0.1°) são colunas inteiras, os
+    ids saem de factorize/ngroup (por ordem de primeira ocorrência) e os
+    centróides de groupby. Cada nível é carregado com um único executemany.
+    """
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
-    # Configurar para inserção em lote
-    c.execute("BEGIN TRANSACTION")
-    
     status_text.text("Passo 1/5: Criando hierarquia e clusters...")
+    progress_bar.progress(10)
     
-    country_id_map = {}
-    regional_block_id_map = {}
-    continent_id_map = {}
-    municipality_clusters = {}
+    cities = df[['id', 'city', 'country', 'lat', 'lng']].copy()
+    cities['id'] = cities['id'].astype(str)
     
-    total_rows = len(df)
-    for i, (_, row) in enumerate(df.iterrows()):
-        row_dict = row.to_dict()
-        country_name = row_dict['country']
-        
-        if country_name not in country_id_map:
-            continent_code = get_continent(country_name)
-            if continent_code not in continent_id_map:
-                c.execute("INSERT INTO continents(code, name, centroid_lat, centroid_lng) VALUES(?, ?, 0, 0)", 
-                         (continent_code, CONTINENT_CODES.get(continent_code, "Unknown")))
-                continent_id_map[continent_code] = c.lastrowid
-            
-            regional_block_name = get_regional_block(country_name)
-            if regional_block_name not in regional_block_id_map:
-                c.execute("INSERT INTO regional_blocks(name, continent_id, centroid_lat, centroid_lng) VALUES(?, ?, 0, 0)",
-                         (regional_block_name, continent_id_map[continent_code]))
-                regional_block_id_map[regional_block_name] = c.lastrowid
-            
-            c.execute("INSERT INTO countries(name, regional_block_id, continent_id, centroid_lat, centroid_lng) VALUES(?, ?, ?, 0, 0)",
-                     (country_name, regional_block_id_map[regional_block_name], continent_id_map[continent_code]))
-            country_id_map[country_name] = c.lastrowid
-        
-        municipality_key = f"{country_name}_{round(row_dict['lat'], 2)}_{round(row_dict['lng'], 2)}"
-        municipality_clusters.setdefault(municipality_key, []).append(row_dict)
-        
-        if i % 1000 == 0:
-            progress_bar.progress(10 + int(15 * i / total_rows))
-            
-    c.execute("COMMIT")
+    # Países, blocos regionais e continentes (ids 1..n pela ordem de primeira ocorrência)
+    country_codes, country_names = pd.factorize(cities['country'])
+    countries = pd.DataFrame({'name': country_names})
+    countries['continent_code'] = countries['name'].map(get_continent)
+    countries['block_name'] = countries['name'].map(get_regional_block)
+    countries['continent_id'] = pd.factorize(countries['continent_code'])[0] + 1
+    countries['regional_block_id'] = pd.factorize(countries['block_name'])[0] + 1
+    cities['country_id'] = country_codes + 1
+    cities['continent_id'] = countries['continent_id'].to_numpy()[country_codes]
+    cities['regional_block_id'] = countries['regional_block_id'].to_numpy()[country_codes]
+    
+    # Um bloco pertence ao continente do seu primeiro país
+    blocks = countries.groupby('regional_block_id', sort=True).agg(
+        name=('block_name', 'first'), continent_id=('continent_id', 'first'))
+    continents = countries.groupby('continent_id', sort=True).agg(code=('continent_code', 'first'))
+    continents['name'] = continents['code'].map(lambda code: CONTINENT_CODES.get(code, "Unknown"))
+    
+    # Municípios: mesma célula de 0.01° no mesmo país
+    cities['municipality_id'] = cities.assign(
+        mlat=np.round(cities['lat'].to_numpy() * 100).astype(np.int64),
+        mlng=np.round(cities['lng'].to_numpy() * 100).astype(np.int64),
+    ).groupby(['country_id', 'mlat', 'mlng'], sort=False).ngroup() + 1
     
     status_text.text("Passo 2/5: Criando estados e municípios...")
     progress_bar.progress(25)
     
-    c.execute("BEGIN TRANSACTION")
-    state_id_map = {}
-    
-    for municipal_key, cities in municipality_clusters.items():
-        country = cities[0]['country']
-        state_key = f"{country}_{round(cities[0]['lat'], 1)}_{round(cities[0]['lng'], 1)}"
-        if state_key not in state_id_map:
-            centroid_lat_s = np.mean([c['lat'] for c in cities])
-            centroid_lng_s = np.mean([c['lng'] for c in cities])
-            c.execute("INSERT INTO states(country_id, centroid_lat, centroid_lng) VALUES(?, ?, ?)",
-                     (country_id_map[country], centroid_lat_s, centroid_lng_s))
-            state_id_map[state_key] = c.lastrowid
-
-    municipality_id_map = {}
-    for municipal_key, cities in municipality_clusters.items():
-        centroid_lat = np.mean([c['lat'] for c in cities])
-        centroid_lng = np.mean([c['lng'] for c in cities])
-        country = cities[0]['country']
-        state_key = f"{country}_{round(cities[0]['lat'], 1)}_{round(cities[0]['lng'], 1)}"
-        state_id = state_id_map[state_key]
-        
-        c.execute("INSERT INTO municipalities(centroid_lat, centroid_lng, state_id) VALUES(?, ?, ?)",
-                  (centroid_lat, centroid_lng, state_id))
-        municipality_id_map[municipal_key] = c.lastrowid
+    # Estados: célula de 0.1° da primeira cidade de cada município (o município não se divide)
+    municipality_first = cities.groupby('municipality_id', sort=True).agg(
+        country_id=('country_id', 'first'), lat=('lat', 'first'), lng=('lng', 'first'))
+    municipality_state = municipality_first.assign(
+        slat=np.round(municipality_first['lat'].to_numpy() * 10).astype(np.int64),
+        slng=np.round(municipality_first['lng'].to_numpy() * 10).astype(np.int64),
+    ).groupby(['country_id', 'slat', 'slng'], sort=False).ngroup() + 1
+    cities['state_id'] = municipality_state.to_numpy()[cities['municipality_id'].to_numpy() - 1]
+    
+    municipalities = cities.groupby('municipality_id', sort=True).agg(
+        centroid_lat=('lat', 'mean'), centroid_lng=('lng', 'mean'), state_id=('state_id', 'first'))
+    states = cities.groupby('state_id', sort=True).agg(
+        country_id=('country_id', 'first'), centroid_lat=('lat', 'mean'), centroid_lng=('lng', 'mean'))
     
+    # Níveis superiores: centróides esféricos das suas cidades
+    countries = countries.set_index(countries.index + 1).join(_spherical_centroids(cities, 'country_id'))
+    blocks = blocks.join(_spherical_centroids(cities, 'regional_block_id'))
+    continents = continents.join(_spherical_centroids(cities, 'continent_id'))
+    
+    c.execute("BEGIN TRANSACTION")
+    c.executemany("INSERT INTO continents(id, code, name, centroid_lat, centroid_lng) VALUES(?, ?, ?, ?, ?)",
+                  continents[['code', 'name', 'centroid_lat', 'centroid_lng']].itertuples(name=None))
+    c.executemany("INSERT INTO regional_blocks(id, name, continent_id, centroid_lat, centroid_lng) VALUES(?, ?, ?, ?, ?)",
+                  blocks[['name', 'continent_id', 'centroid_lat', 'centroid_lng']].itertuples(name=None))
+    c.executemany("INSERT INTO countries(id, name, regional_block_id, continent_id, centroid_lat, centroid_lng) VALUES(?, ?, ?, ?, ?, ?)",
+                  countries[['name', 'regional_block_id', 'continent_id', 'centroid_lat', 'centroid_lng']].itertuples(name=None))
+    c.executemany("INSERT INTO states(id, country_id, centroid_lat, centroid_lng) VALUES(?, ?, ?, ?)",
+                  states[['country_id', 'centroid_lat', 'centroid_lng']].itertuples(name=None))
+    c.executemany("INSERT INTO municipalities(id, centroid_lat, centroid_lng, state_id) VALUES(?, ?, ?, ?)",
+                  municipalities[['centroid_lat', 'centroid_lng', 'state_id']].itertuples(name=None))
     c.execute("COMMIT")
     
     status_text.text("Passo 3/5: Inserindo cidades...")
     progress_bar.progress(50)
 
+    # Cidades agrupadas por município (localidade no ficheiro)
+    cities = cities.sort_values('municipality_id', kind='stable')
+    columns = ['id', 'city', 'country', 'lat', 'lng', 'municipality_id', 'state_id', 'country_id',
+               'regional_block_id', 'continent_id']
     c.execute("BEGIN TRANSACTION")
-    cities_to_insert = []
-    for municipal_key, cities in municipality_clusters.items():
-        municipality_id = municipality_id_map[municipal_key]
-        
-        country = cities[0]['country']
-        state_key = f"{country}_{round(cities[0]['lat'], 1)}_{round(cities[0]['lng'], 1)}"
-        state_id = state_id_map[state_key]
-        
-        for city in cities:
-            cities_to_insert.append((
-                city['id'], city['city'], city['country'], city['lat'], city['lng'],
-                municipality_id, state_id, country_id_map[country],
-                regional_block_id_map[get_regional_block(city['country'])],
-                continent_id_map[get_continent(city['country'])]
-            ))
-            
     c.executemany("""
         INSERT INTO cities (id, name, country, lat, lng, municipality_id, state_id, country_id, regional_block_id, continent_id)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, cities_to_insert)
+    """, zip(*(cities[column].tolist() for column in columns)))
     c.execute("COMMIT")
 
     status_text.text("Passo 4/5: Criando conexões hierárquicas...")
@@ -424,35 +442,76 @@ def create_hierarchical_connections(conn):
     
     c.execute("COMMIT")
 
+def _nearest_in_box(lat, lng, members, candidates):
+    """Até NEARBY_MAX_NEIGHBORS vizinhas (na caixa de NEARBY_BOX_DEGREES) de cada cidade de `members`"""
+    distances = haversine_array(lat[members, None], lng[members, None], lat[candidates], lng[candidates])
+    outside = (np.abs(lat[members, None] - lat[candidates]) >= NEARBY_BOX_DEGREES) | \
+              (np.abs(lng[members, None] - lng[candidates]) >= NEARBY_BOX_DEGREES) | \
+              (members[:, None] == candidates[None, :])
+    distances[outside] = np.inf
+
+    k = min(NEARBY_MAX_NEIGHBORS, distances.shape[1])
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    nearest_dist = np.take_along_axis(distances, nearest, axis=1)
+    keep = nearest_dist < NEARBY_MAX_DISTANCE_KM
+    sources = np.broadcast_to(members[:, None], nearest.shape)[keep]
+    return sources, candidates[nearest[keep]], nearest_dist[keep]
+
 def precompute_nearby_distances(conn):
-    """Pré-computa distâncias entre cidades próximas para O(1) lookup"""
+    """Pré-computa distâncias entre cidades próximas para O(1) lookup.
+
+    Numa só passagem em memória: as cidades são agrupadas numa grelha de
+    células de NEARBY_BOX_DEGREES graus, pelo que as candidatas de cada
+    cidade estão nas 3x3 células à volta da sua. Para cada célula, a
+    haversine vetorizada dá as NEARBY_MAX_NEIGHBORS mais próximas e os pares
+    (nos dois sentidos) são inseridos com um único executemany.
+    """
+    cities = pd.read_sql_query("SELECT id, lat, lng FROM cities", conn)
+    if cities.empty:
+        return
+    ids = cities['id'].to_numpy()
+    lat = cities['lat'].to_numpy(dtype=np.float64)
+    lng = cities['lng'].to_numpy(dtype=np.float64)
+
+    # Chave linear da célula (linha de latitude x coluna de longitude, com uma célula de margem)
+    rows = np.floor(lat / NEARBY_BOX_DEGREES).astype(np.int64)
+    cols = np.floor(lng / NEARBY_BOX_DEGREES).astype(np.int64)
+    width = int(cols.max() - cols.min()) + 3
+    keys = (rows - rows.min() + 1) * width + (cols - cols.min() + 1)
+    order = np.argsort(keys, kind='stable')
+    cell_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    offsets = np.array([dr * width + dc for dr in (-1, 0, 1) for dc in (-1, 0, 1)])
+
+    sources, targets, distances = [], [], []
+    for cell, start, count in zip(cell_keys.tolist(), starts.tolist(), counts.tolist()):
+        members = order[start:start + count]
+        neighbor_keys = cell + offsets
+        neighbor_cells = np.searchsorted(cell_keys, neighbor_keys[np.isin(neighbor_keys, cell_keys, assume_unique=True)])
+        candidates = np.concatenate([order[starts[p]:starts[p] + counts[p]] for p in neighbor_cells])
+        if len(candidates) < 2:
+            continue
+        # Células densas em blocos, para limitar a matriz cidades x candidatas
+        block = max(1, NEARBY_BLOCK_PAIRS // len(candidates))
+        for first in range(0, len(members), block):
+            src, dst, dist = _nearest_in_box(lat, lng, members[first:first + block], candidates)
+            sources.append(src)
+            targets.append(dst)
+            distances.append(dist)
+
+    if not sources:
+        return
+    sources, targets, distances = np.concatenate(sources), np.concatenate(targets), np.concatenate(distances)
+    # Bidirecional: cada par nos dois sentidos, sem repetidos
+    pairs = pd.DataFrame({
+        'city1_id': ids[np.concatenate([sources, targets])],
+        'city2_id': ids[np.concatenate([targets, sources])],
+        'distance': np.concatenate([distances, distances]),
+    }).drop_duplicates(['city1_id', 'city2_id'], keep='last')
+
     c = conn.cursor()
-    
-    # Buscar todas as cidades
-    cities = c.execute("SELECT id, lat, lng FROM cities").fetchall()
-    
     c.execute("BEGIN TRANSACTION")
-    distances_to_insert = []
-    
-    for i, (city1_id, lat1, lng1) in enumerate(cities):
-        if i % 1000 == 0:
-            st.write(f"Pré-computando distâncias: {i}/{len(cities)}")
-            
-        # Encontrar cidades próximas (dentro de 2 graus)
-        nearby = c.execute("""
-            SELECT id, lat, lng FROM cities 
-            WHERE id != ? AND 
-            abs(lat - ?) < 2 AND abs(lng - ?) < 2
-            ORDER BY (lat-?)*(lat-?) + (lng-?)*(lng-?) LIMIT 20
-        """, (city1_id, lat1, lng1, lat1, lat1, lng1, lng1)).fetchall()
-        
-        for city2_id, lat2, lng2 in nearby:
-            dist = haversine(lat1, lng1, lat2, lng2)
-            if dist < 200:  # Apenas distâncias menores que 200km
-                distances_to_insert.append((city1_id, city2_id, dist))
-                distances_to_insert.append((city2_id, city1_id, dist))  # Bidirecional
-    
-    c.executemany("INSERT OR REPLACE INTO precomputed_distances VALUES (?, ?, ?)", distances_to_insert)
+    c.executemany("INSERT OR REPLACE INTO precomputed_distances VALUES (?, ?, ?)",
+                  zip(pairs['city1_id'].tolist(), pairs['city2_id'].tolist(), pairs['distance'].tolist()))
     c.execute("COMMIT")
 
 # ---------- ALGORITMO DE BUSCA OTIMIZADO ----------
@@ -0,0 +1,8 @@
+"""Benchmarks reprodutíveis dos algoritmos da Routing_API.
+
+`gazetteers` gera conjuntos sintéticos de cidades (uniforme, em aglomerados
+e com densidade semelhante à real) a partir de uma semente, e `run` mede
+cada algoritmo em bases SQLite temporárias, emitindo os resultados em JSON:
+
+    python -m benchmarks.run --sizes 1000 10000 100000 --output resultados.json
+"""
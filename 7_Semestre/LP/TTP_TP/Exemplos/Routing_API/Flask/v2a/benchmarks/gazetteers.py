@@ -0,0 +1,90 @@
+import numpy as np
+
+from distance_engine import EARTH_RADIUS_KM
+from quadtree_logic import Quadtree
+
+CLUSTER_COUNT = 50  # Centros do gazetteer 'clustered'
+CLUSTER_SIGMA_KM = 100.0  # Desvio padrão (por eixo) da dispersão em torno de cada centro
+RURAL_FRACTION = 0.15  # Fração de cidades dispersas longe dos centros no gazetteer 'realistic'
+
+# Grandes áreas metropolitanas (lat, lon), por ordem aproximada de população: o peso de
+# cada uma segue a lei de Zipf, como a distribuição real do tamanho das cidades
+METRO_AREAS = (
+    (35.6895, 139.6917), (28.6139, 77.2090), (31.2304, 121.4737), (-23.5505, -46.6333),
+    (19.4326, -99.1332), (30.0444, 31.2357), (19.0760, 72.8777), (39.9042, 116.4074),
+    (23.8103, 90.4125), (34.6937, 135.5023), (40.7128, -74.0060), (24.8607, 67.0011),
+    (-34.6037, -58.3816), (41.0082, 28.9784), (22.5726, 88.3639), (14.5995, 120.9842),
+    (6.5244, 3.3792), (-22.9068, -43.1729), (55.7558, 37.6173), (48.8566, 2.3522),
+    (34.0522, -118.2437), (51.5074, -0.1278), (-6.2088, 106.8456), (37.5665, 126.9780),
+    (-12.0464, -77.0428), (13.7563, 100.5018), (41.8781, -87.6298), (40.4168, -3.7038),
+    (-33.8688, 151.2093), (52.5200, 13.4050), (-26.2041, 28.0473), (43.6532, -79.3832),
+    (38.7223, -9.1393), (1.3521, 103.8198), (25.2048, 55.2708), (45.4642, 9.1900),
+)
+
+
+def _destination(lat, lon, distance_km, bearing):
+    # Ponto a `distance_km` de (lat, lon) na direção `bearing` (radianos), sobre a esfera
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    angle = np.asarray(distance_km) / EARTH_RADIUS_KM
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(angle) + np.cos(lat1) * np.sin(angle) * np.cos(bearing))
+    lon2 = lon1 + np.arctan2(np.sin(bearing) * np.sin(angle) * np.cos(lat1),
+                             np.cos(angle) - np.sin(lat1) * np.sin(lat2))
+    return np.degrees(lat2), (np.degrees(lon2) + 180.0) % 360.0 - 180.0
+
+
+def uniform(n, rng):
+    """Cidades uniformemente distribuídas na superfície da esfera."""
+    latitudes = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, n)))
+    longitudes = rng.uniform(-180.0, 180.0, n)
+    return latitudes, longitudes
+
+
+def clustered(n, rng):
+    """CLUSTER_COUNT aglomerados gaussianos (CLUSTER_SIGMA_KM) de tamanhos aleatórios."""
+    center_lat, center_lon = uniform(CLUSTER_COUNT, rng)
+    members = rng.choice(CLUSTER_COUNT, size=n, p=rng.dirichlet(np.ones(CLUSTER_COUNT)))
+    # Distância de Rayleigh = norma de um deslocamento gaussiano 2D
+    distances = CLUSTER_SIGMA_KM * np.sqrt(rng.chisquare(2, n))
+    return _destination(center_lat[members], center_lon[members], distances, rng.uniform(0, 2 * np.pi, n))
+
+
+def realistic(n, rng):
+    """Densidade semelhante à real: metrópoles com pesos de Zipf e periferias de cauda longa.
+
+    A distância ao centro segue uma lognormal (mediana de ~40 km): muitas
+    cidades perto do núcleo e algumas bem mais longe. RURAL_FRACTION das
+    cidades fica dispersa a centenas de quilómetros dos centros.
+    """
+    anchors = np.asarray(METRO_AREAS)
+    weights = 1.0 / np.arange(1, len(anchors) + 1)
+    members = rng.choice(len(anchors), size=n, p=weights / weights.sum())
+    distances = rng.lognormal(mean=np.log(40.0), sigma=1.0, size=n)
+    rural = rng.random(n) < RURAL_FRACTION
+    distances[rural] = rng.uniform(200.0, 1500.0, int(rural.sum()))
+    return _destination(anchors[members, 0], anchors[members, 1], distances, rng.uniform(0, 2 * np.pi, n))
+
+
+DISTRIBUTIONS = {
+    'uniform': uniform,
+    'clustered': clustered,
+    'realistic': realistic,
+}
+
+
+def generate(distribution, n, seed=0):
+    """(latitudes, longitudes) de `n` cidades; a mesma semente dá sempre o mesmo gazetteer."""
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"Distribuição desconhecida: {distribution}; use {', '.join(DISTRIBUTIONS)}")
+    return DISTRIBUTIONS[distribution](n, np.random.default_rng(seed))
+
+
+def write_gazetteer(db_path, distribution, n, seed=0, index_mode=None):
+    """Cria a tabela cities (e o índice espacial) em `db_path` com um gazetteer gerado.
+
+    Retorna a Quadtree da base, já pronta para consultas.
+    """
+    latitudes, longitudes = generate(distribution, n, seed)
+    quadtree = Quadtree(db_name=db_path, index_mode=index_mode)
+    quadtree.add_cities_bulk((f"{distribution}-{i}", lat, lon)
+                             for i, (lat, lon) in enumerate(zip(latitudes.tolist(), longitudes.tolist())))
+    return quadtree
@@ -0,0 +1,226 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from routing_algorithms import RoutingAlgorithms
+
+from .gazetteers import DISTRIBUTIONS, write_gazetteer
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_QUERIES = 200  # Consultas por benchmark de consulta (região, vizinhos)
+DEFAULT_PATH_QUERIES = 20  # Pares origem/destino por benchmark de caminho mais curto
+DEFAULT_REPEAT = 3  # Repetições dos benchmarks de lote (kmeans, TSP)
+REGION_BOX_DEGREES = 2.0  # Lado da caixa de find_cities_in_region, centrada numa cidade
+NEAREST_K = 10
+KMEANS_CLUSTERS = 20
+DBSCAN_EPS_KM = 25.0
+DBSCAN_MIN_SAMPLES = 5
+TSP_MAX_CITIES = 2000  # O vizinho mais próximo é O(n²): o TSP usa uma amostra deste tamanho
+
+
+def latency_stats(samples):
+    """Estatísticas (em ms) de uma lista de durações em segundos."""
+    samples = np.asarray(samples, dtype=np.float64)
+    total = float(samples.sum())
+    return {
+        'ops': len(samples),
+        'total_s': total,
+        'mean_ms': float(samples.mean() * 1000),
+        'p50_ms': float(np.percentile(samples, 50) * 1000),
+        'p95_ms': float(np.percentile(samples, 95) * 1000),
+        'max_ms': float(samples.max() * 1000),
+        'ops_per_s': len(samples) / total if total > 0 else None,
+    }
+
+
+def _timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+class Workload:
+    """Base de dados temporária com um gazetteer e o gerador de consultas (com semente)."""
+
+    def __init__(self, db_path, distribution, size, seed):
+        self.db_path = db_path
+        self.distribution = distribution
+        self.size = size
+        self.rng = np.random.default_rng(seed + 1)  # Consultas independentes da geração das cidades
+        self.insert_seconds, self.quadtree = _timed(write_gazetteer, db_path, distribution, size, seed)
+        self.router = RoutingAlgorithms(db_name=db_path)
+        store = self.router.coordinates
+        self.ids = store.ids.copy()
+        self.latitudes = store.latitudes.copy()
+        self.longitudes = store.longitudes.copy()
+
+    def sample_cities(self, count):
+        return self.rng.integers(0, len(self.ids), size=count)
+
+
+def bench_insert(workload, options):
+    # A inserção já foi medida ao criar a base (add_cities_bulk numa transação)
+    return {
+        'ops': workload.size,
+        'total_s': workload.insert_seconds,
+        'ops_per_s': workload.size / workload.insert_seconds,
+    }
+
+
+def bench_find_cities_in_region(workload, options):
+    half = REGION_BOX_DEGREES / 2
+    samples, found = [], []
+    for row in workload.sample_cities(options.queries).tolist():
+        lat, lon = float(workload.latitudes[row]), float(workload.longitudes[row])
+        seconds, cities = _timed(workload.quadtree.find_cities_in_region,
+                                 max(lat - half, -90.0), min(lat + half, 90.0),
+                                 max(lon - half, -180.0), min(lon + half, 180.0))
+        samples.append(seconds)
+        found.append(len(cities))
+    return {**latency_stats(samples), 'box_degrees': REGION_BOX_DEGREES, 'mean_results': float(np.mean(found))}
+
+
+def bench_find_nearest_cities(workload, options):
+    samples = []
+    for row in workload.sample_cities(options.queries).tolist():
+        # Pontos perto (mas não em cima) de cidades existentes
+        lat = float(np.clip(workload.latitudes[row] + workload.rng.normal(0, 0.5), -90, 90))
+        lon = float((workload.longitudes[row] + workload.rng.normal(0, 0.5) + 180) % 360 - 180)
+        seconds, _ = _timed(workload.quadtree.find_nearest_cities, lat, lon, NEAREST_K)
+        samples.append(seconds)
+    return {**latency_stats(samples), 'k': NEAREST_K}
+
+
+def bench_graph_build(workload, options):
+    # Primeira carga do grafo: gera as arestas k-NN de todas as cidades e monta o CSR
+    seconds, graph = _timed(workload.router.road_graph.ensure_loaded)
+    return {'ops': 1, 'total_s': seconds, 'nodes': len(graph), 'edges': graph.num_edges}
+
+
+def bench_dijkstra(workload, options):
+    workload.router.road_graph.ensure_loaded()
+    samples, settled, unreachable = [], [], 0
+    rows = workload.sample_cities(2 * options.path_queries).reshape(-1, 2)
+    for start, end in workload.ids[rows].tolist():
+        seconds, (path, _, settled_nodes) = _timed(workload.router.shortest_path, start, end, 'dijkstra')
+        samples.append(seconds)
+        settled.append(settled_nodes)
+        unreachable += not path
+    return {**latency_stats(samples), 'mean_settled_nodes': float(np.mean(settled)), 'unreachable': unreachable}
+
+
+def bench_kmeans(workload, options):
+    city_ids = workload.ids.tolist()
+    samples = [_timed(workload.router.kmeans, city_ids, KMEANS_CLUSTERS, seed=options.seed)[0]
+               for _ in range(options.repeat)]
+    return {**latency_stats(samples), 'clusters': KMEANS_CLUSTERS, 'cities': len(city_ids)}
+
+
+def bench_dbscan(workload, options):
+    city_ids = workload.ids.tolist()
+    runs = [_timed(workload.router.dbscan, city_ids, DBSCAN_EPS_KM, DBSCAN_MIN_SAMPLES)
+            for _ in range(options.repeat)]
+    clusters, noise = runs[-1][1]
+    return {**latency_stats([seconds for seconds, _ in runs]), 'eps_km': DBSCAN_EPS_KM, 'min_samples': DBSCAN_MIN_SAMPLES,
+            'clusters': len(clusters), 'noise': len(noise)}
+
+
+def bench_tsp_nearest_neighbor(workload, options):
+    size = min(TSP_MAX_CITIES, len(workload.ids))
+    city_ids = workload.ids[workload.rng.choice(len(workload.ids), size=size, replace=False)].tolist()
+    samples = [_timed(workload.router.tsp_nearest_neighbor, city_ids)[0] for _ in range(options.repeat)]
+    return {**latency_stats(samples), 'cities': size}
+
+
+BENCHMARKS = {
+    'insert': bench_insert,
+    'find_cities_in_region': bench_find_cities_in_region,
+    'find_nearest_cities': bench_find_nearest_cities,
+    'graph_build': bench_graph_build,
+    'dijkstra': bench_dijkstra,
+    'kmeans': bench_kmeans,
+    'dbscan': bench_dbscan,
+    'tsp_nearest_neighbor': bench_tsp_nearest_neighbor,
+}
+
+
+def _git_commit():
+    try:
+        output = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'git_commit': _git_commit(),
+    }
+
+
+def run_suite(options, log=sys.stderr):
+    """Corre os benchmarks pedidos para cada distribuição e tamanho; retorna o relatório (dict)."""
+    results = []
+    with tempfile.TemporaryDirectory(prefix='routing-bench-', dir=options.workdir) as workdir:
+        for distribution in options.distributions:
+            for size in options.sizes:
+                db_path = os.path.join(workdir, f'{distribution}-{size}.db')
+                workload = Workload(db_path, distribution, size, options.seed)
+                for name in options.benchmarks:
+                    result = {'distribution': distribution, 'size': size, 'benchmark': name,
+                              **BENCHMARKS[name](workload, options)}
+                    results.append(result)
+                    print(f"{distribution:>10} {size:>7} {name:<22} {result['total_s']:9.3f}s"
+                          f"  {result['ops']:>7} ops", file=log)
+    return {
+        'suite': 'routing_api',
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'seed': options.seed,
+        'parameters': {
+            'queries': options.queries,
+            'path_queries': options.path_queries,
+            'repeat': options.repeat,
+        },
+        'environment': environment(),
+        'results': results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks da Routing_API sobre gazetteers sintéticos")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--distributions', nargs='+', choices=list(DISTRIBUTIONS), default=list(DISTRIBUTIONS))
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--queries', type=int, default=DEFAULT_QUERIES)
+    parser.add_argument('--path-queries', type=int, default=DEFAULT_PATH_QUERIES)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None, help="Diretório para as bases temporárias (por omissão o do sistema)")
+    parser.add_argument('--output', default=None, help="Ficheiro JSON de saída (por omissão, stdout)")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    options = parse_args()
+    report = run_suite(options)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,111 @@
+import csv
+import json
+
+STREAM_CHUNK_SIZE = 1 << 20  # Bytes lidos do corpo do pedido de cada vez
+
+# Nomes de coluna/chave aceites para cada campo
+NAME_KEYS = ('name', 'nome', 'city')
+LATITUDE_KEYS = ('latitude', 'lat')
+LONGITUDE_KEYS = ('longitude', 'lon', 'lng')
+
+
+class ImportStats:
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []  # Primeiras linhas rejeitadas, para diagnóstico
+
+    def reject(self, line_number, reason, max_errors=20):
+        self.rejected += 1
+        if len(self.errors) < max_errors:
+            self.errors.append({'line': line_number, 'error': reason})
+
+    def to_dict(self):
+        return {'accepted': self.accepted, 'rejected': self.rejected, 'errors': self.errors}
+
+
+def _decode_line(line, line_number, stats):
+    # 'utf-8-sig' na primeira linha descarta o BOM que o Excel escreve nos CSV.
+    # Uma linha que não é UTF-8 válido é rejeitada e trocada por uma linha vazia,
+    # que os parsers ignoram sem desalinhar a numeração das linhas seguintes.
+    try:
+        return line.rstrip(b'\r').decode('utf-8-sig' if line_number == 1 else 'utf-8')
+    except UnicodeDecodeError:
+        stats.reject(line_number, 'Linha não está em UTF-8')
+        return ''
+
+
+def iter_lines(stream, stats, chunk_size=STREAM_CHUNK_SIZE):
+    # Lê o stream por blocos e produz linhas de texto, sem carregar o corpo inteiro
+    remainder = b''
+    line_number = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            line_number += 1
+            yield _decode_line(line, line_number, stats)
+    if remainder.strip():
+        yield _decode_line(remainder, line_number + 1, stats)
+
+
+def _pick(record, keys):
+    for key in keys:
+        if key in record and record[key] not in (None, ''):
+            return record[key]
+    return None
+
+
+def _to_city(record, line_number, stats):
+    name = _pick(record, NAME_KEYS)
+    latitude = _pick(record, LATITUDE_KEYS)
+    longitude = _pick(record, LONGITUDE_KEYS)
+    if name is None or latitude is None or longitude is None:
+        stats.reject(line_number, 'Campos name/latitude/longitude em falta')
+        return None
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (TypeError, ValueError):
+        stats.reject(line_number, 'Coordenadas não numéricas')
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        stats.reject(line_number, 'Coordenadas fora do intervalo')
+        return None
+    stats.accepted += 1
+    return str(name), latitude, longitude
+
+
+def parse_csv(lines, stats):
+    """Produz (name, latitude, longitude) de linhas CSV com cabeçalho."""
+    reader = csv.DictReader(lines)
+    if reader.fieldnames:
+        reader.fieldnames = [field.strip().lower() for field in reader.fieldnames]
+        # Sem estas colunas todas as linhas seriam rejeitadas: um só erro para o pedido
+        if not all(set(keys) & set(reader.fieldnames) for keys in (NAME_KEYS, LATITUDE_KEYS, LONGITUDE_KEYS)):
+            raise ValueError('Cabeçalho CSV sem colunas name/latitude/longitude')
+    for record in reader:
+        city = _to_city(record, reader.line_num, stats)
+        if city is not None:
+            yield city
+
+
+def parse_ndjson(lines, stats):
+    """Produz (name, latitude, longitude) de linhas NDJSON (um objeto por linha)."""
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            stats.reject(line_number, 'JSON inválido')
+            continue
+        if not isinstance(record, dict):
+            stats.reject(line_number, 'Esperado um objeto JSON')
+            continue
+        city = _to_city({key.lower(): value for key, value in record.items()}, line_number, stats)
+        if city is not None:
+            yield city
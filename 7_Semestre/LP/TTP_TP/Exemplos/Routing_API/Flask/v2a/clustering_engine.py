@@ -0,0 +1,287 @@
+import numpy as np
+
+from spatial_grid import KNN_BLOCK_PAIRS, UnitVectorGrid, km_to_chord
+
+KMEANS_INITS = ('k-means++', 'random')
+DEFAULT_TOL_KM = 0.001  # Paragem quando nenhum centróide se move mais do que isto (km)
+DEFAULT_MAX_ITERATIONS = 100
+ASSIGN_BLOCK_ELEMENTS = 1 << 22  # Elementos (pontos x centróides) por bloco na atribuição
+MIN_EPS_KM = 0.1  # Raio mínimo do DBSCAN (abaixo disto as chaves da grelha transbordam)
+NOISE = -1  # Rótulo DBSCAN dos pontos que não pertencem a nenhum cluster
+
+
+class KMeansResult:
+    def __init__(self, labels, centroids, iterations, converged):
+        self.labels = labels  # Índice do cluster de cada ponto
+        self.centroids = centroids  # Vetores unitários (k, 3)
+        self.iterations = iterations
+        self.converged = converged
+
+
+def assign(vectors, centroids, out_labels=None, out_similarity=None):
+    """Centróide mais próximo de cada ponto (maior produto escalar = menor corda).
+
+    Processa os pontos por blocos para limitar a matriz pontos x centróides
+    em memória. Retorna (labels, similaridades).
+    """
+    n = len(vectors)
+    labels = np.empty(n, dtype=np.int64) if out_labels is None else out_labels
+    similarity = np.empty(n, dtype=np.float64) if out_similarity is None else out_similarity
+    block = max(1, ASSIGN_BLOCK_ELEMENTS // max(len(centroids), 1))
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        dots = vectors[start:end] @ centroids.T
+        labels[start:end] = np.argmax(dots, axis=1)
+        similarity[start:end] = dots[np.arange(end - start), labels[start:end]]
+    return labels, similarity
+
+
+def _normalize(sums):
+    norms = np.linalg.norm(sums, axis=1)
+    valid = norms > 1e-12
+    sums[valid] /= norms[valid, None]
+    return sums, valid
+
+
+def kmeans_plus_plus(vectors, k, rng):
+    """Sementes k-means++: cada novo centro é escolhido com probabilidade ∝ D².
+
+    D² é o quadrado da corda ao centro mais próximo já escolhido (2 - 2·cos),
+    atualizado incrementalmente, pelo que o custo total é O(n·k).
+    """
+    n = len(vectors)
+    centers = np.empty(k, dtype=np.int64)
+    centers[0] = rng.integers(n)
+    closest_sq = np.maximum(2.0 - 2.0 * (vectors @ vectors[centers[0]]), 0.0)
+    for i in range(1, k):
+        total = closest_sq.sum()
+        if total <= 0:
+            # Menos pontos distintos que k: os restantes centros são sorteados
+            centers[i] = rng.integers(n)
+        else:
+            centers[i] = min(int(np.searchsorted(np.cumsum(closest_sq), rng.random() * total)), n - 1)
+        np.minimum(closest_sq, np.maximum(2.0 - 2.0 * (vectors @ vectors[centers[i]]), 0.0), out=closest_sq)
+    return vectors[centers].copy()
+
+
+def _initial_centroids(vectors, k, init, rng, sample_size=None):
+    if sample_size is not None and sample_size < len(vectors):
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    if init == 'k-means++':
+        return kmeans_plus_plus(vectors, k, rng)
+    return vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+
+def spherical_kmeans(vectors, k, init='k-means++', tol=DEFAULT_TOL_KM,
+                     max_iterations=DEFAULT_MAX_ITERATIONS, batch_size=None, seed=None, callback=None):
+    """K-means sobre vetores unitários 3D (centróides esféricos corretos).
+
+    O centróide de um cluster é a soma normalizada dos seus vetores, o que
+    funciona através do antimeridiano e perto dos polos. Cada iteração de
+    Lloyd é totalmente vetorizada (atribuição por produto matricial e
+    atualização por bincount). Com `batch_size` usa a variante mini-batch,
+    em que cada passo vê apenas uma amostra e os centróides avançam com taxa
+    1/contagem, adequada a milhões de pontos. `callback(iteração, máximo)`,
+    se indicado, é chamado no fim de cada iteração.
+    """
+    if init not in KMEANS_INITS:
+        raise ValueError(f"init inválido. Use um de: {', '.join(KMEANS_INITS)}")
+    vectors = np.ascontiguousarray(vectors, dtype=np.float64)
+    n = len(vectors)
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    tol_chord = float(km_to_chord(tol))
+
+    if batch_size is not None and batch_size < n:
+        return _minibatch_kmeans(vectors, k, init, tol_chord, max_iterations, batch_size, rng, callback)
+
+    centroids = _initial_centroids(vectors, k, init, rng)
+    labels = np.empty(n, dtype=np.int64)
+    similarity = np.empty(n, dtype=np.float64)
+    converged = False
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        assign(vectors, centroids, labels, similarity)
+
+        sums = np.empty((k, 3))
+        for axis in range(3):
+            sums[:, axis] = np.bincount(labels, weights=vectors[:, axis], minlength=k)
+        new_centroids, valid = _normalize(sums)
+
+        # Clusters vazios recebem os pontos mais afastados do seu centróide
+        empty = np.flatnonzero(~valid)
+        if len(empty):
+            farthest = np.argpartition(similarity, len(empty) - 1)[:len(empty)]
+            new_centroids[empty] = vectors[farthest]
+
+        shift = np.linalg.norm(new_centroids - centroids, axis=1).max()
+        centroids = new_centroids
+        if callback is not None:
+            callback(iteration, max_iterations)
+        if shift <= tol_chord:
+            converged = True
+            break
+
+    assign(vectors, centroids, labels, similarity)
+    return KMeansResult(labels, centroids, iteration, converged)
+
+
+def _minibatch_kmeans(vectors, k, init, tol_chord, max_iterations, batch_size, rng, callback=None):
+    n = len(vectors)
+    centroids = _initial_centroids(vectors, k, init, rng, sample_size=max(3 * batch_size, 10 * k))
+    counts = np.zeros(k)
+    converged = False
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        batch = vectors[rng.integers(n, size=batch_size)]
+        labels, _ = assign(batch, centroids)
+
+        batch_counts = np.bincount(labels, minlength=k).astype(np.float64)
+        sums = np.empty((k, 3))
+        for axis in range(3):
+            sums[:, axis] = np.bincount(labels, weights=batch[:, axis], minlength=k)
+        # Média incremental: c <- (c·n_c + Σx) / (n_c + m_c), depois projetada na esfera
+        counts += batch_counts
+        touched = batch_counts > 0
+        updated = centroids.copy()
+        updated[touched] += (sums[touched] - batch_counts[touched, None] * centroids[touched]) / counts[touched, None]
+        updated, _ = _normalize(updated)
+
+        shift = np.linalg.norm(updated - centroids, axis=1).max()
+        centroids = updated
+        if callback is not None:
+            callback(iteration, max_iterations)
+        if shift <= tol_chord:
+            converged = True
+            break
+
+    labels, _ = assign(vectors, centroids)
+    return KMeansResult(labels, centroids, iteration, converged)
+
+
+class DBSCANResult:
+    def __init__(self, labels, core):
+        self.labels = labels  # Índice do cluster de cada ponto (NOISE para ruído)
+        self.core = core  # Máscara dos pontos núcleo
+        self.num_clusters = int(labels.max()) + 1 if len(labels) else 0
+
+
+def _squared_chords(vectors, members, candidates):
+    # Cordas² (membros x candidatos) em blocos de membros, para limitar o array
+    # de diferenças a ~KNN_BLOCK_PAIRS x 3; produz (início do bloco, cordas²)
+    block = max(1, KNN_BLOCK_PAIRS // max(len(candidates), 1))
+    for start in range(0, len(members), block):
+        diff = vectors[members[start:start + block]][:, None, :] - vectors[candidates][None, :, :]
+        yield start, np.einsum('ijk,ijk->ij', diff, diff)
+
+
+def dbscan(vectors, eps_km, min_samples):
+    """DBSCAN sobre vetores unitários 3D, com a vizinhança-eps respondida por uma grelha.
+
+    A grelha (UnitVectorGrid) usa células de lado eps/√3, pelo que dois
+    pontos da mesma célula estão sempre a menos de eps e os vizinhos-eps de
+    um ponto estão nas 5³ células à sua volta. Daí: uma célula com pelo menos
+    `min_samples` pontos é toda de núcleos, só as células esparsas precisam
+    de contar vizinhos, e os núcleos de uma célula pertencem todos ao mesmo
+    cluster, pelo que os clusters são componentes de uma union-find sobre
+    células. Cada ponto só é comparado com as células vizinhas: ~O(n log n)
+    para densidades moderadas em vez dos O(n²) pares da força bruta.
+
+    `min_samples` conta o próprio ponto (como no scikit-learn). Os pontos de
+    fronteira ficam no cluster do núcleo mais próximo; os restantes são
+    ruído (NOISE).
+    """
+    if not eps_km >= MIN_EPS_KM:
+        raise ValueError(f"eps_km deve ser pelo menos {MIN_EPS_KM}")
+    if min_samples < 1:
+        raise ValueError("min_samples deve ser positivo")
+    vectors = np.ascontiguousarray(vectors, dtype=np.float64)
+    n = len(vectors)
+    labels = np.full(n, NOISE, dtype=np.int64)
+    core = np.zeros(n, dtype=bool)
+    if n == 0:
+        return DBSCANResult(labels, core)
+
+    eps = float(km_to_chord(eps_km))
+    eps_sq = eps * eps
+    grid = UnitVectorGrid(vectors, eps / np.sqrt(3.0))
+    neighbor_positions, neighbor_exists = grid.neighbor_cells(rings=2)
+    counts = grid.cell_sizes()
+    neighbor_counts = np.where(neighbor_exists, counts[neighbor_positions], 0).sum(axis=1)
+
+    def around(position, mask=None):
+        candidates = grid.members_of(neighbor_positions[position][neighbor_exists[position]])
+        return candidates if mask is None else candidates[mask[candidates]]
+
+    # 1. Núcleos: células densas diretamente; nas esparsas conta-se a vizinhança-eps
+    for position in np.flatnonzero(neighbor_counts >= min_samples).tolist():
+        members = grid.members_at(position)
+        if counts[position] >= min_samples:
+            core[members] = True
+            continue
+        candidates = around(position)
+        for start, squared in _squared_chords(vectors, members, candidates):
+            core[members[start:start + len(squared)]] = np.count_nonzero(squared <= eps_sq, axis=1) >= min_samples
+
+    # 2. Clusters: union-find sobre as células com núcleos; duas células ligam-se se
+    # algum par de núcleos estiver a menos de eps
+    cell_of = np.searchsorted(grid.cell_keys, grid.point_keys)
+    parent = list(range(len(grid.cell_keys)))
+
+    def find(cell):
+        root = cell
+        while parent[root] != root:
+            root = parent[root]
+        while parent[cell] != root:
+            parent[cell], cell = root, parent[cell]
+        return root
+
+    def other_components(candidates, root):
+        # Candidatos cujas células ainda não estão na componente `root`
+        cells, inverse = np.unique(cell_of[candidates], return_inverse=True)
+        keep = np.array([find(cell) != root for cell in cells.tolist()], dtype=bool)
+        return candidates[keep[inverse]]
+
+    core_cells = np.unique(cell_of[core])
+    for position in core_cells.tolist():
+        members = grid.members_at(position)
+        members = members[core[members]]
+        candidates = around(position, core)
+        # Só interessam núcleos de células seguintes que ainda estejam noutra componente
+        root = find(position)
+        candidates = other_components(candidates[cell_of[candidates] > position], root)
+        while len(candidates):
+            linked = None
+            for _, squared in _squared_chords(vectors, members, candidates):
+                hits = (squared <= eps_sq).any(axis=0)
+                if hits.any():
+                    linked = candidates[hits]
+                    break
+            if linked is None:
+                break
+            for cell in np.unique(cell_of[linked]).tolist():
+                parent[find(cell)] = root
+            candidates = other_components(candidates, root)
+
+    # Clusters numerados pela ordem do primeiro núcleo (por índice) de cada um
+    roots = np.array([find(cell) for cell in range(len(parent))], dtype=np.int64)
+    core_roots = roots[cell_of[core]]
+    unique_roots, first = np.unique(core_roots, return_index=True)
+    cluster_of_root = np.full(len(parent), NOISE, dtype=np.int64)
+    cluster_of_root[unique_roots[np.argsort(first)]] = np.arange(len(unique_roots))
+    labels[core] = cluster_of_root[core_roots]
+
+    # 3. Fronteira: pontos não núcleo com um núcleo a menos de eps ficam no cluster do mais próximo
+    for position in np.unique(cell_of[~core]).tolist():
+        members = grid.members_at(position)
+        members = members[~core[members]]
+        candidates = around(position, core)
+        if len(candidates) == 0:
+            continue
+        for start, squared in _squared_chords(vectors, members, candidates):
+            block = members[start:start + len(squared)]
+            nearest = np.argmin(squared, axis=1)
+            border = squared[np.arange(len(block)), nearest] <= eps_sq
+            labels[block[border]] = labels[candidates[nearest[border]]]
+
+    return DBSCANResult(labels, core)
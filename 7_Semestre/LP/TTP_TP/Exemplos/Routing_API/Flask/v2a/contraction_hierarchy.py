@@ -0,0 +1,388 @@
+import heapq
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from data_version import current_version
+from road_graph import RoadGraph
+
+WITNESS_SETTLE_LIMIT = 500  # Nós fixados no máximo por busca de testemunhas ao contrair
+WITNESS_SIMULATION_LIMIT = 16  # Idem ao estimar a prioridade de um nó
+HIERARCHY_SUFFIX = '.ch.npz'  # Ficheiro gravado ao lado da base (routing_system.ch.npz)
+
+
+class HierarchyUnavailable(Exception):
+    pass
+
+
+def hierarchy_path(db_name):
+    return os.path.splitext(os.path.abspath(db_name))[0] + HIERARCHY_SUFFIX
+
+
+class _Contractor:
+    # Contração de um grafo dirigido: out_edges[v] / in_edges[v] = {vizinho: (peso, nó do meio)}
+    # guardam só as arestas entre nós ainda não contraídos (incluindo atalhos)
+    def __init__(self, graph):
+        n = len(graph)
+        self.n = n
+        self.out_edges = [{} for _ in range(n)]
+        self.in_edges = [{} for _ in range(n)]
+        for u in range(n):
+            for v, weight in graph.neighbors(u):
+                if u != v and weight < self.out_edges[u].get(v, (math.inf,))[0]:
+                    self.out_edges[u][v] = (weight, -1)
+                    self.in_edges[v][u] = (weight, -1)
+        self.contracted = [False] * n
+        self.deleted_neighbors = [0] * n
+        self.shortcuts_added = 0
+
+    def _witness_distances(self, source, excluded, targets, limit, max_settled):
+        # Dijkstra limitado a partir de `source` no grafo restante, sem passar por `excluded`;
+        # pára quando todos os `targets` estão fixados ou a distância passa de `limit`
+        out_edges = self.out_edges
+        distances = {source: 0.0}
+        get = distances.get
+        heap = [(0.0, source)]
+        pop, push = heapq.heappop, heapq.heappush
+        remaining = len(targets)
+        settled = 0
+        while heap and settled < max_settled:
+            distance, node = pop(heap)
+            if distance > get(node, math.inf):
+                continue
+            if distance > limit:
+                break
+            settled += 1
+            if node in targets:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            for neighbor, (weight, _) in out_edges[node].items():
+                candidate = distance + weight
+                if candidate < get(neighbor, math.inf) and neighbor != excluded:
+                    distances[neighbor] = candidate
+                    push(heap, (candidate, neighbor))
+        return distances
+
+    def _shortcuts(self, node, max_settled=WITNESS_SETTLE_LIMIT):
+        # Atalhos u -> w (via node) sem caminho testemunha mais curto que evite node
+        shortcuts = []
+        outgoing = self.out_edges[node]
+        if not outgoing:
+            return shortcuts
+        max_out = max(weight for weight, _ in outgoing.values())
+        for u, (weight_in, _) in self.in_edges[node].items():
+            targets = outgoing.keys() - {u}
+            if not targets:
+                continue
+            witness = self._witness_distances(u, node, targets, weight_in + max_out, max_settled)
+            for w in targets:
+                via = weight_in + outgoing[w][0]
+                if witness.get(w, math.inf) > via:
+                    shortcuts.append((u, w, via))
+        return shortcuts
+
+    def priority(self, node):
+        # Diferença de arestas (atalhos criados - arestas removidas) + vizinhos já contraídos
+        removed = len(self.out_edges[node]) + len(self.in_edges[node])
+        # Simulação com buscas de testemunhas mais curtas: só a ordem relativa importa
+        shortcuts = self._shortcuts(node, WITNESS_SIMULATION_LIMIT)
+        return len(shortcuts) - removed + self.deleted_neighbors[node]
+
+    def contract(self, node):
+        """Contrai `node`; retorna os vizinhos afetados (cuja prioridade mudou)."""
+        for u, w, via in self._shortcuts(node):
+            if via < self.out_edges[u].get(w, (math.inf,))[0]:
+                self.out_edges[u][w] = (via, node)
+                self.in_edges[w][u] = (via, node)
+                self.shortcuts_added += 1
+        self.contracted[node] = True
+        neighbors = set(self.out_edges[node]) | set(self.in_edges[node])
+        for w in self.out_edges[node]:
+            del self.in_edges[w][node]
+        for u in self.in_edges[node]:
+            del self.out_edges[u][node]
+        for neighbor in neighbors:
+            self.deleted_neighbors[neighbor] += 1
+        return neighbors
+
+    def run(self):
+        """Contrai todos os nós; retorna (rank, arestas para cima, arestas para baixo).
+
+        As arestas de cada nó, no momento em que é contraído, ligam-no apenas a
+        nós de rank superior: as de saída formam o grafo da busca para a frente,
+        as de entrada (invertidas) o da busca para trás.
+        """
+        priorities = [self.priority(node) for node in range(self.n)]
+        heap = [(priority, node) for node, priority in enumerate(priorities)]
+        heapq.heapify(heap)
+        rank = np.empty(self.n, dtype=np.int64)
+        upward, downward = [], []
+        order = 0
+        while heap:
+            priority, node = heapq.heappop(heap)
+            if self.contracted[node] or priority != priorities[node]:
+                continue  # Entrada obsoleta
+            # Atualização preguiçosa: recalcula e devolve ao heap se deixou de ser o mínimo
+            priority = priorities[node] = self.priority(node)
+            if heap and priority > heap[0][0]:
+                heapq.heappush(heap, (priority, node))
+                continue
+            rank[node] = order
+            order += 1
+            upward.extend((node, w, weight, middle) for w, (weight, middle) in self.out_edges[node].items())
+            downward.extend((node, u, weight, middle) for u, (weight, middle) in self.in_edges[node].items())
+            # Os vizinhos ganharam atalhos e perderam uma aresta: a prioridade deles mudou
+            for neighbor in self.contract(node):
+                priorities[neighbor] = self.priority(neighbor)
+                heapq.heappush(heap, (priorities[neighbor], neighbor))
+        return rank, upward, downward
+
+
+def _edges_to_csr(edges, n):
+    # (nó, vizinho, peso, meio) -> CSR indexado pelo nó
+    if not edges:
+        return (np.zeros(n + 1, dtype=np.int64), np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64))
+    nodes, neighbors, weights, middles = (np.array(column) for column in zip(*edges))
+    order = np.argsort(nodes, kind='stable')
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(nodes, minlength=n), out=offsets[1:])
+    return (offsets, neighbors[order].astype(np.int64), weights[order].astype(np.float64),
+            middles[order].astype(np.int64))
+
+
+class ContractionHierarchy:
+    """Hierarquia de contração do grafo de estradas, para consultas ponto a ponto.
+
+    O pré-processamento (`build`, offline) contrai os nós por ordem de
+    importância e acrescenta atalhos que preservam as distâncias; o resultado
+    é gravado em `<base>.ch.npz` com a versão dos dados usada. Cada consulta é
+    um Dijkstra bidirecional que só sobe na hierarquia (com stall-on-demand),
+    e fixa tipicamente algumas centenas de nós em vez de uma fração do grafo.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.path = hierarchy_path(db_name)
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._conn = None
+        self.version = None
+
+    @classmethod
+    def for_db(cls, db_name):
+        key = os.path.abspath(db_name)
+        with cls._instances_lock:
+            hierarchy = cls._instances.get(key)
+            if hierarchy is None:
+                hierarchy = cls(key)
+                cls._instances[key] = hierarchy
+            return hierarchy
+
+    def _data_version(self):
+        # Ligação própria e persistente: a verificação corre em cada consulta
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.db_name, check_same_thread=False)
+            try:
+                return current_version(self._conn.cursor())
+            except sqlite3.OperationalError:
+                return 0  # Tabela data_version ainda não criada
+
+    @classmethod
+    def build(cls, db_name):
+        """Pré-processa o grafo de `db_name` e grava a hierarquia. Retorna as estatísticas."""
+        graph = RoadGraph.for_db(db_name).ensure_loaded()
+        hierarchy = cls.for_db(db_name)
+        version = hierarchy._data_version()
+        started = time.perf_counter()
+        contractor = _Contractor(graph)
+        rank, upward, downward = contractor.run()
+        n = len(graph)
+        up = _edges_to_csr(upward, n)
+        down = _edges_to_csr(downward, n)
+        np.savez(hierarchy.path, version=np.int64(version), node_ids=graph.node_ids, rank=rank,
+                 up_offsets=up[0], up_targets=up[1], up_weights=up[2], up_middles=up[3],
+                 down_offsets=down[0], down_sources=down[1], down_weights=down[2], down_middles=down[3])
+        with hierarchy._lock:
+            hierarchy._loaded_mtime = None
+        return {
+            'nodes': n,
+            'edges': graph.num_edges,
+            'shortcuts': contractor.shortcuts_added,
+            'seconds': time.perf_counter() - started,
+        }
+
+    @staticmethod
+    def _adjacency(offsets, neighbors, weights):
+        pairs = list(zip(neighbors.tolist(), weights.tolist()))
+        offsets = offsets.tolist()
+        return [pairs[offsets[node]:offsets[node + 1]] for node in range(len(offsets) - 1)]
+
+    def _load(self):
+        with np.load(self.path) as data:
+            self.version = int(data['version'])
+            self.node_ids = data['node_ids']
+            self._index = {int(city_id): i for i, city_id in enumerate(self.node_ids)}
+            # Listas de adjacência (vizinho, peso) por nó: mais rápidas de percorrer que o CSR
+            self._up = self._adjacency(data['up_offsets'], data['up_targets'], data['up_weights'])
+            self._down = self._adjacency(data['down_offsets'], data['down_sources'], data['down_weights'])
+            # Nó do meio de cada atalho, para desdobrar o caminho no fim da consulta
+            self._middles = {}
+            for prefix, other in (('up', 'targets'), ('down', 'sources')):
+                offsets, neighbors, middles = (data[f'{prefix}_{name}'] for name in ('offsets', other, 'middles'))
+                nodes = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+                shortcut = middles >= 0
+                for node, neighbor, middle in zip(nodes[shortcut].tolist(), neighbors[shortcut].tolist(),
+                                                  middles[shortcut].tolist()):
+                    key = (node, neighbor) if prefix == 'up' else (neighbor, node)
+                    self._middles[key] = middle
+
+    def ensure_loaded(self):
+        """Carrega a hierarquia se estiver atualizada; lança HierarchyUnavailable se não existir ou estiver obsoleta."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            raise HierarchyUnavailable(f"Hierarquia de contração inexistente: execute 'python contraction_hierarchy.py --db {self.db_name}'")
+        with self._lock:
+            if self._loaded_mtime != mtime:
+                self._load()
+                self._loaded_mtime = mtime
+        if self.version != self._data_version():
+            raise HierarchyUnavailable("Hierarquia de contração desatualizada (cities/edges mudaram): volte a executar o pré-processamento")
+        return self
+
+    def _unpack(self, u, v, path):
+        # Acrescenta a `path` os nós de u -> v (sem u), desdobrando atalhos recursivamente
+        stack = [(u, v)]
+        while stack:
+            a, b = stack.pop()
+            middle = self._middles.get((a, b))
+            if middle is None:
+                path.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+
+    def query(self, start_city_id, end_city_id):
+        """Retorna (caminho em ids de cidade, distância, nós fixados)."""
+        start = self._index.get(start_city_id)
+        end = self._index.get(end_city_id)
+        if start is None or end is None:
+            return [], math.inf, 0
+        if start == end:
+            return [start_city_id], 0.0, 1
+
+        # Lado 0 sobe pelas arestas de saída; lado 1 sobe pelas de entrada (a partir do destino)
+        searches = (
+            {'dist': {start: 0.0}, 'prev': {start: None}, 'heap': [(0.0, start)], 'edges': self._up, 'stall': self._down},
+            {'dist': {end: 0.0}, 'prev': {end: None}, 'heap': [(0.0, end)], 'edges': self._down, 'stall': self._up},
+        )
+        best = math.inf
+        meeting = None
+        settled = 0
+        side = 0
+        while searches[0]['heap'] or searches[1]['heap']:
+            # Alterna os lados; um lado pára quando o seu mínimo já não pode melhorar `best`
+            if not searches[side]['heap'] or searches[side]['heap'][0][0] >= best:
+                side = 1 - side
+                if not searches[side]['heap'] or searches[side]['heap'][0][0] >= best:
+                    break
+            this, other = searches[side], searches[1 - side]
+            distance, node = heapq.heappop(this['heap'])
+            side = 1 - side
+            if distance > this['dist'][node]:
+                continue
+            settled += 1
+            if node in other['dist'] and distance + other['dist'][node] < best:
+                best = distance + other['dist'][node]
+                meeting = node
+
+            # Stall-on-demand: um vizinho de rank superior chega a `node` mais barato
+            dist = this['dist']
+            get = dist.get
+            if any(get(neighbor, math.inf) + weight < distance for neighbor, weight in this['stall'][node]):
+                continue
+
+            for neighbor, weight in this['edges'][node]:
+                candidate = distance + weight
+                if candidate < get(neighbor, math.inf):
+                    dist[neighbor] = candidate
+                    this['prev'][neighbor] = node
+                    heapq.heappush(this['heap'], (candidate, neighbor))
+
+        if meeting is None:
+            return [], math.inf, settled
+
+        upward = []
+        node = meeting
+        while node is not None:
+            upward.append(node)
+            node = searches[0]['prev'][node]
+        upward.reverse()
+        path = [upward[0]]
+        for a, b in zip(upward, upward[1:]):
+            self._unpack(a, b, path)
+        node = meeting
+        previous = searches[1]['prev'][node]
+        while previous is not None:
+            self._unpack(node, previous, path)
+            node, previous = previous, searches[1]['prev'][previous]
+        return [int(self.node_ids[i]) for i in path], best, settled
+
+
+def benchmark(db_name, queries=200, seed=0):
+    """Compara a latência média da hierarquia com Dijkstra, A* e A* bidirecional."""
+    from routing_algorithms import RoutingAlgorithms
+
+    router = RoutingAlgorithms(db_name=db_name)
+    graph = router.road_graph.ensure_loaded()
+    hierarchy = ContractionHierarchy.for_db(db_name).ensure_loaded()
+    rng = np.random.default_rng(seed)
+    pairs = [(int(a), int(b)) for a, b in rng.choice(graph.node_ids, size=(queries, 2))]
+
+    results = {}
+    reference = None
+    for algorithm in ('dijkstra', 'astar', 'bidirectional_astar', 'ch'):
+        distances, settled_total = [], 0
+        started = time.perf_counter()
+        for start_id, end_id in pairs:
+            _, distance, settled = router.shortest_path(start_id, end_id, algorithm)
+            distances.append(distance)
+            settled_total += settled
+        elapsed = time.perf_counter() - started
+        if reference is None:
+            reference = distances
+        mismatches = sum(1 for a, b in zip(distances, reference) if not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9))
+        results[algorithm] = {
+            'ms_per_query': 1000.0 * elapsed / queries,
+            'settled_per_query': settled_total / queries,
+            'mismatches': mismatches,
+        }
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pré-processa o grafo de estradas numa hierarquia de contração.")
+    parser.add_argument('--db', default='routing_system.db')
+    parser.add_argument('--benchmark', type=int, metavar='N', default=0,
+                        help="Depois de construir, compara N consultas aleatórias com Dijkstra/A*")
+    args = parser.parse_args()
+
+    stats = ContractionHierarchy.build(args.db)
+    print(f"Hierarquia gravada em {hierarchy_path(args.db)}: {stats['nodes']} nós, {stats['edges']} arestas, "
+          f"{stats['shortcuts']} atalhos em {stats['seconds']:.1f} s.")
+    if args.benchmark:
+        for algorithm, result in benchmark(args.db, args.benchmark).items():
+            print(f"  {algorithm:<20} {result['ms_per_query']:8.3f} ms/consulta  "
+                  f"{result['settled_per_query']:9.1f} nós fixados  {result['mismatches']} diferenças")
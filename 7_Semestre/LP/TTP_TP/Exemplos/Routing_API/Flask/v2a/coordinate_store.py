@@ -0,0 +1,169 @@
+import os
+import threading
+
+import numpy as np
+
+from db_pool import ConnectionPool
+from distance_engine import PointSet
+
+
+class CoordinateStore:
+    """Cache em memória das coordenadas da tabela `cities`.
+
+    A tabela é carregada uma única vez para arrays NumPy contíguos
+    (id -> índice da linha), partilhados por todo o processo. Existe uma
+    instância por ficheiro de base de dados, obtida com `for_db`.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._coords = np.empty((0, 2), dtype=np.float64)
+        self._index = {}
+        self._points = {}
+        self.generation = 0  # Incrementado sempre que o conteúdo muda
+
+    @classmethod
+    def for_db(cls, db_name):
+        key = os.path.abspath(db_name)
+        with cls._instances_lock:
+            store = cls._instances.get(key)
+            if store is None:
+                store = cls(key)
+                cls._instances[key] = store
+            return store
+
+    def load(self):
+        with ConnectionPool.for_db(self.db_name).connection() as conn:
+            rows = conn.execute("SELECT id, latitude, longitude FROM cities ORDER BY id").fetchall()
+
+        with self._lock:
+            self._size = len(rows)
+            capacity = max(self._size, 16)
+            self._ids = np.zeros(capacity, dtype=np.int64)
+            self._coords = np.zeros((capacity, 2), dtype=np.float64)
+            if rows:
+                data = np.asarray(rows, dtype=np.float64)
+                self._ids[:self._size] = data[:, 0].astype(np.int64)
+                self._coords[:self._size] = data[:, 1:3]
+            self._index = {int(city_id): i for i, city_id in enumerate(self._ids[:self._size])}
+            self._points = {}
+            self.generation += 1
+            self._loaded = True
+
+    def adopt(self, ids, coords):
+        """Usa arrays já existentes (por exemplo em memória partilhada) sem ler a tabela."""
+        with self._lock:
+            self._size = len(ids)
+            self._ids = ids
+            self._coords = coords
+            self._index = {int(city_id): i for i, city_id in enumerate(ids.tolist())}
+            self._points = {}
+            self.generation += 1
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    def invalidate(self):
+        # A próxima leitura volta a carregar a tabela inteira
+        with self._lock:
+            self._loaded = False
+            self._index = {}
+            self._points = {}
+            self._size = 0
+
+    def append(self, city_id, latitude, longitude):
+        with self._lock:
+            # Se ainda não foi carregado, a cidade virá com o próximo load()
+            if not self._loaded:
+                return
+            self._points = {}
+            self.generation += 1
+            if city_id in self._index:
+                self._coords[self._index[city_id]] = (latitude, longitude)
+                return
+            if self._size == len(self._ids):
+                capacity = max(16, 2 * len(self._ids))
+                self._ids = np.resize(self._ids, capacity)
+                self._coords = np.resize(self._coords, (capacity, 2))
+            self._ids[self._size] = city_id
+            self._coords[self._size] = (latitude, longitude)
+            self._index[city_id] = self._size
+            self._size += 1
+
+    def __len__(self):
+        self._ensure_loaded()
+        return self._size
+
+    def __contains__(self, city_id):
+        self._ensure_loaded()
+        return city_id in self._index
+
+    @property
+    def ids(self):
+        self._ensure_loaded()
+        return self._ids[:self._size]
+
+    @property
+    def latitudes(self):
+        self._ensure_loaded()
+        return self._coords[:self._size, 0]
+
+    @property
+    def longitudes(self):
+        self._ensure_loaded()
+        return self._coords[:self._size, 1]
+
+    def get(self, city_id):
+        """Retorna (latitude, longitude) da cidade, ou None se não existir."""
+        self._ensure_loaded()
+        row = self._index.get(city_id)
+        if row is None:
+            return None
+        lat, lon = self._coords[row]
+        return float(lat), float(lon)
+
+    def indices_for(self, city_ids):
+        """Converte ids de cidade em índices de linha.
+
+        Lança KeyError com o primeiro id desconhecido.
+        """
+        self._ensure_loaded()
+        index = self._index
+        rows = np.empty(len(city_ids), dtype=np.int64)
+        for i, city_id in enumerate(city_ids):
+            row = index.get(city_id)
+            if row is None:
+                raise KeyError(city_id)
+            rows[i] = row
+        return rows
+
+    def coordinates_for(self, city_ids):
+        """Retorna um array (n, 2) com latitude/longitude pela ordem de `city_ids`."""
+        rows = self.indices_for(city_ids)
+        return self._coords[rows]
+
+    def points(self, dtype=np.float64):
+        """PointSet (radianos pré-calculados) de todas as cidades, pela ordem de `ids`."""
+        self._ensure_loaded()
+        key = np.dtype(dtype).str
+        with self._lock:
+            points = self._points.get(key)
+            if points is None:
+                points = PointSet.from_degrees(self._coords[:self._size, 0], self._coords[:self._size, 1], dtype)
+                self._points[key] = points
+            return points
+
+    def points_for(self, city_ids, dtype=np.float64):
+        """PointSet das cidades indicadas, pela ordem de `city_ids`."""
+        return self.points(dtype).take(self.indices_for(city_ids))
@@ -0,0 +1,83 @@
+TRACKED_TABLES = ('cities', 'edges')  # Tabelas de que dependem os resultados de rotas
+
+# Colunas cujas alterações mudam resultados de rotas (UPDATE de cities.morton não conta)
+_TRACKED_UPDATES = {
+    'cities': 'name, latitude, longitude',
+    'edges': 'source_id, target_id, distance',
+}
+
+_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def _trigger_name(table, operation):
+    return f"trg_{table}_{operation}_version"
+
+
+def _create_trigger(cursor, table, operation):
+    event = f"UPDATE OF {_TRACKED_UPDATES[table]}" if operation == 'update' else operation.upper()
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {_trigger_name(table, operation)}
+        AFTER {event} ON {table}
+        BEGIN
+            UPDATE data_version SET version = version + 1, updated_at = {_NOW} WHERE name = '{table}';
+        END
+    """)
+
+
+def ensure_version_tracking(cursor, table):
+    """Cria a tabela data_version e os gatilhos que a incrementam quando `table` muda."""
+    # Caminho rápido só com leituras, para não pedir o lock de escrita em cada consulta
+    names = tuple(_trigger_name(table, operation) for operation in ('insert', 'update', 'delete'))
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? "
+                   "AND name IN (?, ?, ?) AND sql LIKE '%updated_at%'", (table, *names))
+    if cursor.fetchone()[0] == 3:
+        return
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at INTEGER
+        )
+    """)
+    # Bases criadas antes da coluna updated_at (gatilhos antigos são recriados abaixo)
+    cursor.execute("PRAGMA table_info(data_version)")
+    if 'updated_at' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE data_version ADD COLUMN updated_at INTEGER")
+    cursor.execute(f"INSERT OR IGNORE INTO data_version (name, version, updated_at) VALUES (?, 0, {_NOW})",
+                   (table,))
+    for name in names:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for operation in ('insert', 'update', 'delete'):
+        _create_trigger(cursor, table, operation)
+
+
+def current_version(cursor, tables=TRACKED_TABLES):
+    """Versão combinada de `tables`: muda sempre que alguma delas muda."""
+    cursor.execute(f"SELECT COALESCE(SUM(version), 0) FROM data_version WHERE name IN ({', '.join('?' * len(tables))})",
+                   tuple(tables))
+    return cursor.fetchone()[0]
+
+
+def version_info(cursor, table):
+    """(versão, instante da última alteração em segundos Unix) de uma tabela."""
+    cursor.execute("SELECT version, updated_at FROM data_version WHERE name = ?", (table,))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def bump_version(cursor, table):
+    cursor.execute(f"UPDATE data_version SET version = version + 1, updated_at = {_NOW} WHERE name = ?", (table,))
+
+
+def suspend_insert_trigger(cursor, table):
+    """Remove o gatilho de INSERT de `table` durante uma carga em massa.
+
+    Tem de ser chamado dentro de uma transação explícita; `resume_insert_trigger`
+    recria o gatilho e incrementa a versão uma única vez (em vez de uma vez por linha).
+    """
+    cursor.execute(f"DROP TRIGGER IF EXISTS {_trigger_name(table, 'insert')}")
+
+
+def resume_insert_trigger(cursor, table):
+    _create_trigger(cursor, table, 'insert')
+    bump_version(cursor, table)
@@ -0,0 +1,146 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+DEFAULT_POOL_SIZE = 8  # Ligações abertas no máximo por ficheiro de base de dados
+DEFAULT_ACQUIRE_TIMEOUT = 30.0  # Segundos à espera de uma ligação livre
+STATEMENT_CACHE_SIZE = 256  # Instruções preparadas guardadas por ligação
+
+# Uma única instrução preparada serve qualquer número de ids (lista JSON num só parâmetro)
+SELECT_CITIES_BY_IDS = """
+    SELECT id, name, latitude, longitude FROM cities
+    WHERE id IN (SELECT value FROM json_each(?))
+"""
+
+
+class ConnectionPool:
+    """Pool de ligações SQLite reutilizáveis, uma instância por ficheiro (`for_db`).
+
+    As ligações são abertas em modo WAL (leitores não bloqueiam o escritor) e
+    mantêm a cache de instruções preparadas do módulo sqlite3 entre pedidos,
+    pelo que cada pedido poupa a abertura do ficheiro e a compilação do SQL.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, db_name, max_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        self.db_name = db_name
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_db(cls, db_name):
+        key = os.path.abspath(db_name)
+        with cls._instances_lock:
+            pool = cls._instances.get(key)
+            if pool is None:
+                pool = cls(key)
+                cls._instances[key] = pool
+            return pool
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Conta cada instrução executada (exposto em /metrics)
+        conn.set_trace_callback(metrics.count_sql_statement)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.max_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Nenhuma ligação livre em {self.timeout} s ({self.max_size} em uso)")
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Ligação inutilizável: descarta-a e liberta o lugar no pool
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+@contextmanager
+def immediate_transaction(conn):
+    """Transação explícita BEGIN IMMEDIATE numa ligação (do pool ou não).
+
+    Desliga as transações implícitas do módulo sqlite3 enquanto dura: produz
+    um cursor, faz COMMIT no fim e ROLLBACK se o bloco falhar.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def fetch_cities(conn, city_ids):
+    """Dicionários das cidades `city_ids` numa só consulta, pela ordem pedida.
+
+    Ids repetidos (por exemplo, a cidade que fecha um tour) são repetidos no
+    resultado; ids inexistentes são ignorados.
+    """
+    unique_ids = list(dict.fromkeys(int(city_id) for city_id in city_ids))
+    if not unique_ids:
+        return []
+    with metrics.timed('sqlite'):
+        rows = conn.execute(SELECT_CITIES_BY_IDS, (json.dumps(unique_ids),)).fetchall()
+    by_id = {row[0]: {'id': row[0], 'name': row[1], 'latitude': row[2], 'longitude': row[3]} for row in rows}
+    return [by_id[city_id] for city_id in map(int, city_ids) if city_id in by_id]
@@ -0,0 +1,128 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0  # Raio da Terra em quilómetros
+DEFAULT_BLOCK_SIZE = 2048  # Linhas/colunas por bloco nas matrizes grandes
+
+
+class PointSet:
+    """Conjunto de pontos com as grandezas da fórmula de haversine pré-calculadas.
+
+    Guarda latitude/longitude em radianos e cos(latitude), de modo que cada
+    distância custa apenas dois senos. Os vetores unitários 3D são calculados
+    sob pedido (úteis para médias esféricas e vizinhanças por corda).
+    """
+
+    __slots__ = ('lat', 'lon', 'cos_lat', 'dtype', '_unit_vectors')
+
+    def __init__(self, lat_rad, lon_rad, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.lat = np.ascontiguousarray(lat_rad, dtype=self.dtype)
+        self.lon = np.ascontiguousarray(lon_rad, dtype=self.dtype)
+        self.cos_lat = np.cos(self.lat)
+        self._unit_vectors = None
+
+    @classmethod
+    def from_degrees(cls, latitudes, longitudes, dtype=np.float64):
+        return cls(np.radians(np.asarray(latitudes, dtype=np.float64)),
+                   np.radians(np.asarray(longitudes, dtype=np.float64)),
+                   dtype=dtype)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def take(self, indices):
+        subset = PointSet.__new__(PointSet)
+        subset.dtype = self.dtype
+        subset.lat = self.lat[indices]
+        subset.lon = self.lon[indices]
+        subset.cos_lat = self.cos_lat[indices]
+        subset._unit_vectors = None if self._unit_vectors is None else self._unit_vectors[indices]
+        return subset
+
+    def unit_vectors(self):
+        if self._unit_vectors is None:
+            self._unit_vectors = to_unit_vectors(self.lat, self.lon, self.dtype)
+        return self._unit_vectors
+
+
+def to_unit_vectors(lat_rad, lon_rad, dtype=np.float64):
+    lat_rad = np.asarray(lat_rad)
+    lon_rad = np.asarray(lon_rad)
+    cos_lat = np.cos(lat_rad)
+    vectors = np.empty(lat_rad.shape + (3,), dtype=dtype)
+    vectors[..., 0] = cos_lat * np.cos(lon_rad)
+    vectors[..., 1] = cos_lat * np.sin(lon_rad)
+    vectors[..., 2] = np.sin(lat_rad)
+    return vectors
+
+
+def unit_vectors_to_degrees(vectors):
+    vectors = np.asarray(vectors, dtype=np.float64)
+    lat = np.degrees(np.arctan2(vectors[..., 2], np.hypot(vectors[..., 0], vectors[..., 1])))
+    lon = np.degrees(np.arctan2(vectors[..., 1], vectors[..., 0]))
+    return lat, lon
+
+
+def _haversine_core(lat1, cos_lat1, lon1, lat2, cos_lat2, lon2):
+    # Versão broadcast da fórmula de haversine sobre valores já em radianos
+    sin_dlat = np.sin((lat2 - lat1) * 0.5)
+    sin_dlon = np.sin((lon2 - lon1) * 0.5)
+    a = sin_dlat * sin_dlat + cos_lat1 * cos_lat2 * (sin_dlon * sin_dlon)
+    return (2.0 * EARTH_RADIUS_KM) * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Distância de haversine (km) entre coordenadas em graus, com broadcast NumPy."""
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lon1, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lon2, dtype=np.float64))
+    return _haversine_core(lat1, np.cos(lat1), lon1, lat2, np.cos(lat2), lon2)
+
+
+def one_to_many(points, source, targets=None):
+    """Distâncias (km) do ponto `source` (índice em `points`) até todos os `targets`.
+
+    Se `targets` for omitido, usa o próprio `points`.
+    """
+    if targets is None:
+        targets = points
+    return _haversine_core(points.lat[source], points.cos_lat[source], points.lon[source],
+                           targets.lat, targets.cos_lat, targets.lon)
+
+
+def consecutive_distances(points):
+    """Distâncias (km) entre pontos consecutivos: points[i] -> points[i + 1]."""
+    return _haversine_core(points.lat[:-1], points.cos_lat[:-1], points.lon[:-1],
+                           points.lat[1:], points.cos_lat[1:], points.lon[1:])
+
+
+def iter_distance_tiles(rows, cols=None, block_size=DEFAULT_BLOCK_SIZE):
+    """Percorre a matriz de distâncias rows x cols em blocos.
+
+    Produz (row_slice, col_slice, tile); cada bloco ocupa no máximo
+    block_size² elementos, o que limita a memória para n grande.
+    """
+    if cols is None:
+        cols = rows
+    for r0 in range(0, len(rows), block_size):
+        r1 = min(r0 + block_size, len(rows))
+        lat1 = rows.lat[r0:r1, None]
+        cos1 = rows.cos_lat[r0:r1, None]
+        lon1 = rows.lon[r0:r1, None]
+        for c0 in range(0, len(cols), block_size):
+            c1 = min(c0 + block_size, len(cols))
+            tile = _haversine_core(lat1, cos1, lon1,
+                                   cols.lat[None, c0:c1], cols.cos_lat[None, c0:c1], cols.lon[None, c0:c1])
+            yield slice(r0, r1), slice(c0, c1), tile
+
+
+def distance_matrix(rows, cols=None, block_size=DEFAULT_BLOCK_SIZE, out=None):
+    """Matriz completa de distâncias (km) entre dois PointSet, calculada por blocos."""
+    if cols is None:
+        cols = rows
+    if out is None:
+        out = np.empty((len(rows), len(cols)), dtype=rows.dtype)
+    for row_slice, col_slice, tile in iter_distance_tiles(rows, cols, block_size):
+        out[row_slice, col_slice] = tile
+    return out
@@ -0,0 +1,285 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from coordinate_store import CoordinateStore
+from routing_algorithms import RoutingAlgorithms
+
+DEFAULT_MAX_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+DEFAULT_MAX_PENDING = 16  # Jobs à espera (além dos em execução) antes de recusar novos
+MAX_FINISHED_JOBS = 256  # Jobs terminados guardados para consulta
+JOB_KINDS = ('kmeans', 'tsp')
+PROGRESS_REPORT_INTERVAL = 0.2  # Segundos mínimos entre atualizações de progresso não forçadas
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# --- Lado dos processos de trabalho -------------------------------------------------
+
+_worker_progress = None
+_worker_cancel_flags = None
+_worker_segments = {}  # db_name -> (nome do segmento, SharedMemory)
+
+
+def _init_worker(progress_queue, cancel_flags):
+    global _worker_progress, _worker_cancel_flags
+    _worker_progress = progress_queue
+    _worker_cancel_flags = cancel_flags
+
+
+def _attach_coordinates(db_name, segment_name, size):
+    # As coordenadas chegam por memória partilhada: o processo não lê a tabela cities
+    current = _worker_segments.get(db_name)
+    if current is not None and current[0] == segment_name:
+        return
+    segment = shared_memory.SharedMemory(name=segment_name)
+    ids = np.ndarray((size,), dtype=np.int64, buffer=segment.buf)
+    coords = np.ndarray((size, 2), dtype=np.float64, buffer=segment.buf, offset=size * 8)
+    CoordinateStore.for_db(db_name).adopt(ids, coords)
+    if current is not None:
+        current[1].close()
+    _worker_segments[db_name] = (segment_name, segment)
+
+
+def _run_job(job_id, slot, kind, db_name, segment_name, size, args):
+    last_report = [0.0]
+
+    def report(progress, stage=None, force=True):
+        # O pedido de cancelamento é sempre verificado; o progresso só é enviado
+        # de PROGRESS_REPORT_INTERVAL em PROGRESS_REPORT_INTERVAL segundos (salvo `force`)
+        if _worker_cancel_flags[slot]:
+            raise JobCancelled(job_id)
+        now = time.perf_counter()
+        if force or now - last_report[0] >= PROGRESS_REPORT_INTERVAL:
+            last_report[0] = now
+            _worker_progress.put((job_id, progress, stage))
+
+    report(0.0, 'running')
+    _attach_coordinates(db_name, segment_name, size)
+    router = RoutingAlgorithms(db_name=db_name)
+
+    if kind == 'kmeans':
+        clusters = router.kmeans(progress=lambda iteration, total: report(iteration / total, 'kmeans'), **args)
+        return {'clusters': clusters}
+
+    tour, total_distance, details = router.tsp(
+        progress=lambda fraction, stage: report(fraction, stage, force=False), **args)
+    report(1.0, 'tsp')
+    return {'tour': tour, 'total_distance': total_distance, 'details': details}
+
+
+# --- Lado do servidor ----------------------------------------------------------------
+
+class Job:
+    def __init__(self, kind, slot):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.slot = slot
+        self.status = 'queued'  # queued, running, cancelling, done, failed, cancelled
+        self.progress = 0.0
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.segment = None
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'stage': self.stage,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class _Segment:
+    # Cópia das coordenadas de uma base em memória partilhada (ids int64 + lat/lon float64)
+    def __init__(self, store):
+        ids = store.ids
+        size = len(ids)
+        self.generation = store.generation
+        self.size = size
+        self.refs = 0
+        self.retired = False
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size * 24, 1))
+        np.ndarray((size,), dtype=np.int64, buffer=self.shm.buf)[:] = ids
+        coords = np.ndarray((size, 2), dtype=np.float64, buffer=self.shm.buf, offset=size * 8)
+        coords[:, 0] = store.latitudes
+        coords[:, 1] = store.longitudes
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class JobQueue:
+    """Fila de jobs longos (kmeans, tsp) executados num pool de processos.
+
+    Os cálculos correm fora do GIL do servidor. As coordenadas de cada base
+    são publicadas uma vez em memória partilhada e reutilizadas por todos os
+    jobs até a tabela mudar. A fila é limitada: com todos os lugares ocupados
+    `submit` lança QueueFull (o cliente deve tentar mais tarde). Jobs ainda em
+    fila são cancelados de imediato; os que já correm param no próximo ponto
+    de progresso.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+        # 'spawn': o servidor tem várias threads, e fork copiaria locks em estado indefinido
+        context = multiprocessing.get_context('spawn')
+        self.capacity = max_workers + max_pending
+        self._progress = context.Queue()
+        self._cancel_flags = context.Array('b', self.capacity, lock=False)
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                             initializer=_init_worker,
+                                             initargs=(self._progress, self._cancel_flags))
+        self._lock = threading.Lock()
+        self._free_slots = list(range(self.capacity))
+        self._jobs = OrderedDict()
+        self._segments = {}
+        self._closed = False
+        threading.Thread(target=self._drain_progress, daemon=True).start()
+        atexit.register(self.shutdown)
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def _segment_for(self, db_name):
+        store = CoordinateStore.for_db(db_name)
+        len(store)  # Garante o carregamento antes de ler a geração
+        current = self._segments.get(db_name)
+        if current is not None and current.generation == store.generation:
+            return current
+        segment = _Segment(store)
+        self._segments[db_name] = segment
+        if current is not None:
+            current.retired = True
+            if current.refs == 0:
+                current.release()
+        return segment
+
+    def submit(self, kind, db_name, args):
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Tipo de job desconhecido: {kind}")
+        db_name = os.path.abspath(db_name)
+        with self._lock:
+            if not self._free_slots:
+                raise QueueFull(f"Fila cheia ({self.capacity} jobs em curso)")
+            job = Job(kind, self._free_slots.pop())
+            self._cancel_flags[job.slot] = 0
+            job.segment = self._segment_for(db_name)
+            job.segment.refs += 1
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(_run_job, job.id, job.slot, kind, db_name,
+                                               job.segment.shm.name, job.segment.size, args)
+        job.future.add_done_callback(partial(self._finish, job))
+        return job
+
+    def _finish(self, job, future):
+        with self._lock:
+            self._free_slots.append(job.slot)
+            job.segment.refs -= 1
+            if job.segment.retired and job.segment.refs == 0 and not self._closed:
+                job.segment.release()
+            job.finished_at = time.time()
+            if future.cancelled():
+                job.status = 'cancelled'
+            elif isinstance(future.exception(), JobCancelled):
+                job.status = 'cancelled'
+            elif future.exception() is not None:
+                job.status = 'failed'
+                job.error = str(future.exception())
+            else:
+                job.status = 'done'
+                job.progress = 1.0
+                job.result = future.result()
+            # Esquece os jobs terminados mais antigos
+            finished = [job_id for job_id, other in self._jobs.items() if other.finished]
+            for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[job_id]
+
+    def _drain_progress(self):
+        while True:
+            try:
+                job_id, progress, stage = self._progress.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.finished:
+                    continue
+                if job.status == 'queued':
+                    job.status = 'running'
+                    job.started_at = time.time()
+                job.progress = progress
+                job.stage = stage
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancela um job. Retorna o job (None se não existir)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+        if not job.future.cancel():
+            with self._lock:
+                if not job.finished:
+                    self._cancel_flags[job.slot] = 1
+                    job.status = 'cancelling'
+        return job
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            return {
+                'capacity': self.capacity,
+                'free_slots': len(self._free_slots),
+                **{status: statuses.count(status) for status in
+                   ('queued', 'running', 'cancelling', 'done', 'failed', 'cancelled')},
+            }
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for segment in self._segments.values():
+            try:
+                segment.release()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,144 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Limites superiores (segundos) dos baldes dos histogramas de latência
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Tempos por etapa do pedido atual, para o cabeçalho Server-Timing (None = não pedido)
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """Histograma cumulativo no formato do Prometheus, uma série por conjunto de rótulos."""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # rótulos -> [contagem por balde (+Inf no fim), soma, contagem]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self._series.items())]
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {repr(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class Counter:
+    """Contador monótono no formato do Prometheus, uma série por conjunto de rótulos."""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = sorted(self._series.items())
+        lines.extend(f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in series)
+        return lines
+
+
+REQUEST_SECONDS = Histogram('routing_request_duration_seconds',
+                            'Latência dos handlers do blueprint de roteamento, por endpoint, método e estado.')
+STAGE_SECONDS = Histogram('routing_stage_duration_seconds',
+                          'Latência das etapas internas (carga do grafo, busca, reconstrução do caminho, SQLite, JSON).')
+REQUESTS = Counter('routing_requests_total', 'Pedidos tratados, por endpoint, método e estado.')
+PATH_QUERIES = Counter('routing_shortest_path_queries_total', 'Buscas de caminho mais curto, por algoritmo.')
+NODES_SETTLED = Counter('routing_nodes_settled_total', 'Nós fixados pelas buscas de caminho mais curto, por algoritmo.')
+SQL_STATEMENTS = Counter('routing_sqlite_statements_total', 'Instruções SQL executadas nas ligações do pool.')
+
+REGISTRY = (REQUEST_SECONDS, STAGE_SECONDS, REQUESTS, PATH_QUERIES, NODES_SETTLED, SQL_STATEMENTS)
+
+
+def record_stage(stage, seconds, **labels):
+    STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage, **labels):
+    """Mede o bloco como a etapa `stage` (histograma + Server-Timing do pedido, se ativo)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, **labels)
+
+
+def count_sql_statement(statement):
+    # Callback de sqlite3.Connection.set_trace_callback
+    SQL_STATEMENTS.inc()
+
+
+def start_request_timing():
+    """Ativa a recolha de etapas do pedido atual; retorna o token para `finish_request_timing`."""
+    return _request_timings.set({})
+
+
+def finish_request_timing(token, total_seconds):
+    """Valor do cabeçalho Server-Timing com as etapas medidas e o total (em ms)."""
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    entries = [f'{stage};dur={seconds * 1000:.3f}' for stage, seconds in timings.items()]
+    entries.append(f'total;dur={total_seconds * 1000:.3f}')
+    return ', '.join(entries)
+
+
+def render():
+    """Todas as métricas no formato de texto do Prometheus (versão 0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,27 @@
+import argparse
+import os
+import sqlite3
+
+from quadtree_logic import Quadtree
+
+# Converte ficheiros routing_system.db existentes do índice quadkey (uma linha
+# TEXT por nível em quadtree_index) para um único código de Morton por cidade.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migra routing_system.db para o índice de Morton.")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'routing_system.db'))
+    parser.add_argument('--keep-quadkey-index', action='store_true',
+                        help="Mantém a tabela quadtree_index (por omissão é removida)")
+    args = parser.parse_args()
+
+    size_before = os.path.getsize(args.db)
+    qt = Quadtree(db_name=args.db)
+    migrated = qt.migrate_to_morton(drop_quadkey_index=not args.keep_quadkey_index)
+    size_after = os.path.getsize(args.db)
+
+    conn = sqlite3.connect(args.db)
+    missing = conn.execute("SELECT COUNT(*) FROM cities WHERE morton IS NULL").fetchone()[0]
+    conn.close()
+
+    print(f"{migrated} cidades migradas para o índice de Morton ({missing} sem código).")
+    print(f"Tamanho do ficheiro: {size_before / 1024:.1f} KiB -> {size_after / 1024:.1f} KiB")
@@ -1,10 +1,101 @@
 
+import math
+import os
 import sqlite3
+from contextlib import nullcontext
+from itertools import islice
+import numpy as np
+import distance_engine
+from coordinate_store import CoordinateStore
+from db_pool import ConnectionPool, immediate_transaction
+from data_version import ensure_version_tracking, resume_insert_trigger, suspend_insert_trigger
+from road_graph import RoadGraph
+from spatial_codes import (MORTON_LEVELS, cell_quadkey, grid_cells, morton_encode, morton_quadkeys,
+                           quadkey_to_morton_range)
+from spatial_shapes import INSIDE, OUTSIDE, BoundingBox, Circle, Polygon
+
+DEFAULT_MAX_COVERING_CELLS = 128  # Limite de intervalos por consulta de região
+BULK_CHUNK_SIZE = 50000  # Cidades por lote em add_cities_bulk
+MAX_RINGS_PER_LEVEL = 3  # Anéis expandidos num nível antes de passar ao nível mais grosso
+INDEX_MODES = ('quadkey', 'morton')
+
 
 class Quadtree:
-    def __init__(self, db_name='routing_system.db', max_level=9):
+    # (ficheiro, index_mode pedido) -> (schema_version, tem coluna morton, index_mode)
+    _checked_schemas = {}
+
+    def __init__(self, db_name='routing_system.db', max_level=9, index_mode=None, conn=None):
+        # index_mode:
+        #   'quadkey' - uma linha TEXT por nível na tabela quadtree_index (original)
+        #   'morton'  - um único código de Morton INTEGER indexado em cities.morton
+        #   None      - deteta pelo esquema (morton se a coluna cities.morton existir)
+        # conn: ligação a usar (ex.: a do pedido Flask); sem ela, cada operação
+        # empresta uma ligação do ConnectionPool do ficheiro
+        if index_mode is not None and index_mode not in INDEX_MODES:
+            raise ValueError(f"Modo de índice desconhecido: {index_mode}")
         self.db_name = db_name
         self.max_level = max_level
+        self.index_mode = index_mode
+        self.conn = conn
+        self._has_morton_column = None
+
+    def _connection(self):
+        if self.conn is not None:
+            return nullcontext(self.conn)
+        return ConnectionPool.for_db(self.db_name).connection()
+
+    def _morton_column_exists(self, cursor):
+        cursor.execute("PRAGMA table_info(cities)")
+        return any(row[1] == 'morton' for row in cursor.fetchall())
+
+    def _ensure_schema(self, cursor):
+        # As verificações só se repetem quando o esquema do ficheiro muda
+        # (PRAGMA schema_version, incrementado por qualquer CREATE/ALTER/DROP)
+        key = (os.path.abspath(self.db_name), self.index_mode)
+        cursor.execute("PRAGMA schema_version")
+        checked = Quadtree._checked_schemas.get(key)
+        if checked is not None and checked[0] == cursor.fetchone()[0]:
+            _, self._has_morton_column, self.index_mode = checked
+            return
+        self._create_schema(cursor)
+        cursor.execute("PRAGMA schema_version")
+        Quadtree._checked_schemas[key] = (cursor.fetchone()[0], self._has_morton_column, self.index_mode)
+
+    def _create_schema(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cities (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL
+            )
+        """)
+        ensure_version_tracking(cursor, 'cities')
+        if self._has_morton_column is None:
+            self._has_morton_column = self._morton_column_exists(cursor)
+        if self.index_mode is None:
+            self.index_mode = 'morton' if self._has_morton_column else 'quadkey'
+
+        if self.index_mode == 'morton':
+            if not self._has_morton_column:
+                cursor.execute("ALTER TABLE cities ADD COLUMN morton INTEGER")
+                self._has_morton_column = True
+            # Qualquer quadrante de qualquer nível é um intervalo contíguo deste índice
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_cities_morton ON cities (morton)")
+            return
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS quadtree_index (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                city_id INTEGER NOT NULL,
+                quadkey TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                UNIQUE(city_id, level),
+                FOREIGN KEY (city_id) REFERENCES cities(id)
+            )
+        """)
+        # Índice composto: cada prefixo da cobertura vira um range scan num só nível
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_quadtree_level_quadkey ON quadtree_index (level, quadkey)")
 
     def _get_quadkey(self, lat, lon, level):
         # Normaliza latitude e longitude para o intervalo [0, 1]
@@ -34,20 +125,113 @@ class Quadtree:
         return ''.join(quadkey)
 
     def add_city(self, name, latitude, longitude):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+
+            if self._has_morton_column:
+                cursor.execute("INSERT INTO cities (name, latitude, longitude, morton) VALUES (?, ?, ?, ?)",
+                               (name, latitude, longitude, morton_encode(latitude, longitude)))
+            else:
+                cursor.execute("INSERT INTO cities (name, latitude, longitude) VALUES (?, ?, ?)", (name, latitude, longitude))
+            city_id = cursor.lastrowid
 
-        cursor.execute("INSERT INTO cities (name, latitude, longitude) VALUES (?, ?, ?)", (name, latitude, longitude))
-        city_id = cursor.lastrowid
+            if self.index_mode == 'quadkey':
+                for level in range(1, self._index_depth(cursor) + 1):
+                    quadkey = self._get_quadkey(latitude, longitude, level)
+                    cursor.execute("INSERT INTO quadtree_index (city_id, quadkey, level) VALUES (?, ?, ?)", (city_id, quadkey, level))
 
-        for level in range(1, self.max_level + 1):
-            quadkey = self._get_quadkey(latitude, longitude, level)
-            cursor.execute("INSERT INTO quadtree_index (city_id, quadkey, level) VALUES (?, ?, ?)", (city_id, quadkey, level))
+            conn.commit()
 
-        conn.commit()
-        conn.close()
+        # Mantém o cache de coordenadas do processo sincronizado com a tabela
+        CoordinateStore.for_db(self.db_name).append(city_id, latitude, longitude)
+        # A nova cidade é ligada ao grafo k-NN no próximo carregamento
+        RoadGraph.for_db(self.db_name).invalidate()
         return city_id
 
+    def _secondary_indexes(self, cursor):
+        # Índices explícitos (não os UNIQUE automáticos) das tabelas do quadtree
+        cursor.execute("""
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ('cities', 'quadtree_index')
+        """)
+        return cursor.fetchall()
+
+    def add_cities_bulk(self, cities, chunk_size=BULK_CHUNK_SIZE, rebuild_indexes=None):
+        """Insere muitas cidades numa única transação.
+
+        `cities` é um iterável de (name, latitude, longitude), consumido em lotes
+        de `chunk_size`: os códigos de Morton/quadkeys de cada lote são calculados
+        de forma vetorizada e gravados com executemany. Em cargas grandes
+        (`rebuild_indexes`; por omissão, quando o primeiro lote vem cheio) os
+        índices secundários são removidos e reconstruídos no fim.
+        Retorna um range com os ids atribuídos.
+        """
+        dropped_indexes = []
+        total = 0
+        with self._connection() as conn, immediate_transaction(conn) as cursor:
+            self._ensure_schema(cursor)
+
+            # Ids explícitos e contíguos: a transação tem o lock de escrita
+            cursor.execute("SELECT MAX(id) FROM cities")
+            max_id = cursor.fetchone()[0] or 0
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'cities'")
+            row = cursor.fetchone()
+            first_id = max(max_id, row[0] if row else 0) + 1
+            # Uma só mudança de versão para a carga inteira, não uma por linha
+            suspend_insert_trigger(cursor, 'cities')
+
+            iterator = iter(cities)
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                if total == 0 and (rebuild_indexes or (rebuild_indexes is None and len(chunk) == chunk_size)):
+                    dropped_indexes = self._secondary_indexes(cursor)
+                    for name, _ in dropped_indexes:
+                        cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+                names = [str(city[0]) for city in chunk]
+                latitudes = np.array([city[1] for city in chunk], dtype=np.float64)
+                longitudes = np.array([city[2] for city in chunk], dtype=np.float64)
+                invalid = ~((np.abs(latitudes) <= 90) & (np.abs(longitudes) <= 180))
+                if invalid.any():
+                    bad = int(np.flatnonzero(invalid)[0])
+                    raise ValueError(f"Coordenadas inválidas para a cidade '{names[bad]}': "
+                                     f"({latitudes[bad]}, {longitudes[bad]})")
+
+                ids = range(first_id + total, first_id + total + len(chunk))
+                codes = morton_encode(latitudes, longitudes)
+                if self._has_morton_column:
+                    cursor.executemany(
+                        "INSERT INTO cities (id, name, latitude, longitude, morton) VALUES (?, ?, ?, ?, ?)",
+                        zip(ids, names, latitudes.tolist(), longitudes.tolist(), codes.tolist()))
+                else:
+                    cursor.executemany(
+                        "INSERT INTO cities (id, name, latitude, longitude) VALUES (?, ?, ?, ?)",
+                        zip(ids, names, latitudes.tolist(), longitudes.tolist()))
+
+                if self.index_mode == 'quadkey':
+                    # O quadkey de cada nível é um prefixo do quadkey do nível máximo
+                    depth = self._index_depth(cursor) if total == 0 else depth
+                    quadkeys = morton_quadkeys(codes, depth)
+                    cursor.executemany(
+                        "INSERT INTO quadtree_index (city_id, quadkey, level) VALUES (?, ?, ?)",
+                        ((city_id, quadkey[:level], level)
+                         for city_id, quadkey in zip(ids, quadkeys)
+                         for level in range(1, depth + 1)))
+                total += len(chunk)
+
+            for _, sql in dropped_indexes:
+                cursor.execute(sql)
+            resume_insert_trigger(cursor, 'cities')
+
+        if total:
+            # Carga grande: mais barato recarregar o cache e o grafo sob pedido
+            CoordinateStore.for_db(self.db_name).invalidate()
+            RoadGraph.for_db(self.db_name).invalidate()
+        return range(first_id, first_id + total)
+
     def _get_quadkey_bbox(self, quadkey):
         # Converte um quadkey de volta para sua caixa delimitadora (min_lat, max_lat, min_lon, max_lon)
         # Isso é uma simplificação e pode ter imprecisões para níveis muito altos.
@@ -75,67 +259,266 @@ class Quadtree:
 
         return min_lat, max_lat, min_lon, max_lon
 
-    def get_bounding_box_quadkeys(self, min_lat, max_lat, min_lon, max_lon, target_level):
-        # Retorna uma lista de quadkeys no target_level que intersectam a caixa delimitadora
-        # Esta é uma implementação simplificada e pode não ser exaustiva para caixas grandes.
-        # Uma implementação robusta usaria um algoritmo de travessia da árvore.
-        # Para o propósito de demonstração e para atingir a complexidade logarítmica,
-        # vamos focar nos quadkeys que contêm os cantos da caixa e o centro.
+    def get_covering_quadkeys(self, min_lat, max_lat, min_lon, max_lon, max_level=None,
+                              max_cells=DEFAULT_MAX_COVERING_CELLS):
+        # Cobertura de uma caixa; min_lon > max_lon atravessa o antimeridiano
+        return self.get_shape_covering(BoundingBox(min_lat, max_lat, min_lon, max_lon), max_level, max_cells)
 
-        test_points = [
-            (min_lat, min_lon), (min_lat, max_lon), (max_lat, min_lon), (max_lat, max_lon),
-            ((min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
-        ]
+    def get_shape_covering(self, shape, max_level=None, max_cells=DEFAULT_MAX_COVERING_CELLS):
+        # Percorre a árvore a partir da raiz e devolve o conjunto mínimo de
+        # prefixos (níveis mistos) que cobre a forma (ver spatial_shapes):
+        # quadrantes totalmente dentro param logo; os que só a intersectam são
+        # subdivididos até max_level ou até o número de células atingir max_cells.
+        # Retorna uma lista de (quadkey, totalmente_contido).
+        max_level = self.max_level if max_level is None else min(max_level, self.max_level)
+        covering = []
+        frontier = [('', -90.0, 90.0, -180.0, 180.0)]
+        level = 0
+
+        while frontier:
+            partial = []
+            for quadkey, lat0, lat1, lon0, lon1 in frontier:
+                relation = shape.classify(lat0, lat1, lon0, lon1)
+                if relation == OUTSIDE:
+                    continue
+                if relation == INSIDE:
+                    covering.append((quadkey, True))
+                else:
+                    partial.append((quadkey, lat0, lat1, lon0, lon1))
+
+            if level == max_level or len(covering) + 4 * len(partial) > max_cells:
+                covering.extend((quadkey, False) for quadkey, *_ in partial)
+                break
+
+            frontier = []
+            for quadkey, lat0, lat1, lon0, lon1 in partial:
+                mid_lat = (lat0 + lat1) / 2
+                mid_lon = (lon0 + lon1) / 2
+                frontier.append((quadkey + '0', lat0, mid_lat, lon0, mid_lon))  # Sudoeste
+                frontier.append((quadkey + '1', lat0, mid_lat, mid_lon, lon1))  # Sudeste
+                frontier.append((quadkey + '2', mid_lat, lat1, lon0, mid_lon))  # Noroeste
+                frontier.append((quadkey + '3', mid_lat, lat1, mid_lon, lon1))  # Nordeste
+            level += 1
 
-        quadkeys = set()
-        for lat, lon in test_points:
-            if -90 <= lat <= 90 and -180 <= lon <= 180:
-                quadkeys.add(self._get_quadkey(lat, lon, target_level))
-        return list(quadkeys)
+        return covering
+
+    def _index_depth(self, cursor):
+        # Profundidade do índice quadkey gravado na base. Fica fixa na primeira
+        # escrita, para que todas as cidades tenham linhas nos mesmos níveis.
+        cursor.execute("SELECT MAX(level) FROM quadtree_index")
+        level = cursor.fetchone()[0]
+        return self.max_level if level is None else level
+
+    def _indexed_level(self, cursor):
+        # Nível mais fino presente no índice, limitado a max_level
+        return min(self._index_depth(cursor), self.max_level)
+
+    def _scan_tile(self, cursor, quadkey, level):
+        # Linhas (id, name, latitude, longitude) das cidades no quadrante `quadkey`
+        if self.index_mode == 'morton':
+            # O quadrante é o intervalo contíguo [início, fim) de códigos de Morton
+            start, end = quadkey_to_morton_range(quadkey)
+            cursor.execute("""
+                SELECT id, name, latitude, longitude FROM cities
+                WHERE morton BETWEEN ? AND ?
+            """, (start, end - 1))
+        else:
+            # Cada prefixo p corresponde ao intervalo [p, p || '4') no índice (level, quadkey)
+            cursor.execute("""
+                SELECT c.id, c.name, c.latitude, c.longitude
+                FROM quadtree_index qi INDEXED BY idx_quadtree_level_quadkey
+                JOIN cities c ON c.id = qi.city_id
+                WHERE qi.level = ? AND qi.quadkey >= ? AND qi.quadkey < ?
+            """, (level, quadkey, quadkey + '4'))
+        return cursor.fetchall()
+
+    def _query_level(self, cursor, search_level=None):
+        # Nível de refinamento máximo da cobertura. No modo quadkey os prefixos
+        # são comparados com os quadkeys desse nível, que têm de existir no índice.
+        if self.index_mode == 'morton':
+            level = self.max_level
+        else:
+            level = self._indexed_level(cursor)
+        if search_level is not None:
+            level = min(level, search_level)
+        return min(level, MORTON_LEVELS)
+
+    def find_cities_in_shape(self, shape, search_level=None):
+        """Cidades dentro de uma forma de spatial_shapes (caixa, círculo ou polígono).
+
+        Cada quadrante da cobertura é lido como um intervalo do índice; só as
+        linhas dos quadrantes parciais passam pelo filtro exato, vetorizado
+        (`shape.contains`) sobre todas elas de uma vez.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+            if conn.in_transaction:
+                conn.commit()  # Esquema criado agora: não fica com o lock de escrita
+
+            query_level = self._query_level(cursor, search_level)
+            covering = self.get_shape_covering(shape, max_level=query_level)
+
+            rows, contained_flags = [], []
+            for quadkey, contained in covering:
+                tile_rows = self._scan_tile(cursor, quadkey, query_level)
+                rows.extend(tile_rows)
+                contained_flags.extend([contained] * len(tile_rows))
+        if not rows:
+            return []
+
+        keep = np.asarray(contained_flags, dtype=bool)
+        partial = np.flatnonzero(~keep)
+        if len(partial):
+            coordinates = np.asarray([rows[i][2:4] for i in partial.tolist()], dtype=np.float64)
+            keep[partial] = shape.contains(coordinates[:, 0], coordinates[:, 1])
+        return [{'id': city_id, 'name': name, 'latitude': lat, 'longitude': lon}
+                for (city_id, name, lat, lon), kept in zip(rows, keep.tolist()) if kept]
 
     def find_cities_in_region(self, min_lat, max_lat, min_lon, max_lon, search_level=None):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-
-        if search_level is None:
-            # Determina um nível de busca razoável com base no tamanho da região
-            # Isso é heurístico e pode ser ajustado.
-            lat_diff = abs(max_lat - min_lat)
-            lon_diff = abs(max_lon - min_lon)
-            # Um nível maior para regiões menores
-            if lat_diff < 1 and lon_diff < 1: search_level = 9
-            elif lat_diff < 5 and lon_diff < 5: search_level = 7
-            elif lat_diff < 20 and lon_diff < 20: search_level = 5
-            else: search_level = 3
-            search_level = min(search_level, self.max_level)
-
-        # Obter todos os quadkeys relevantes para a região no nível de busca
-        relevant_quadkeys = self.get_bounding_box_quadkeys(min_lat, max_lat, min_lon, max_lon, search_level)
-
-        if not relevant_quadkeys:
-            conn.close()
+        # Caixa lat/lon; com min_lon > max_lon a caixa atravessa o antimeridiano
+        return self.find_cities_in_shape(BoundingBox(min_lat, max_lat, min_lon, max_lon), search_level)
+
+    def find_cities_in_radius(self, latitude, longitude, radius_km, search_level=None):
+        """Cidades a até `radius_km` do ponto, ordenadas por distância (com distance_km)."""
+        circle = Circle(latitude, longitude, radius_km)
+        cities = self.find_cities_in_shape(circle, search_level)
+        if not cities:
             return []
+        distances = circle.distances([city['latitude'] for city in cities], [city['longitude'] for city in cities])
+        for city, distance in zip(cities, distances.tolist()):
+            city['distance_km'] = distance
+        return sorted(cities, key=lambda city: city['distance_km'])
+
+    def find_cities_in_polygon(self, geometry, search_level=None):
+        # `geometry`: Polygon/MultiPolygon GeoJSON (anéis de [lon, lat]; buracos suportados)
+        return self.find_cities_in_shape(Polygon.from_geojson(geometry), search_level)
+
+    @staticmethod
+    def _ring_cells(row0, col0, ring, size):
+        # Células à distância de Chebyshev `ring` de (row0, col0); as colunas
+        # dão a volta no antimeridiano e as linhas param nos polos
+        for row in range(max(row0 - ring, 0), min(row0 + ring, size - 1) + 1):
+            if abs(row - row0) == ring:
+                cols = range(col0 - ring, col0 + ring + 1)
+            else:
+                cols = (col0 - ring, col0 + ring)
+            for col in cols:
+                yield row, col % size
+
+    def _nearest(self, cursor, latitude, longitude, k, query_level, tile_cache):
+        # kNN por expansão em anéis: começa na célula do ponto no nível mais fino
+        # e lê as células vizinhas anel a anel. Termina quando a k-ésima distância
+        # encontrada não excede o limite inferior da distância a qualquer célula
+        # ainda não lida. Se os anéis crescerem demasiado, sobe um nível.
+        candidates = {}
+        cos_phi = math.cos(math.radians(latitude))
+        # Nível inicial com ~k cidades por célula numa distribuição uniforme
+        total = len(CoordinateStore.for_db(self.db_name))
+        level = min(query_level, max(0, int(math.log(max(total, 1) / k, 4)) if total > k else 0))
+
+        while True:
+            size = 1 << level
+            tile_lat = 180.0 / size
+            tile_lon = 360.0 / size
+            row0, col0 = (int(value) for value in grid_cells(latitude, longitude, level))
+            visited = set()
+            ring = 0
+
+            while True:
+                for cell in self._ring_cells(row0, col0, ring, size):
+                    if cell in visited:
+                        continue
+                    visited.add(cell)
+                    quadkey = cell_quadkey(cell[0], cell[1], level)
+                    rows = tile_cache.get(quadkey)
+                    if rows is None:
+                        rows = self._scan_tile(cursor, quadkey, query_level)
+                        tile_cache[quadkey] = rows
+                    if rows:
+                        distances = distance_engine.haversine(
+                            latitude, longitude, [r[2] for r in rows], [r[3] for r in rows])
+                        for row, distance in zip(rows, distances.tolist()):
+                            candidates[row[0]] = (distance, row)
+
+                # Limite inferior da distância até à região ainda não lida
+                bounds = []
+                if row0 - ring > 0:
+                    bounds.append(math.radians(latitude - ((row0 - ring) * tile_lat - 90)))
+                if row0 + ring < size - 1:
+                    bounds.append(math.radians(((row0 + ring + 1) * tile_lat - 90) - latitude))
+                if 2 * ring + 1 < size:
+                    west = (col0 - ring) * tile_lon - 180
+                    east = (col0 + ring + 1) * tile_lon - 180
+                    lon_gap = math.radians(min(longitude - west, east - longitude))
+                    bounds.append(math.asin(min(1.0, math.sin(min(lon_gap, math.pi / 2)) * cos_phi)))
+                bound = distance_engine.EARTH_RADIUS_KM * min(bounds) if bounds else float('inf')
+
+                if not bounds:
+                    break
+                if len(candidates) >= k:
+                    kth = sorted(distance for distance, _ in candidates.values())[k - 1]
+                    if kth <= bound:
+                        break
+                ring += 1
+                if ring > MAX_RINGS_PER_LEVEL and level > 0:
+                    break
+
+            if not bounds or (len(candidates) >= k and kth <= bound):
+                break
+            level -= 1
+
+        nearest = sorted(candidates.values(), key=lambda item: item[0])[:k]
+        return [
+            {'id': row[0], 'name': row[1], 'latitude': row[2], 'longitude': row[3], 'distance_km': distance}
+            for distance, row in nearest
+        ]
+
+    def find_nearest_cities(self, latitude, longitude, k=10):
+        """As k cidades mais próximas do ponto, ordenadas por distância (km)."""
+        return self.find_nearest_cities_batch([(latitude, longitude)], k)[0]
+
+    def find_nearest_cities_batch(self, points, k=10):
+        """kNN para uma lista de pontos (latitude, longitude) numa só ligação.
+
+        As células lidas são partilhadas entre os pontos do lote, o que torna
+        barato ajustar milhares de pontos GPS próximos uns dos outros.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+            if conn.in_transaction:
+                conn.commit()  # Esquema criado agora: não fica com o lock de escrita
+            query_level = self._query_level(cursor)
+            tile_cache = {}
+            return [self._nearest(cursor, latitude, longitude, k, query_level, tile_cache)
+                    for latitude, longitude in points]
+
+    def migrate_to_morton(self, drop_quadkey_index=True):
+        """Converte a base para o modo 'morton'.
 
-        # Construir a cláusula WHERE para a consulta SQL
-        placeholders = ", ".join(["?" for _ in relevant_quadkeys])
-        query = f"""
-            SELECT DISTINCT c.id, c.name, c.latitude, c.longitude
-            FROM cities c
-            JOIN quadtree_index qi ON c.id = qi.city_id
-            WHERE qi.quadkey IN ({placeholders}) AND qi.level = ?
+        Calcula o código de Morton de todas as cidades (vetorizado), grava-o em
+        cities.morton e cria o índice. Com `drop_quadkey_index`, remove a tabela
+        quadtree_index e compacta o ficheiro. Retorna o número de cidades.
         """
-        params = relevant_quadkeys + [search_level]
-        cursor.execute(query, params)
-        results = cursor.fetchall()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            self.index_mode = 'morton'
+            self._ensure_schema(cursor)
 
-        # Filtrar resultados para garantir que estão estritamente dentro da caixa delimitadora
-        filtered_results = []
-        for city_id, name, lat, lon in results:
-            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
-                filtered_results.append({'id': city_id, 'name': name, 'latitude': lat, 'longitude': lon})
+            cursor.execute("SELECT id, latitude, longitude FROM cities")
+            rows = cursor.fetchall()
+            if rows:
+                ids, latitudes, longitudes = zip(*rows)
+                codes = morton_encode(latitudes, longitudes).tolist()
+                cursor.executemany("UPDATE cities SET morton = ? WHERE id = ?", zip(codes, ids))
 
-        conn.close()
-        return filtered_results
+            if drop_quadkey_index:
+                cursor.execute("DROP TABLE IF EXISTS quadtree_index")
+            conn.commit()
+            if drop_quadkey_index:
+                conn.execute("VACUUM")
+        return len(rows)
 
 
 if __name__ == '__main__':
@@ -147,9 +530,12 @@ if __name__ == '__main__':
     conn = sqlite3.connect(qt.db_name)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM cities;")
-    cursor.execute("DELETE FROM quadtree_index;")
+    cursor.execute("DROP TABLE IF EXISTS quadtree_index;")
+    cursor.execute("DROP TABLE IF EXISTS edges;")
     conn.commit()
     conn.close()
+    CoordinateStore.for_db(qt.db_name).invalidate()
+    RoadGraph.for_db(qt.db_name).invalidate()
 
     qt.add_city("Lisboa", 38.7223, -9.1393)
     qt.add_city("Porto", 41.1579, -8.6291)
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 1024  # Resultados guardados no máximo (LRU)
+DEFAULT_TTL = 600.0  # Segundos até um resultado expirar
+
+HIT, MISS, COALESCED = 'HIT', 'MISS', 'COALESCED'
+
+
+class _Flight:
+    # Cálculo em curso para uma chave; os pedidos repetidos esperam pelo evento
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """Cache em memória de resultados com LRU, TTL e coalescência de pedidos.
+
+    As chaves devem incluir a versão dos dados (ver data_version), pelo que
+    uma alteração das tabelas torna as entradas antigas inalcançáveis; estas
+    saem depois por LRU ou TTL. Quando vários pedidos iguais chegam ao mesmo
+    tempo só o primeiro calcula o resultado e os restantes esperam por ele.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # chave -> (expira_em, valor)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at < now:
+            del self._entries[key]
+            self.expirations += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def get(self, key):
+        with self._lock:
+            found, value = self._lookup(key, time.monotonic())
+            if found:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Retorna (valor, estado), com estado HIT, MISS ou COALESCED.
+
+        Em MISS o valor é calculado por `compute()` e guardado. Exceções não são
+        guardadas: propagam-se ao pedido que calculou e aos que esperavam por ele.
+        """
+        with self._lock:
+            found, value = self._lookup(key, time.monotonic())
+            if found:
+                self.hits += 1
+                return value, HIT
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, COALESCED
+
+        try:
+            flight.value = compute()
+            self.put(key, flight.value)
+            return flight.value, MISS
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,288 @@
+import math
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+import distance_engine
+from coordinate_store import CoordinateStore
+from db_pool import ConnectionPool, immediate_transaction
+from data_version import ensure_version_tracking, resume_insert_trigger, suspend_insert_trigger
+from spatial_grid import UnitVectorGrid, chord_to_km
+
+DEFAULT_KNN_NEIGHBORS = 6  # Vizinhos por cidade no grafo k-NN automático
+
+
+class RoadGraph:
+    """Grafo esparso de estradas carregado em formato CSR.
+
+    As arestas vivem na tabela `edges` (explícitas ou geradas como grafo dos
+    k vizinhos mais próximos) e são carregadas uma vez para três arrays:
+    `offsets` (n + 1), `targets` e `weights`. Os vizinhos do nó i são
+    targets[offsets[i]:offsets[i + 1]]. Os índices dos nós são os índices de
+    linha do `CoordinateStore` no momento do carregamento.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, db_name, knn_neighbors=DEFAULT_KNN_NEIGHBORS):
+        self.db_name = db_name
+        self.knn_neighbors = knn_neighbors
+        self.coordinates = CoordinateStore.for_db(db_name)
+        self._lock = threading.RLock()
+        self._loaded = False
+        self.node_ids = np.empty(0, dtype=np.int64)
+        self.points = None
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.targets = np.empty(0, dtype=np.int64)
+        self.weights = np.empty(0, dtype=np.float64)
+        self._index = {}
+
+    @classmethod
+    def for_db(cls, db_name):
+        key = os.path.abspath(db_name)
+        with cls._instances_lock:
+            graph = cls._instances.get(key)
+            if graph is None:
+                graph = cls(key)
+                cls._instances[key] = graph
+            return graph
+
+    def _ensure_schema(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS edges (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source_id INTEGER NOT NULL,
+                target_id INTEGER NOT NULL,
+                distance REAL NOT NULL,
+                kind TEXT NOT NULL DEFAULT 'manual', -- 'manual' ou 'knn'
+                UNIQUE(source_id, target_id),
+                FOREIGN KEY (source_id) REFERENCES cities(id),
+                FOREIGN KEY (target_id) REFERENCES cities(id)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_edges_source ON edges (source_id)")
+        ensure_version_tracking(cursor, 'edges')
+
+    def has_edges(self):
+        """Se já existe um grafo de estradas (carregado ou com arestas na tabela)."""
+        if self._loaded:
+            return self.num_edges > 0
+        with ConnectionPool.for_db(self.db_name).connection() as conn:
+            try:
+                return conn.execute("SELECT 1 FROM edges LIMIT 1").fetchone() is not None
+            except sqlite3.OperationalError:
+                return False  # Tabela edges ainda não criada
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def add_edge(self, source_id, target_id, distance=None, bidirectional=True, kind='manual'):
+        if distance is None:
+            source = self.coordinates.get(source_id)
+            target = self.coordinates.get(target_id)
+            if source is None or target is None:
+                raise KeyError(source_id if source is None else target_id)
+            distance = float(distance_engine.haversine(source[0], source[1], target[0], target[1]))
+
+        rows = [(source_id, target_id, distance, kind)]
+        if bidirectional:
+            rows.append((target_id, source_id, distance, kind))
+
+        with ConnectionPool.for_db(self.db_name).connection() as conn:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+            cursor.executemany(
+                "INSERT OR REPLACE INTO edges (source_id, target_id, distance, kind) VALUES (?, ?, ?, ?)", rows)
+            conn.commit()
+        self.invalidate()
+
+    def build_knn_edges(self, k=None, city_ids=None):
+        """Liga cada cidade (ou só `city_ids`) às suas k vizinhas mais próximas.
+
+        As arestas são gravadas nos dois sentidos com kind='knn'. Retorna o
+        número de linhas inseridas.
+        """
+        k = self.knn_neighbors if k is None else k
+        ids = self.coordinates.ids
+        if len(ids) < 2:
+            return 0
+        points = self.coordinates.points()
+        vectors = points.unit_vectors()
+
+        if city_ids is not None and len(city_ids) < 64:
+            # Poucas cidades novas: força bruta vetorizada contra todas
+            rows = self.coordinates.indices_for(city_ids)
+            k = min(k, len(ids) - 1)
+            sources, neighbors, chords = [], [], []
+            for row in rows:
+                diff = vectors - vectors[row]
+                squared = np.einsum('ij,ij->i', diff, diff)
+                squared[row] = np.inf
+                nearest = np.argpartition(squared, k - 1)[:k]
+                sources.append(np.full(k, row))
+                neighbors.append(nearest)
+                chords.append(np.sqrt(squared[nearest]))
+            sources = np.concatenate(sources)
+            neighbors = np.concatenate(neighbors)
+            chords = np.concatenate(chords)
+        else:
+            grid = UnitVectorGrid.for_neighbors(vectors, k)
+            knn, knn_chords = grid.knn(k)
+            rows = np.arange(len(ids)) if city_ids is None else self.coordinates.indices_for(city_ids)
+            sources = np.repeat(rows, knn.shape[1])
+            neighbors = knn[rows].ravel()
+            chords = knn_chords[rows].ravel()
+
+        distances = chord_to_km(chords)
+        source_ids = ids[sources].tolist()
+        target_ids = ids[neighbors].tolist()
+        distances = distances.tolist()
+        edge_rows = list(zip(source_ids, target_ids, distances, ['knn'] * len(distances)))
+        edge_rows += list(zip(target_ids, source_ids, distances, ['knn'] * len(distances)))
+
+        with ConnectionPool.for_db(self.db_name).connection() as conn, immediate_transaction(conn) as cursor:
+            self._ensure_schema(cursor)
+            # Uma só mudança de versão para todas as arestas, não uma por linha
+            suspend_insert_trigger(cursor, 'edges')
+            cursor.executemany(
+                "INSERT OR IGNORE INTO edges (source_id, target_id, distance, kind) VALUES (?, ?, ?, ?)", edge_rows)
+            inserted = cursor.rowcount
+            resume_insert_trigger(cursor, 'edges')
+        self.invalidate()
+        return inserted
+
+    def _cities_without_edges(self, cursor):
+        cursor.execute("""
+            SELECT c.id FROM cities c
+            WHERE NOT EXISTS (SELECT 1 FROM edges e WHERE e.source_id = c.id)
+        """)
+        return [row[0] for row in cursor.fetchall()]
+
+    def load(self):
+        pool = ConnectionPool.for_db(self.db_name)
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            self._ensure_schema(cursor)
+            conn.commit()
+            isolated = self._cities_without_edges(cursor) if self.knn_neighbors else []
+
+        # Cidades sem arestas (base nova ou cidades adicionadas) entram no grafo k-NN
+        if isolated:
+            self.build_knn_edges(city_ids=None if len(isolated) == len(self.coordinates) else isolated)
+
+        with pool.connection() as conn:
+            edges = conn.execute("SELECT source_id, target_id, distance FROM edges").fetchall()
+
+        with self._lock:
+            node_ids = self.coordinates.ids.copy()
+            index = {int(city_id): i for i, city_id in enumerate(node_ids)}
+            n = len(node_ids)
+
+            sources = np.fromiter((index.get(e[0], -1) for e in edges), dtype=np.int64, count=len(edges))
+            targets = np.fromiter((index.get(e[1], -1) for e in edges), dtype=np.int64, count=len(edges))
+            weights = np.fromiter((e[2] for e in edges), dtype=np.float64, count=len(edges))
+            valid = (sources >= 0) & (targets >= 0)
+            sources, targets, weights = sources[valid], targets[valid], weights[valid]
+
+            self.offsets, self.targets, self.weights = self._to_csr(sources, targets, weights, n)
+            # Grafo reverso, usado pela busca para trás das variantes bidirecionais
+            self.reverse_offsets, self.reverse_sources, self.reverse_weights = \
+                self._to_csr(targets, sources, weights, n)
+            self.node_ids = node_ids
+            self.points = self.coordinates.points()
+            self._index = index
+            # Listas Python para o ciclo do heap (mais rápidas que indexar arrays NumPy)
+            self._offsets_list = self.offsets.tolist()
+            self._targets_list = self.targets.tolist()
+            self._weights_list = self.weights.tolist()
+            self._reverse_offsets_list = self.reverse_offsets.tolist()
+            self._reverse_sources_list = self.reverse_sources.tolist()
+            self._reverse_weights_list = self.reverse_weights.tolist()
+            self._lat_list = self.points.lat.tolist()
+            self._lon_list = self.points.lon.tolist()
+            self._cos_lat_list = self.points.cos_lat.tolist()
+            self._loaded = True
+
+    @staticmethod
+    def _to_csr(sources, targets, weights, n):
+        order = np.argsort(sources, kind='stable')
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+        return offsets, targets[order], weights[order]
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+        return self
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    def index_of(self, city_id):
+        return self._index.get(city_id)
+
+    def neighbors(self, node):
+        start, end = self._offsets_list[node], self._offsets_list[node + 1]
+        return zip(self._targets_list[start:end], self._weights_list[start:end])
+
+    def reverse_neighbors(self, node):
+        # Nós com aresta a entrar em `node` (u -> node), com o respetivo peso
+        start, end = self._reverse_offsets_list[node], self._reverse_offsets_list[node + 1]
+        return zip(self._reverse_sources_list[start:end], self._reverse_weights_list[start:end])
+
+    def great_circle_to(self, target):
+        """Função h(node) com a distância de grande círculo (km) até `target`.
+
+        É uma heurística admissível desde que nenhuma aresta seja mais curta que
+        a distância em linha reta entre as suas cidades (caso das arestas k-NN).
+        Os valores são calculados sob pedido e memorizados, para que o custo
+        acompanhe apenas os nós explorados.
+        """
+        lat_list, lon_list, cos_list = self._lat_list, self._lon_list, self._cos_lat_list
+        lat_t, lon_t, cos_t = lat_list[target], lon_list[target], cos_list[target]
+        diameter = 2.0 * distance_engine.EARTH_RADIUS_KM
+        cache = {}
+
+        def heuristic(node):
+            value = cache.get(node)
+            if value is None:
+                sin_dlat = math.sin((lat_list[node] - lat_t) * 0.5)
+                sin_dlon = math.sin((lon_list[node] - lon_t) * 0.5)
+                a = sin_dlat * sin_dlat + cos_list[node] * cos_t * sin_dlon * sin_dlon
+                value = diameter * math.asin(math.sqrt(min(max(a, 0.0), 1.0)))
+                cache[node] = value
+            return value
+
+        return heuristic
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Constrói o grafo k-NN de estradas na tabela edges.")
+    parser.add_argument('--db', default='routing_system.db')
+    parser.add_argument('-k', type=int, default=DEFAULT_KNN_NEIGHBORS)
+    parser.add_argument('--rebuild', action='store_true', help="Apaga as arestas k-NN existentes antes de construir")
+    args = parser.parse_args()
+
+    graph = RoadGraph.for_db(args.db)
+    if args.rebuild:
+        conn = sqlite3.connect(graph.db_name)
+        cursor = conn.cursor()
+        graph._ensure_schema(cursor)
+        cursor.execute("DELETE FROM edges WHERE kind = 'knn'")
+        conn.commit()
+        conn.close()
+    inserted = graph.build_knn_edges(k=args.k)
+    graph.ensure_loaded()
+    print(f"{inserted} arestas inseridas; grafo com {len(graph)} nós e {graph.num_edges} arestas.")
@@ -1,47 +1,271 @@
-from flask import Blueprint, request, jsonify
-import sqlite3
+from flask import Blueprint, Response, request, jsonify, g, url_for, stream_with_context
+from werkzeug.http import http_date
 import os
+import json
+import math
+import time
+import zlib
+import numpy as np
 from routing_algorithms import RoutingAlgorithms
+from contraction_hierarchy import HierarchyUnavailable
 from quadtree_logic import Quadtree
+import spatial_shapes
+from tile_aggregates import TileAggregates
+from clustering_engine import DEFAULT_TOL_KM, KMEANS_INITS, MIN_EPS_KM
+from tsp_solver import DEFAULT_TIME_BUDGET, HELD_KARP_MAX_CITIES
+from db_pool import ConnectionPool, fetch_cities
+from data_version import current_version, ensure_version_tracking, version_info
+from result_cache import ResultCache
+from job_queue import JobQueue, QueueFull
+from city_import import ImportStats, iter_lines, parse_csv, parse_ndjson
+import metrics
 
 routing_bp = Blueprint('routing', __name__)
 
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'routing_system.db')
 
+
+def get_db():
+    """Ligação do pool reservada para o pedido atual (devolvida no fim do pedido)."""
+    if 'routing_db' not in g:
+        g.routing_db_pool = ConnectionPool.for_db(DB_PATH)
+        g.routing_db = g.routing_db_pool.acquire()
+    return g.routing_db
+
+
+@routing_bp.teardown_request
+def release_db(exception=None):
+    conn = g.pop('routing_db', None)
+    if conn is not None:
+        g.pop('routing_db_pool').release(conn)
+
+
+@routing_bp.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    # Server-Timing é opcional: só com o cabeçalho X-Server-Timing: 1 no pedido
+    if request.headers.get('X-Server-Timing', '').lower() in ('1', 'true', 'on'):
+        g.metrics_timing_token = metrics.start_request_timing()
+
+
+@routing_bp.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.pop('metrics_started', time.perf_counter())
+    # Regra do URL (ex.: /api/routing/jobs/<job_id>) em vez do caminho, para não multiplicar as séries.
+    # Em respostas em streaming o tempo medido é até ao início do envio.
+    labels = {'endpoint': request.url_rule.rule if request.url_rule else 'unmatched',
+              'method': request.method, 'status': response.status_code}
+    metrics.REQUEST_SECONDS.observe(elapsed, **labels)
+    metrics.REQUESTS.inc(**labels)
+    token = g.pop('metrics_timing_token', None)
+    if token is not None:
+        response.headers['Server-Timing'] = metrics.finish_request_timing(token, elapsed)
+    return response
+
+
+# Resultados de /route/dijkstra e /route/tsp, indexados pela versão dos dados
+ROUTE_CACHE = ResultCache()
+_version_tracked = set()
+
+
+def _versioned_cursor():
+    conn = get_db()
+    cursor = conn.cursor()
+    if DB_PATH not in _version_tracked:
+        ensure_version_tracking(cursor, 'cities')
+        conn.commit()
+        _version_tracked.add(DB_PATH)
+    return cursor
+
+
+def _graph_version():
+    """Versão atual de cities/edges (incrementada por gatilhos a cada alteração)."""
+    with metrics.timed('sqlite'):
+        return current_version(_versioned_cursor())
+
+
+CITY_FIELDS = ('id', 'name', 'latitude', 'longitude')
+MAX_CITIES_PAGE = 10000  # Limite máximo de cidades por página em /cities
+CITIES_FETCH_BATCH = 5000  # Linhas lidas por consulta ao percorrer a tabela
+
+
+def _parse_fields(value):
+    if not value:
+        return CITY_FIELDS
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in CITY_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"Campos inválidos: {', '.join(unknown) or value}; use {', '.join(CITY_FIELDS)}")
+    return fields
+
+
+def _city_columns(fields):
+    # O id é sempre lido (é a chave da paginação), mesmo quando não é pedido
+    return ('id',) + tuple(field for field in fields if field != 'id')
+
+
+def _iter_city_rows(conn, fields, after_id, limit=None):
+    # Paginação por chave (id > último id): cada consulta usa o índice da chave
+    # primária, sem OFFSET, e não mantém uma leitura aberta entre lotes
+    columns = _city_columns(fields)
+    sql = f"SELECT {', '.join(columns)} FROM cities WHERE id > ? ORDER BY id LIMIT ?"
+    remaining = limit
+    while remaining is None or remaining > 0:
+        batch = CITIES_FETCH_BATCH if remaining is None else min(remaining, CITIES_FETCH_BATCH)
+        rows = conn.execute(sql, (after_id, batch)).fetchall()
+        yield from rows
+        if len(rows) < batch:
+            return
+        after_id = rows[-1][0]
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+def _cities_validators(prefix, variant):
+    """Cabeçalhos de cache (ETag/Last-Modified) derivados da versão da tabela cities.
+
+    Retorna (cabeçalhos, True se o pedido condicional do cliente ainda é válido).
+    """
+    version, updated_at = version_info(_versioned_cursor(), 'cities')
+    etag = f"{prefix}-{version}-{zlib.crc32(variant.encode()):08x}"
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if updated_at is not None:
+        headers['Last-Modified'] = http_date(updated_at)
+    if request.if_none_match:
+        return headers, request.if_none_match.contains(etag)
+    not_modified = updated_at is not None and request.if_modified_since is not None \
+        and int(request.if_modified_since.timestamp()) >= updated_at
+    return headers, not_modified
+
+
 @routing_bp.route('/cities', methods=['GET'])
 def get_cities():
-    """Retorna todas as cidades disponíveis no banco de dados."""
+    """Lista as cidades por páginas (?after_id=&limit=&fields=&format=json|ndjson).
+
+    Sem `limit` devolve a tabela inteira, escrita aos poucos. A resposta leva
+    ETag e Last-Modified derivados da versão da tabela cities, pelo que um
+    cliente que revalide (If-None-Match / If-Modified-Since) recebe 304 sem
+    corpo enquanto a tabela não mudar.
+    """
+    try:
+        try:
+            after_id = int(request.args.get('after_id', 0))
+            limit = request.args.get('limit')
+            if limit is not None:
+                limit = int(limit)
+                if not 1 <= limit <= MAX_CITIES_PAGE:
+                    raise ValueError(f'limit deve estar entre 1 e {MAX_CITIES_PAGE}')
+            fields = _parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        output = request.args.get('format')
+        if output is None:
+            output = 'ndjson' if request.accept_mimetypes.best == 'application/x-ndjson' else 'json'
+        if output not in ('json', 'ndjson'):
+            return jsonify({'error': 'format deve ser json ou ndjson'}), 400
+
+        headers, not_modified = _cities_validators('cities', f"{after_id}:{limit}:{','.join(fields)}:{output}")
+        if not_modified:
+            return Response(status=304, headers=headers)
+
+        conn = get_db()
+        if limit is None:
+            rows = _iter_city_rows(conn, fields, after_id)
+            next_after_id = None
+        else:
+            # Uma linha a mais indica se existe página seguinte
+            rows = list(_iter_city_rows(conn, fields, after_id, limit + 1))
+            next_after_id = rows[limit - 1][0] if len(rows) > limit else None
+            rows = rows[:limit]
+            if next_after_id is not None:
+                headers['X-Next-After-Id'] = str(next_after_id)
+
+        columns = _city_columns(fields)
+        selected = [(field, columns.index(field)) for field in fields]
+
+        def generate():
+            if output == 'ndjson':
+                for row in rows:
+                    yield json.dumps({field: row[index] for field, index in selected}, ensure_ascii=False) + '\n'
+                return
+            yield '{"cities": ['
+            separator = ''
+            for row in rows:
+                yield separator + json.dumps({field: row[index] for field, index in selected}, ensure_ascii=False)
+                separator = ', '
+            yield f'], "next_after_id": {json.dumps(next_after_id)}}}'
+
+        mimetype = 'application/x-ndjson' if output == 'ndjson' else 'application/json'
+        # stream_with_context mantém a ligação do pool até o gerador terminar
+        return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@routing_bp.route('/tiles/<int:z>', defaults={'quadkey': ''}, methods=['GET'])
+@routing_bp.route('/tiles/<int:z>/<quadkey>', methods=['GET'])
+def get_tiles(z, quadkey):
+    """Agregados de nível `z` (contagem, centróide, cidade representativa) dentro de `quadkey`.
+
+    Com len(quadkey) == z devolve o próprio tile; com um quadkey mais curto
+    devolve os seus sub-tiles ocupados de nível z. O cliente pede só os tiles
+    visíveis ao nível de zoom atual em vez da tabela inteira.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, latitude, longitude FROM cities")
-        cities = cursor.fetchall()
-        conn.close()
-        
-        cities_list = [
-            {'id': city[0], 'name': city[1], 'latitude': city[2], 'longitude': city[3]}
-            for city in cities
-        ]
-        
-        return jsonify({'cities': cities_list}), 200
+        tiles = TileAggregates.for_db(DB_PATH)
+        try:
+            # Validação antes de consultar a base, para um 400 barato
+            tiles.validate(z, quadkey)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        headers, not_modified = _cities_validators('tiles', f'{z}:{quadkey}')
+        if not_modified:
+            return Response(status=304, headers=headers)
+
+        aggregates = tiles.tiles(z, quadkey)
+        cities_by_id = {city['id']: city for city in fetch_cities(get_db(), [tile['city_id'] for tile in aggregates])}
+        for tile in aggregates:
+            tile['city'] = cities_by_id.get(tile.pop('city_id'))
+        response = jsonify({'level': z, 'quadkey': quadkey, 'tiles': aggregates})
+        response.headers.update(headers)
+        return response, 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @routing_bp.route('/cities/search', methods=['POST'])
 def search_cities():
-    """Busca cidades numa região específica usando a Quadtree."""
+    """Busca cidades numa região usando a Quadtree.
+
+    A região é uma caixa (`min_lat`, `max_lat`, `min_lon`, `max_lon`; com
+    min_lon > max_lon atravessa o antimeridiano) ou uma `geometry` GeoJSON:
+    Polygon/MultiPolygon, ou Point com `radius_km` (círculo; as cidades vêm
+    ordenadas por distância, com `distance_km`).
+    """
     try:
         data = request.get_json()
+        qt = Quadtree(db_name=DB_PATH, conn=get_db())
+
+        if data.get('geometry') is not None:
+            try:
+                shape = spatial_shapes.from_geojson(data['geometry'], data.get('radius_km'))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if isinstance(shape, spatial_shapes.Circle):
+                cities = qt.find_cities_in_radius(shape.latitude, shape.longitude, shape.radius_km)
+            else:
+                cities = qt.find_cities_in_shape(shape)
+            return jsonify({'cities': cities}), 200
+
         min_lat = data.get('min_lat')
         max_lat = data.get('max_lat')
         min_lon = data.get('min_lon')
         max_lon = data.get('max_lon')
         
         if None in [min_lat, max_lat, min_lon, max_lon]:
-            return jsonify({'error': 'Parâmetros de caixa delimitadora faltando'}), 400
+            return jsonify({'error': 'Parâmetros de caixa delimitadora (ou geometry) faltando'}), 400
         
-        qt = Quadtree(db_name=DB_PATH)
         cities = qt.find_cities_in_region(min_lat, max_lat, min_lon, max_lon)
         
         return jsonify({'cities': cities}), 200
@@ -49,130 +273,497 @@ def search_cities():
         return jsonify({'error': str(e)}), 500
 
 
+MAX_NEAREST_K = 1000  # Vizinhos máximos por ponto em /cities/nearest
+MAX_NEAREST_BATCH = 10000  # Pontos máximos por pedido em /cities/nearest/batch
+
+
+def _parse_point(point):
+    # Aceita [lat, lon] ou {'lat'|'latitude': ..., 'lon'|'longitude': ...}
+    if isinstance(point, dict):
+        latitude = point.get('lat', point.get('latitude'))
+        longitude = point.get('lon', point.get('longitude'))
+    elif isinstance(point, (list, tuple)) and len(point) == 2:
+        latitude, longitude = point
+    else:
+        raise ValueError('Ponto inválido: use [lat, lon] ou {"lat": ..., "lon": ...}')
+    latitude, longitude = float(latitude), float(longitude)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Coordenadas fora do intervalo')
+    return latitude, longitude
+
+
+def _parse_k(value):
+    k = int(value)
+    if not 1 <= k <= MAX_NEAREST_K:
+        raise ValueError(f'k deve estar entre 1 e {MAX_NEAREST_K}')
+    return k
+
+
+@routing_bp.route('/cities/nearest', methods=['GET'])
+def nearest_cities():
+    """Retorna as k cidades mais próximas de um ponto (?lat=&lon=&k=)."""
+    try:
+        if request.args.get('lat') is None or request.args.get('lon') is None:
+            return jsonify({'error': 'Parâmetros lat e lon são obrigatórios'}), 400
+        try:
+            latitude, longitude = _parse_point([request.args['lat'], request.args['lon']])
+            k = _parse_k(request.args.get('k', 10))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        qt = Quadtree(db_name=DB_PATH, conn=get_db())
+        cities = qt.find_nearest_cities(latitude, longitude, k)
+
+        return jsonify({'cities': cities}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@routing_bp.route('/cities/nearest/batch', methods=['POST'])
+def nearest_cities_batch():
+    """kNN em lote para uma lista de pontos (por exemplo, ajuste de pontos GPS)."""
+    try:
+        data = request.get_json()
+        points = data.get('points') if data else None
+
+        if not points:
+            return jsonify({'error': 'Lista de pontos é obrigatória'}), 400
+        if len(points) > MAX_NEAREST_BATCH:
+            return jsonify({'error': f'Máximo de {MAX_NEAREST_BATCH} pontos por pedido'}), 400
+        try:
+            points = [_parse_point(point) for point in points]
+            k = _parse_k(data.get('k', 10))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        qt = Quadtree(db_name=DB_PATH, conn=get_db())
+        results = qt.find_nearest_cities_batch(points, k)
+
+        return jsonify({'results': results}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@routing_bp.route('/cities/import', methods=['POST'])
+def import_cities():
+    """Importa cidades em massa de um corpo CSV ou NDJSON, lido em streaming por blocos."""
+    try:
+        import_format = request.args.get('format')
+        if import_format is None:
+            mimetype = (request.mimetype or '').lower()
+            if 'ndjson' in mimetype or 'jsonl' in mimetype:
+                import_format = 'ndjson'
+            elif 'csv' in mimetype:
+                import_format = 'csv'
+        if import_format not in ('csv', 'ndjson'):
+            return jsonify({'error': 'Formato não suportado. Use text/csv ou application/x-ndjson (ou ?format=csv|ndjson)'}), 415
+        
+        stats = ImportStats()
+        lines = iter_lines(request.stream, stats)
+        cities = parse_csv(lines, stats) if import_format == 'csv' else parse_ndjson(lines, stats)
+        
+        qt = Quadtree(db_name=DB_PATH, conn=get_db())
+        city_ids = qt.add_cities_bulk(cities)
+        
+        result = stats.to_dict()
+        result['first_id'] = city_ids.start if city_ids else None
+        result['last_id'] = city_ids.stop - 1 if city_ids else None
+        return jsonify(result), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @routing_bp.route('/route/dijkstra', methods=['POST'])
 def calculate_dijkstra_route():
-    """Calcula a rota mais curta entre duas cidades usando Dijkstra."""
+    """Calcula a rota mais curta entre duas cidades (Dijkstra, A* ou variantes bidirecionais)."""
     try:
         data = request.get_json()
         start_city_id = data.get('start_city_id')
         end_city_id = data.get('end_city_id')
+        algorithm = data.get('algorithm', 'dijkstra')
         
         if not start_city_id or not end_city_id:
             return jsonify({'error': 'IDs de cidade de início e fim são obrigatórios'}), 400
+        if algorithm not in RoutingAlgorithms.SHORTEST_PATH_ALGORITHMS:
+            return jsonify({'error': f"Algoritmo inválido. Use um de: {', '.join(RoutingAlgorithms.SHORTEST_PATH_ALGORITHMS)}"}), 400
         
         router = RoutingAlgorithms(db_name=DB_PATH)
-        
-        # Obter todas as cidades para construir o grafo
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM cities")
-        all_city_ids = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        
-        path, distance = router.dijkstra(start_city_id, end_city_id, all_city_ids)
+        # O grafo esparso de estradas é carregado uma vez por processo; carregá-lo antes de ler
+        # a versão evita que as arestas k-NN que gera tornem a entrada obsoleta à nascença
+        router.road_graph.ensure_loaded()
+        cache_key = ('shortest_path', DB_PATH, algorithm, start_city_id, end_city_id, _graph_version())
+        (path, distance, settled_nodes), cache_status = ROUTE_CACHE.get_or_compute(
+            cache_key, lambda: router.shortest_path(start_city_id, end_city_id, algorithm))
         
         if not path:
             return jsonify({'error': 'Caminho não encontrado'}), 404
         
-        # Obter coordenadas para cada cidade no caminho
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        path_with_coords = []
-        for city_id in path:
-            cursor.execute("SELECT id, name, latitude, longitude FROM cities WHERE id = ?", (city_id,))
-            city_data = cursor.fetchone()
-            if city_data:
-                path_with_coords.append({
-                    'id': city_data[0],
-                    'name': city_data[1],
-                    'latitude': city_data[2],
-                    'longitude': city_data[3]
-                })
-        conn.close()
+        # Obter coordenadas de todas as cidades do caminho numa só consulta
+        path_with_coords = fetch_cities(get_db(), path)
         
-        return jsonify({
-            'path': path_with_coords,
-            'total_distance': distance
-        }), 200
+        with metrics.timed('serialize'):
+            response = jsonify({
+                'path': path_with_coords,
+                'total_distance': distance,
+                'algorithm': algorithm,
+                'settled_nodes': settled_nodes
+            })
+        return response, 200, {'X-Cache': cache_status}
+    except HierarchyUnavailable as e:
+        # algorithm='ch' sem hierarquia pré-processada (ou obsoleta)
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @routing_bp.route('/route/kmeans', methods=['POST'])
 def calculate_kmeans_clusters():
-    """Agrupa cidades em clusters usando K-means."""
+    """Agrupa cidades em clusters usando K-means esférico (k-means++ e modo mini-batch)."""
     try:
         data = request.get_json()
         city_ids = data.get('city_ids')
         num_clusters = data.get('num_clusters', 3)
+        init = data.get('init', 'k-means++')
+        tol = data.get('tol', DEFAULT_TOL_KM)
+        batch_size = data.get('batch_size')
         
         if not city_ids:
             return jsonify({'error': 'IDs de cidades são obrigatórios'}), 400
+        if init not in KMEANS_INITS:
+            return jsonify({'error': f"init inválido. Use um de: {', '.join(KMEANS_INITS)}"}), 400
+        try:
+            num_clusters = int(num_clusters)
+            tol = float(tol)
+            batch_size = None if batch_size is None else int(batch_size)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'num_clusters, tol e batch_size devem ser numéricos'}), 400
+        if num_clusters < 1 or tol < 0 or (batch_size is not None and batch_size < 1):
+            return jsonify({'error': 'num_clusters e batch_size devem ser positivos e tol não negativo'}), 400
+        
+        kmeans_args = {'city_ids': city_ids, 'num_clusters': num_clusters, 'init': init, 'tol': tol,
+                       'batch_size': batch_size}
+        if data.get('async'):
+            return _submit_job('kmeans', kmeans_args)
         
         router = RoutingAlgorithms(db_name=DB_PATH)
-        clusters = router.kmeans(city_ids, num_clusters)
-        
-        # Obter informações das cidades para cada cluster
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        clusters_with_info = {}
-        for cluster_idx, c_ids in clusters.items():
-            cluster_cities = []
-            for city_id in c_ids:
-                cursor.execute("SELECT id, name, latitude, longitude FROM cities WHERE id = ?", (city_id,))
-                city_data = cursor.fetchone()
-                if city_data:
-                    cluster_cities.append({
-                        'id': city_data[0],
-                        'name': city_data[1],
-                        'latitude': city_data[2],
-                        'longitude': city_data[3]
-                    })
-            clusters_with_info[str(cluster_idx)] = cluster_cities
-        conn.close()
-        
-        return jsonify({'clusters': clusters_with_info}), 200
+        clusters = router.kmeans(**kmeans_args)
+        
+        return jsonify(_clusters_payload(clusters)), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+CLUSTER_METHODS = ('kmeans', 'dbscan')
+DEFAULT_DBSCAN_MIN_SAMPLES = 5
+
+
+@routing_bp.route('/route/cluster', methods=['POST'])
+def calculate_clusters():
+    """Agrupa cidades pelo método indicado em `?method=` (kmeans por omissão, ou dbscan).
+
+    Com dbscan os clusters são regiões densas: `eps_km` é o raio da
+    vizinhança e `min_samples` o número mínimo de cidades (incluindo a
+    própria) nesse raio para uma cidade ser núcleo. Sem `city_ids` agrupa
+    todas as cidades. As cidades fora de qualquer cluster vêm em `noise`.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        method = request.args.get('method', data.get('method', 'kmeans'))
+        if method not in CLUSTER_METHODS:
+            return jsonify({'error': f"method inválido. Use um de: {', '.join(CLUSTER_METHODS)}"}), 400
+        if method == 'kmeans':
+            return calculate_kmeans_clusters()
+
+        city_ids = data.get('city_ids')
+        try:
+            eps_km = float(data['eps_km'])
+            min_samples = int(data.get('min_samples', DEFAULT_DBSCAN_MIN_SAMPLES))
+        except KeyError:
+            return jsonify({'error': 'eps_km é obrigatório'}), 400
+        except (TypeError, ValueError):
+            return jsonify({'error': 'eps_km e min_samples devem ser numéricos'}), 400
+        if not eps_km >= MIN_EPS_KM or min_samples < 1:
+            return jsonify({'error': f'eps_km deve ser pelo menos {MIN_EPS_KM} e min_samples positivo'}), 400
+        if city_ids is not None and not isinstance(city_ids, list):
+            return jsonify({'error': 'city_ids deve ser uma lista'}), 400
+
+        router = RoutingAlgorithms(db_name=DB_PATH)
+        if city_ids is None:
+            city_ids = router.coordinates.ids.tolist()
+        missing = [city_id for city_id in dict.fromkeys(city_ids) if router.coordinates.get(city_id) is None]
+        if missing:
+            return jsonify({'error': f'Cidades não encontradas: {missing[:20]}'}), 400
+
+        clusters, noise = router.dbscan(city_ids, eps_km, min_samples)
+        return jsonify(_clusters_payload(clusters, noise)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def _clusters_payload(clusters, noise=None):
+    # Obter informações de todas as cidades numa só consulta e repartir pelos clusters
+    city_ids = [city_id for c_ids in clusters.values() for city_id in c_ids] + list(noise or [])
+    cities_by_id = {city['id']: city for city in fetch_cities(get_db(), city_ids)}
+    payload = {'clusters': {
+        str(cluster_idx): [cities_by_id[city_id] for city_id in c_ids if city_id in cities_by_id]
+        for cluster_idx, c_ids in clusters.items()
+    }}
+    if noise is not None:
+        payload['noise'] = [cities_by_id[city_id] for city_id in noise if city_id in cities_by_id]
+    return payload
+
+
+def _tsp_payload(tour, total_distance, details):
+    # Obter coordenadas de todas as cidades do tour numa só consulta
+    return {
+        'tour': fetch_cities(get_db(), tour),
+        'total_distance': total_distance,
+        **details
+    }
+
+
+MAX_TSP_TIME_BUDGET = 30.0  # Segundos máximos de melhoria local por pedido
+
+
 @routing_bp.route('/route/tsp', methods=['POST'])
 def calculate_tsp_route():
-    """Calcula a rota do Caixeiro Viajante usando o algoritmo do vizinho mais próximo."""
+    """Calcula a rota do Caixeiro Viajante (ótima com Held-Karp para poucas cidades; senão 2-opt/Or-opt)."""
     try:
         data = request.get_json()
         city_ids = data.get('city_ids')
         start_city_id = data.get('start_city_id')
+        improve = data.get('improve', True)
+        time_budget = data.get('time_budget', DEFAULT_TIME_BUDGET)
+        exact = data.get('exact')  # None = automático pelo número de cidades
         
         if not city_ids:
             return jsonify({'error': 'IDs de cidades são obrigatórios'}), 400
+        if not isinstance(improve, bool):
+            return jsonify({'error': 'improve deve ser true ou false'}), 400
+        if exact is not None and not isinstance(exact, bool):
+            return jsonify({'error': 'exact deve ser true ou false'}), 400
+        if exact and len(set(city_ids) | {start_city_id or city_ids[0]}) > HELD_KARP_MAX_CITIES:
+            return jsonify({'error': f'O TSP exato aceita no máximo {HELD_KARP_MAX_CITIES} cidades'}), 400
+        try:
+            time_budget = float(time_budget)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'time_budget deve ser numérico (segundos)'}), 400
+        if not 0 <= time_budget <= MAX_TSP_TIME_BUDGET:
+            return jsonify({'error': f'time_budget deve estar entre 0 e {MAX_TSP_TIME_BUDGET} segundos'}), 400
+        
+        if data.get('async'):
+            return _submit_job('tsp', {'city_ids': city_ids, 'start_city_id': start_city_id,
+                                       'time_budget': time_budget, 'improve': improve, 'exact': exact})
         
         router = RoutingAlgorithms(db_name=DB_PATH)
-        tour, total_distance = router.tsp_nearest_neighbor(city_ids, start_city_id)
+        cache_key = ('tsp', DB_PATH, tuple(city_ids), start_city_id, improve, time_budget, exact,
+                     _graph_version())
+        (tour, total_distance, details), cache_status = ROUTE_CACHE.get_or_compute(
+            cache_key, lambda: router.tsp(city_ids, start_city_id, time_budget=time_budget,
+                                          improve=improve, exact=exact))
         
         if not tour:
             return jsonify({'error': 'Caminho TSP não encontrado'}), 404
         
-        # Obter coordenadas para cada cidade no tour
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        tour_with_coords = []
-        for city_id in tour:
-            cursor.execute("SELECT id, name, latitude, longitude FROM cities WHERE id = ?", (city_id,))
-            city_data = cursor.fetchone()
-            if city_data:
-                tour_with_coords.append({
-                    'id': city_data[0],
-                    'name': city_data[1],
-                    'latitude': city_data[2],
-                    'longitude': city_data[3]
-                })
-        conn.close()
-        
+        return jsonify(_tsp_payload(tour, total_distance, details)), 200, {'X-Cache': cache_status}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+MAX_VRP_STOPS = 10000  # Paragens máximas por pedido em /route/vrp
+MAX_VRP_VEHICLES = 500
+
+
+@routing_bp.route('/route/vrp', methods=['POST'])
+def calculate_vrp_routes():
+    """Rotas de veículos com capacidade: paragens com procura, veículos com capacidade.
+
+    As paragens são agrupadas por veículo respeitando as capacidades, o tour
+    de cada veículo é resolvido (os das rotas grandes em paralelo em processos de trabalho) e as
+    rotas são reequilibradas deslocando paragens entre veículos.
+    """
+    try:
+        data = request.get_json()
+        depot_id = data.get('depot_id')
+        stops = data.get('stops')
+        vehicles = data.get('vehicles')
+        time_budget = data.get('time_budget', DEFAULT_TIME_BUDGET)
+        seed = data.get('seed')
+
+        if depot_id is None or not stops or not vehicles:
+            return jsonify({'error': 'depot_id, stops e vehicles são obrigatórios'}), 400
+        if not isinstance(stops, list) or not isinstance(vehicles, list):
+            return jsonify({'error': 'stops e vehicles devem ser listas'}), 400
+        if len(stops) > MAX_VRP_STOPS or len(vehicles) > MAX_VRP_VEHICLES:
+            return jsonify({'error': f'No máximo {MAX_VRP_STOPS} paragens e {MAX_VRP_VEHICLES} veículos'}), 400
+        try:
+            # Paragens: {"city_id": ..., "demand": ...} (procura 1 por omissão) ou só o id
+            stops = [(int(stop['city_id']), float(stop.get('demand', 1))) if isinstance(stop, dict)
+                     else (int(stop), 1.0) for stop in stops]
+            # Veículos: {"id": ..., "capacity": ...} ou só a capacidade
+            vehicles = [(vehicle.get('id', i), float(vehicle['capacity'])) if isinstance(vehicle, dict)
+                        else (i, float(vehicle)) for i, vehicle in enumerate(vehicles)]
+            time_budget = float(time_budget)
+            seed = None if seed is None else int(seed)
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Paragens precisam de city_id (e demand numérica) e veículos de capacity numérica'}), 400
+        if not 0 <= time_budget <= MAX_TSP_TIME_BUDGET:
+            return jsonify({'error': f'time_budget deve estar entre 0 e {MAX_TSP_TIME_BUDGET} segundos'}), 400
+
+        router = RoutingAlgorithms(db_name=DB_PATH)
+        missing = [city_id for city_id in dict.fromkeys([depot_id] + [city_id for city_id, _ in stops])
+                   if router.coordinates.get(city_id) is None]
+        if missing:
+            return jsonify({'error': f'Cidades não encontradas: {missing[:20]}'}), 400
+
+        try:
+            routes, details = router.vrp(depot_id, stops, [capacity for _, capacity in vehicles],
+                                         time_budget=time_budget, seed=seed)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Coordenadas de todas as cidades de todas as rotas numa só consulta
+        cities_by_id = {city['id']: city for city in
+                        fetch_cities(get_db(), [city_id for route in routes for city_id in route['tour']])}
         return jsonify({
-            'tour': tour_with_coords,
-            'total_distance': total_distance
+            'routes': [{
+                'vehicle_id': vehicle_id,
+                'capacity': capacity,
+                'load': route['load'],
+                'distance': route['distance'],
+                'tour': [cities_by_id[city_id] for city_id in route['tour']],
+            } for (vehicle_id, capacity), route in zip(vehicles, routes)],
+            'total_distance': sum(route['distance'] for route in routes),
+            **details
         }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+def _submit_job(kind, args):
+    # Modo assíncrono: o cálculo corre no pool de processos e o cliente consulta /jobs/<id>
+    try:
+        job = JobQueue.instance().submit(kind, DB_PATH, args)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '5'}
+    status_url = url_for('routing.get_job', job_id=job.id)
+    return jsonify({**job.to_dict(), 'status_url': status_url}), 202, {'Location': status_url}
+
+
+@routing_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Estado, progresso e (quando terminado) resultado de um job assíncrono."""
+    try:
+        job = JobQueue.instance().get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job não encontrado'}), 404
+        
+        response = job.to_dict()
+        if job.status == 'done':
+            if job.kind == 'kmeans':
+                response['result'] = _clusters_payload(job.result['clusters'])
+            else:
+                response['result'] = _tsp_payload(job.result['tour'], job.result['total_distance'],
+                                                   job.result['details'])
+        return jsonify(response), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@routing_bp.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancela um job: de imediato se ainda estiver na fila, no próximo ponto de progresso se já correr."""
+    try:
+        job = JobQueue.instance().cancel(job_id)
+        if job is None:
+            return jsonify({'error': 'Job não encontrado'}), 404
+        return jsonify(job.to_dict()), 202 if job.status == 'cancelling' else 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+MAX_MATRIX_CELLS = 4_000_000  # Origens x destinos máximos por pedido
+MAX_ROAD_MATRIX_ORIGINS = 1000  # Buscas de Dijkstra (uma por origem) máximas por pedido
+MATRIX_STREAM_CELLS = 250_000  # Acima disto a resposta JSON é enviada em streaming
+
+
+def _row_values(row):
+    # JSON não tem infinito: destinos inalcançáveis vão como null
+    return [value if value != math.inf else None for value in row.tolist()]
+
+
+@routing_bp.route('/matrix', methods=['POST'])
+def calculate_distance_matrix():
+    """Matriz de distâncias origens x destinos (km) numa só passagem.
+
+    Modo 'road': uma busca de Dijkstra um-para-muitos por origem; modo
+    'great_circle': haversine vetorizada; 'auto' escolhe 'road' se existir um
+    grafo de estradas. `format` é 'json' (padrão) ou 'binary' (float32
+    little-endian, linha a linha, forma nos cabeçalhos X-Matrix-Rows/Cols).
+    """
+    try:
+        data = request.get_json()
+        origins = data.get('origins')
+        destinations = data.get('destinations', origins)
+        mode = data.get('mode', 'auto')
+        output_format = data.get('format', 'json')
+        
+        if not origins or not destinations:
+            return jsonify({'error': 'Listas de origens e destinos são obrigatórias'}), 400
+        if not isinstance(origins, list) or not isinstance(destinations, list):
+            return jsonify({'error': 'origins e destinations devem ser listas de IDs de cidades'}), 400
+        if mode not in RoutingAlgorithms.MATRIX_MODES:
+            return jsonify({'error': f"Modo inválido. Use um de: {', '.join(RoutingAlgorithms.MATRIX_MODES)}"}), 400
+        if output_format not in ('json', 'binary'):
+            return jsonify({'error': "Formato inválido. Use 'json' ou 'binary'"}), 400
+        if len(origins) * len(destinations) > MAX_MATRIX_CELLS:
+            return jsonify({'error': f'A matriz pode ter no máximo {MAX_MATRIX_CELLS} células'}), 400
+        
+        router = RoutingAlgorithms(db_name=DB_PATH)
+        missing = [city_id for city_id in dict.fromkeys(origins + destinations) if router.coordinates.get(city_id) is None]
+        if missing:
+            return jsonify({'error': f'Cidades não encontradas: {missing[:20]}'}), 400
+        mode = router.resolve_matrix_mode(mode)
+        if mode == 'road' and len(origins) > MAX_ROAD_MATRIX_ORIGINS:
+            return jsonify({'error': f'O modo road aceita no máximo {MAX_ROAD_MATRIX_ORIGINS} origens'}), 400
+        
+        rows = router.iter_distance_matrix_rows(origins, destinations, mode)
+        headers = {'X-Matrix-Rows': str(len(origins)), 'X-Matrix-Cols': str(len(destinations)), 'X-Matrix-Mode': mode}
+        
+        if output_format == 'binary':
+            headers['X-Matrix-Dtype'] = 'float32-le'
+            return Response((np.asarray(row, dtype='<f4').tobytes() for row in rows),
+                            mimetype='application/octet-stream', headers=headers)
+        
+        if len(origins) * len(destinations) <= MATRIX_STREAM_CELLS:
+            return jsonify({
+                'origins': origins,
+                'destinations': destinations,
+                'mode': mode,
+                'distances': [_row_values(row) for row in rows]
+            }), 200, headers
+        
+        def generate():
+            yield json.dumps({'origins': origins, 'destinations': destinations, 'mode': mode})[:-1]
+            yield ', "distances": ['
+            for i, row in enumerate(rows):
+                yield (', ' if i else '') + json.dumps(_row_values(row))
+            yield ']}'
+        
+        return Response(generate(), mimetype='application/json', headers=headers)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@routing_bp.route('/cache/stats', methods=['GET'])
+def route_cache_stats():
+    """Contadores da cache de resultados de rotas (acertos, falhas, evicções)."""
+    return jsonify(ROUTE_CACHE.stats()), 200
+
+
+@routing_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Histogramas de latência (por endpoint e por etapa) e contadores, no formato de texto do Prometheus."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,20 +1,25 @@
 import sqlite3
 import math
 import heapq
-from collections import defaultdict
-import random
+import numpy as np
+import distance_engine
+import clustering_engine
+import tsp_solver
+import vrp_solver
+import metrics
+from coordinate_store import CoordinateStore
+from road_graph import RoadGraph
+from contraction_hierarchy import ContractionHierarchy
 
 class RoutingAlgorithms:
     def __init__(self, db_name='routing_system.db'):
         self.db_name = db_name
+        # Coordenadas carregadas uma vez por processo, partilhadas entre instâncias
+        self.coordinates = CoordinateStore.for_db(db_name)
+        self.road_graph = RoadGraph.for_db(db_name)
 
     def _get_city_coordinates(self, city_id):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT latitude, longitude FROM cities WHERE id = ?", (city_id,))
-        coords = cursor.fetchone()
-        conn.close()
-        return coords
+        return self.coordinates.get(city_id)
 
     def haversine_distance(self, lat1, lon1, lat2, lon2):
         R = 6371  # Raio da Terra em quilómetros
@@ -33,152 +38,369 @@ class RoutingAlgorithms:
         distance = R * c
         return distance
 
-    def dijkstra(self, start_city_id, end_city_id, all_city_ids):
-        graph = defaultdict(list)
-        city_coords = {}
-
-        for city_id in all_city_ids:
-            coords = self._get_city_coordinates(city_id)
-            if coords: 
-                city_coords[city_id] = coords
-            else:
+    def _points_for(self, city_ids):
+        # PointSet das cidades pedidas; None (com aviso) se alguma não existir
+        try:
+            return self.coordinates.points_for(city_ids)
+        except KeyError as missing:
+            print(f"Coordenadas não encontradas para a cidade ID: {missing.args[0]}")
+            return None
+
+    SHORTEST_PATH_ALGORITHMS = ('dijkstra', 'astar', 'bidirectional', 'bidirectional_astar', 'ch')
+
+    def _resolve_endpoints(self, graph, start_city_id, end_city_id):
+        start = graph.index_of(start_city_id)
+        end = graph.index_of(end_city_id)
+        for city_id, node in ((start_city_id, start), (end_city_id, end)):
+            if node is None:
                 print(f"Coordenadas não encontradas para a cidade ID: {city_id}")
-                return [], float('inf')
-
-        for i, city1_id in enumerate(all_city_ids):
-            for j, city2_id in enumerate(all_city_ids):
-                if city1_id != city2_id:
-                    lat1, lon1 = city_coords[city1_id]
-                    lat2, lon2 = city_coords[city2_id]
-                    distance = self.haversine_distance(lat1, lon1, lat2, lon2)
-                    graph[city1_id].append((city2_id, distance))
-
-        distances = {city_id: float('inf') for city_id in all_city_ids}
-        distances[start_city_id] = 0
-        previous_cities = {city_id: None for city_id in all_city_ids}
-        priority_queue = [(0, start_city_id)]
+                return None, None
+        return start, end
+
+    def _unidirectional_search(self, graph, start, end, heuristic=None, allowed=None):
+        # Dijkstra (heuristic=None) ou A* com heap binário sobre o grafo CSR.
+        # Retorna (caminho em índices de nó, distância, nós fixados).
+        distances = {start: 0.0}
+        previous = {start: None}
+        settled = set()
+        first_key = heuristic(start) if heuristic else 0.0
+        priority_queue = [(first_key, start)]
 
         while priority_queue:
-            current_distance, current_city_id = heapq.heappop(priority_queue)
-
-            if current_distance > distances[current_city_id]:
+            _, current = heapq.heappop(priority_queue)
+            if current in settled:
                 continue
+            settled.add(current)
+            if current == end:
+                break
 
-            for neighbor_city_id, weight in graph[current_city_id]:
+            current_distance = distances[current]
+            for neighbor, weight in graph.neighbors(current):
+                if neighbor in settled or (allowed is not None and neighbor not in allowed):
+                    continue
                 distance = current_distance + weight
-                if distance < distances[neighbor_city_id]:
-                    distances[neighbor_city_id] = distance
-                    previous_cities[neighbor_city_id] = current_city_id
-                    heapq.heappush(priority_queue, (distance, neighbor_city_id))
-
-        path = []
-        current = end_city_id
-        while current is not None:
-            path.insert(0, current)
-            current = previous_cities[current]
-
-        if not path or path[0] != start_city_id:
-            return [], float('inf')
+                if distance < distances.get(neighbor, float('inf')):
+                    distances[neighbor] = distance
+                    previous[neighbor] = current
+                    key = distance + heuristic(neighbor) if heuristic else distance
+                    heapq.heappush(priority_queue, (key, neighbor))
+
+        if end not in settled:
+            return [], float('inf'), len(settled)
+        return self._walk_back(previous, end), distances[end], len(settled)
+
+    @staticmethod
+    def _walk_back(previous, node):
+        # Caminho (da origem até `node`) seguindo os predecessores
+        with metrics.timed('path_reconstruction'):
+            path = []
+            while node is not None:
+                path.append(node)
+                node = previous[node]
+            path.reverse()
+            return path
+
+    def _bidirectional_search(self, graph, start, end, potential=None, allowed=None):
+        # Dijkstra bidirecional; com `potential` p(v) torna-se A* bidirecional
+        # (chaves d_f(v) + p(v) para a frente e d_b(v) - p(v) para trás).
+        # Pára quando min_f + min_b >= melhor caminho encontrado (mu).
+        if start == end:
+            return [start], 0.0, 1
+
+        p = potential if potential else (lambda node: 0.0)
+        directions = (
+            {'dist': {start: 0.0}, 'prev': {start: None}, 'settled': set(),
+             'heap': [(p(start), start)], 'edges': graph.neighbors, 'sign': 1.0},
+            {'dist': {end: 0.0}, 'prev': {end: None}, 'settled': set(),
+             'heap': [(-p(end), end)], 'edges': graph.reverse_neighbors, 'sign': -1.0},
+        )
+        best = float('inf')
+        meeting = None
+
+        while directions[0]['heap'] and directions[1]['heap']:
+            if directions[0]['heap'][0][0] + directions[1]['heap'][0][0] >= best:
+                break
+            # Expande o lado com a fronteira mais pequena
+            side = 0 if len(directions[0]['heap']) <= len(directions[1]['heap']) else 1
+            this, other = directions[side], directions[1 - side]
 
-        return path, distances[end_city_id]
+            _, current = heapq.heappop(this['heap'])
+            if current in this['settled']:
+                continue
+            this['settled'].add(current)
 
-    def kmeans(self, city_ids, num_clusters, max_iterations=100):
+            current_distance = this['dist'][current]
+            for neighbor, weight in this['edges'](current):
+                if neighbor in this['settled'] or (allowed is not None and neighbor not in allowed):
+                    continue
+                distance = current_distance + weight
+                if distance < this['dist'].get(neighbor, float('inf')):
+                    this['dist'][neighbor] = distance
+                    this['prev'][neighbor] = current
+                    heapq.heappush(this['heap'], (distance + this['sign'] * p(neighbor), neighbor))
+                if neighbor in other['dist'] and distance + other['dist'][neighbor] < best:
+                    best = distance + other['dist'][neighbor]
+                    meeting = neighbor
+
+        settled_count = len(directions[0]['settled']) + len(directions[1]['settled'])
+        if meeting is None:
+            return [], float('inf'), settled_count
+
+        # Do início até ao encontro pela busca para a frente; do encontro ao fim pela de trás
+        path = self._walk_back(directions[0]['prev'], meeting)
+        path.extend(reversed(self._walk_back(directions[1]['prev'], directions[1]['prev'][meeting])))
+        return path, best, settled_count
+
+    def shortest_path(self, start_city_id, end_city_id, algorithm='dijkstra', all_city_ids=None):
+        """Caminho mais curto no grafo de estradas com o algoritmo escolhido.
+
+        `algorithm` é um de SHORTEST_PATH_ALGORITHMS. Retorna
+        (caminho em ids de cidade, distância, número de nós fixados). 'ch'
+        usa a hierarquia de contração pré-processada (ver contraction_hierarchy)
+        e lança HierarchyUnavailable se ela não existir ou estiver desatualizada.
+        """
+        if algorithm not in self.SHORTEST_PATH_ALGORITHMS:
+            raise ValueError(f"Algoritmo desconhecido: {algorithm}")
+
+        metrics.PATH_QUERIES.inc(algorithm=algorithm)
+        if algorithm == 'ch':
+            if all_city_ids is not None:
+                raise ValueError("A hierarquia de contração não suporta restringir a busca a um subconjunto")
+            with metrics.timed('graph_load'):
+                hierarchy = ContractionHierarchy.for_db(self.db_name).ensure_loaded()
+            with metrics.timed('search', algorithm=algorithm):
+                path, distance, settled = hierarchy.query(start_city_id, end_city_id)
+            metrics.NODES_SETTLED.inc(settled, algorithm=algorithm)
+            return path, distance, settled
+
+        with metrics.timed('graph_load'):
+            graph = self.road_graph.ensure_loaded()
+        start, end = self._resolve_endpoints(graph, start_city_id, end_city_id)
+        if start is None:
+            return [], float('inf'), 0
+
+        allowed = None
+        if all_city_ids is not None:
+            allowed = {graph.index_of(city_id) for city_id in all_city_ids}
+
+        # O tempo de 'search' inclui o de 'path_reconstruction' (medido à parte dentro da busca)
+        with metrics.timed('search', algorithm=algorithm):
+            if algorithm == 'dijkstra':
+                path, distance, settled = self._unidirectional_search(graph, start, end, allowed=allowed)
+            elif algorithm == 'astar':
+                path, distance, settled = self._unidirectional_search(
+                    graph, start, end, heuristic=graph.great_circle_to(end), allowed=allowed)
+            elif algorithm == 'bidirectional':
+                path, distance, settled = self._bidirectional_search(graph, start, end, allowed=allowed)
+            else:
+                # Potencial médio (h_t - h_s) / 2: consistente nas duas direções
+                to_end = graph.great_circle_to(end)
+                to_start = graph.great_circle_to(start)
+                path, distance, settled = self._bidirectional_search(
+                    graph, start, end, potential=lambda node: 0.5 * (to_end(node) - to_start(node)), allowed=allowed)
+        metrics.NODES_SETTLED.inc(settled, algorithm=algorithm)
+
+        return [int(graph.node_ids[node]) for node in path], distance, settled
+
+    def dijkstra(self, start_city_id, end_city_id, all_city_ids=None):
+        # Dijkstra com heap binário sobre o grafo esparso (CSR) da tabela edges.
+        # O custo é proporcional à região explorada, não ao número de cidades.
+        # `all_city_ids`, se indicado, restringe a busca a esse subconjunto.
+        path, distance, _ = self.shortest_path(start_city_id, end_city_id, 'dijkstra', all_city_ids)
+        return path, distance
+
+    def astar(self, start_city_id, end_city_id, all_city_ids=None):
+        # A* com a distância de grande círculo até ao destino como heurística
+        path, distance, _ = self.shortest_path(start_city_id, end_city_id, 'astar', all_city_ids)
+        return path, distance
+
+    MATRIX_MODES = ('auto', 'road', 'great_circle')
+
+    def _one_to_many_search(self, graph, source, targets):
+        # Dijkstra a partir de `source` que pára quando todos os `targets` estão fixados
+        remaining = set(targets)
+        distances = {source: 0.0}
+        settled = set()
+        priority_queue = [(0.0, source)]
+
+        while priority_queue and remaining:
+            current_distance, current = heapq.heappop(priority_queue)
+            if current in settled:
+                continue
+            settled.add(current)
+            remaining.discard(current)
+            for neighbor, weight in graph.neighbors(current):
+                distance = current_distance + weight
+                if distance < distances.get(neighbor, math.inf):
+                    distances[neighbor] = distance
+                    heapq.heappush(priority_queue, (distance, neighbor))
+
+        return np.fromiter((distances.get(target, math.inf) for target in targets),
+                           dtype=np.float64, count=len(targets))
+
+    def resolve_matrix_mode(self, mode='auto'):
+        # 'auto': rede de estradas se já existir um grafo; senão grande círculo vetorizado
+        if mode not in self.MATRIX_MODES:
+            raise ValueError(f"Modo de matriz desconhecido: {mode}")
+        if mode == 'auto':
+            return 'road' if self.road_graph.has_edges() else 'great_circle'
+        return mode
+
+    def iter_distance_matrix_rows(self, origin_ids, destination_ids, mode='auto'):
+        """Produz, linha a linha, as distâncias (km) de cada origem a todos os destinos.
+
+        Em modo 'road' cada linha é uma única busca de Dijkstra um-para-muitos
+        (inf para destinos inalcançáveis); em 'great_circle' as linhas vêm de
+        blocos da matriz de haversine vetorizada.
+        """
+        mode = self.resolve_matrix_mode(mode)
+        if mode == 'great_circle':
+            origins = self.coordinates.points_for(origin_ids)
+            destinations = self.coordinates.points_for(destination_ids)
+            # Blocos de linhas com ~DEFAULT_BLOCK_SIZE² elementos cada
+            block = max(1, distance_engine.DEFAULT_BLOCK_SIZE ** 2 // max(len(destinations), 1))
+            for start in range(0, len(origins), block):
+                yield from distance_engine.distance_matrix(origins.take(slice(start, start + block)), destinations)
+            return
+
+        graph = self.road_graph.ensure_loaded()
+        nodes = []
+        for city_id in list(origin_ids) + list(destination_ids):
+            node = graph.index_of(city_id)
+            if node is None:
+                raise KeyError(city_id)
+            nodes.append(node)
+        origin_nodes, target_nodes = nodes[:len(origin_ids)], nodes[len(origin_ids):]
+        for source in origin_nodes:
+            yield self._one_to_many_search(graph, source, target_nodes)
+
+    def distance_matrix(self, origin_ids, destination_ids, mode='auto'):
+        """Matriz (origens x destinos) de distâncias em km, como array NumPy."""
+        rows = list(self.iter_distance_matrix_rows(origin_ids, destination_ids, mode))
+        if not rows:
+            return np.empty((0, len(destination_ids)))
+        return np.vstack(rows)
+
+    def kmeans(self, city_ids, num_clusters, max_iterations=clustering_engine.DEFAULT_MAX_ITERATIONS,
+               init='k-means++', tol=clustering_engine.DEFAULT_TOL_KM, batch_size=None, seed=None,
+               progress=None):
         if len(city_ids) < num_clusters:
             return {i: [city_id] for i, city_id in enumerate(city_ids)}
 
-        city_data = {}
-        for city_id in city_ids:
-            coords = self._get_city_coordinates(city_id)
-            if coords: 
-                city_data[city_id] = list(coords)
-            else:
-                print(f"Coordenadas não encontradas para a cidade ID: {city_id}")
-                return {}
-
-        centroids = random.sample(list(city_data.values()), num_clusters)
-
-        for _ in range(max_iterations):
-            clusters = defaultdict(list)
-            for city_id, (lat, lon) in city_data.items():
-                min_distance = float('inf')
-                closest_centroid_idx = -1
-                for i, (c_lat, c_lon) in enumerate(centroids):
-                    dist = self.haversine_distance(lat, lon, c_lat, c_lon)
-                    if dist < min_distance:
-                        min_distance = dist
-                        closest_centroid_idx = i
-                clusters[closest_centroid_idx].append(city_id)
-
-            new_centroids = []
-            for i in range(num_clusters):
-                if clusters[i]:
-                    cluster_lats = [city_data[city_id][0] for city_id in clusters[i]]
-                    cluster_lons = [city_data[city_id][1] for city_id in clusters[i]]
-                    new_centroids.append([
-                        sum(cluster_lats) / len(cluster_lats),
-                        sum(cluster_lons) / len(cluster_lons)
-                    ])
-                else:
-                    new_centroids.append(random.choice(list(city_data.values())))
-            
-            if new_centroids == centroids:
-                break
-            centroids = new_centroids
-        
-        return clusters
-
-    def tsp_nearest_neighbor(self, city_ids, start_city_id=None):
+        city_ids = list(dict.fromkeys(city_ids))
+        points = self._points_for(city_ids)
+        if points is None:
+            return {}
+
+        # K-means esférico sobre vetores unitários (ver clustering_engine)
+        with metrics.timed('kmeans'):
+            result = clustering_engine.spherical_kmeans(
+                points.unit_vectors(), num_clusters, init=init, tol=tol,
+                max_iterations=max_iterations, batch_size=batch_size, seed=seed, callback=progress)
+
+        ids = np.asarray(city_ids)
+        order = np.argsort(result.labels, kind='stable')
+        labels = result.labels[order]
+        boundaries = np.flatnonzero(np.diff(labels)) + 1
+        return {int(group[0]): ids[members].tolist()
+                for group, members in zip(np.split(labels, boundaries), np.split(order, boundaries))}
+
+    def dbscan(self, city_ids, eps_km, min_samples):
+        """Clusters por densidade (DBSCAN) com a vizinhança-eps respondida pela grelha espacial.
+
+        Retorna (clusters, ruído): {índice do cluster: [ids]} e a lista dos
+        ids que não pertencem a nenhum cluster.
+        """
         if not city_ids:
-            return [], 0
+            return {}, []
 
+        city_ids = list(dict.fromkeys(city_ids))
+        points = self._points_for(city_ids)
+        if points is None:
+            return {}, []
+
+        with metrics.timed('dbscan'):
+            result = clustering_engine.dbscan(points.unit_vectors(), eps_km, min_samples)
+
+        ids = np.asarray(city_ids)
+        order = np.argsort(result.labels, kind='stable')
+        labels = result.labels[order]
+        boundaries = np.flatnonzero(np.diff(labels)) + 1
+        clusters = {int(group[0]): ids[members].tolist()
+                    for group, members in zip(np.split(labels, boundaries), np.split(order, boundaries))}
+        return clusters, clusters.pop(clustering_engine.NOISE, [])
+
+    def _nearest_neighbor_order(self, points):
+        # Ordem gulosa (índices em `points`) a partir do índice 0 e o comprimento do ciclo
+        return tsp_solver.nearest_neighbor_order(points)
+
+    def _tsp_points(self, city_ids, start_city_id):
         if start_city_id is None:
             start_city_id = city_ids[0]
+        city_ids = list(dict.fromkeys([start_city_id] + list(city_ids)))
+        return city_ids, self._points_for(city_ids)
 
-        unvisited_cities = set(city_ids)
-        current_city = start_city_id
-        tour = [current_city]
-        unvisited_cities.remove(current_city)
-        total_distance = 0
-
-        while unvisited_cities:
-            min_distance = float('inf')
-            nearest_city = None
-            
-            current_coords = self._get_city_coordinates(current_city)
-            if not current_coords:
-                print(f"Coordenadas não encontradas para a cidade ID: {current_city}")
-                return [], float('inf')
-            current_lat, current_lon = current_coords
-
-            for city_id in unvisited_cities:
-                city_coords = self._get_city_coordinates(city_id)
-                if not city_coords:
-                    print(f"Coordenadas não encontradas para a cidade ID: {city_id}")
-                    return [], float('inf')
-                lat, lon = city_coords
-                
-                distance = self.haversine_distance(current_lat, current_lon, lat, lon)
-                if distance < min_distance:
-                    min_distance = distance
-                    nearest_city = city_id
-            
-            if nearest_city is None:
-                break
+    def tsp_nearest_neighbor(self, city_ids, start_city_id=None):
+        if not city_ids:
+            return [], 0
 
-            tour.append(nearest_city)
-            unvisited_cities.remove(nearest_city)
-            total_distance += min_distance
-            current_city = nearest_city
+        city_ids, points = self._tsp_points(city_ids, start_city_id)
+        if points is None:
+            return [], float('inf')
 
+        order, total_distance = self._nearest_neighbor_order(points)
+        tour = [city_ids[i] for i in order]
         if len(tour) > 1:
-            start_coords = self._get_city_coordinates(tour[0])
-            end_coords = self._get_city_coordinates(tour[-1])
-            if start_coords and end_coords:
-                total_distance += self.haversine_distance(end_coords[0], end_coords[1], start_coords[0], start_coords[1])
-                tour.append(tour[0])
+            tour.append(tour[0])
 
         return tour, total_distance
 
+    def tsp(self, city_ids, start_city_id=None, time_budget=tsp_solver.DEFAULT_TIME_BUDGET, improve=True,
+            exact=None, progress=None):
+        """Tour do Caixeiro Viajante.
+
+        Com até HELD_KARP_MAX_CITIES cidades (ou `exact=True`) devolve o tour
+        ótimo (Held-Karp); acima disso, o vizinho mais próximo melhorado com
+        2-opt/Or-opt. `progress(fração, etapa)` é passado a
+        tsp_solver.solve_tour. Retorna (tour, distância total, detalhes), em
+        que os detalhes incluem a distância do tour guloso (`initial_distance`).
+        """
+        if not city_ids:
+            return [], 0, {}
+
+        city_ids, points = self._tsp_points(city_ids, start_city_id)
+        if points is None:
+            return [], float('inf'), {}
+
+        with metrics.timed('tsp'):
+            order, total_distance, details = tsp_solver.solve_tour(points, time_budget, improve, exact,
+                                                                   progress=progress)
+
+        tour = [city_ids[i] for i in order]
+        if len(tour) > 1:
+            tour.append(tour[0])
+
+        return tour, total_distance, details
+
+    def vrp(self, depot_id, stops, capacities, time_budget=tsp_solver.DEFAULT_TIME_BUDGET, seed=None,
+            max_workers=vrp_solver.DEFAULT_MAX_WORKERS):
+        """Rotas de veículos com capacidade a partir de um depósito (ver vrp_solver).
+
+        `stops` é uma lista de (city_id, procura) e `capacities` a capacidade de
+        cada veículo. Retorna (rotas, detalhes), com uma rota por veículo:
+        tour em ids de cidade (começa e acaba no depósito; vazio se o veículo
+        não for usado), distância e carga.
+        """
+        city_ids = [depot_id] + [city_id for city_id, _ in stops]
+        points = self.coordinates.points_for(city_ids)
+        with metrics.timed('vrp'):
+            routes, details = vrp_solver.solve_vrp(points, [demand for _, demand in stops], capacities,
+                                                   time_budget=time_budget, seed=seed, max_workers=max_workers)
+        return [{
+            'tour': [city_ids[i] for i in tour] + [depot_id] if len(tour) > 1 else [],
+            'distance': distance,
+            'load': load,
+        } for tour, distance, load in routes], details
 
 if __name__ == '__main__':
     router = RoutingAlgorithms()
@@ -245,3 +467,9 @@ if __name__ == '__main__':
                 print(f"Caminho TSP: {' -> '.join(tsp_path_names)}")
                 print(f"Distância total TSP: {tsp_distance:.2f} km")
 
+            tsp_path, tsp_distance, details = router.tsp(european_city_ids, start_city_id=city_name_to_id['Lisboa'])
+            if tsp_path:
+                tsp_path_names = [city_id_to_name[city_id] for city_id in tsp_path]
+                print(f"Caminho TSP ({details['method']}): {' -> '.join(tsp_path_names)}")
+                print(f"Distância total TSP: {details['initial_distance']:.2f} km -> {tsp_distance:.2f} km")
+
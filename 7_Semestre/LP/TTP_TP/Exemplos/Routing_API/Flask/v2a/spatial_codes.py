@@ -0,0 +1,95 @@
+import numpy as np
+
+# 31 níveis x 2 bits = 62 bits: cabe num INTEGER (inteiro de 64 bits com sinal) do SQLite
+MORTON_LEVELS = 31
+_GRID_SIZE = 1 << MORTON_LEVELS
+
+
+def _part1by1(values):
+    # Intercala um bit a zero entre cada bit dos 32 bits inferiores
+    values = values.astype(np.uint64) & np.uint64(0x00000000FFFFFFFF)
+    values = (values | (values << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x3333333333333333)
+    values = (values | (values << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return values
+
+
+def _compact1by1(values):
+    values = values.astype(np.uint64) & np.uint64(0x5555555555555555)
+    values = (values | (values >> np.uint64(1))) & np.uint64(0x3333333333333333)
+    values = (values | (values >> np.uint64(2))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    values = (values | (values >> np.uint64(4))) & np.uint64(0x00FF00FF00FF00FF)
+    values = (values | (values >> np.uint64(8))) & np.uint64(0x0000FFFF0000FFFF)
+    values = (values | (values >> np.uint64(16))) & np.uint64(0x00000000FFFFFFFF)
+    return values
+
+
+def grid_cells(latitudes, longitudes, level=MORTON_LEVELS):
+    """Células inteiras (linha, coluna) da grelha 2^level x 2^level de cada ponto."""
+    size = 1 << level
+    norm_lat = (np.asarray(latitudes, dtype=np.float64) + 90) / 180
+    norm_lon = (np.asarray(longitudes, dtype=np.float64) + 180) / 360
+    rows = np.clip(np.floor(norm_lat * size), 0, size - 1).astype(np.int64)
+    cols = np.clip(np.floor(norm_lon * size), 0, size - 1).astype(np.int64)
+    return rows, cols
+
+
+def morton_encode(latitudes, longitudes):
+    """Código de Morton (Z-order) de 62 bits, com a mesma ordem dos quadkeys.
+
+    Em cada nível o bit da latitude é o mais significativo do par, tal como no
+    dígito do quadkey (0 = Sudoeste, 1 = Sudeste, 2 = Noroeste, 3 = Nordeste),
+    pelo que os primeiros `l` pares de bits são o quadkey de nível `l`.
+    Aceita escalares ou arrays.
+    """
+    rows, cols = grid_cells(latitudes, longitudes)
+    codes = (_part1by1(rows) << np.uint64(1)) | _part1by1(cols)
+    codes = codes.astype(np.int64)
+    return int(codes) if codes.ndim == 0 else codes
+
+
+def morton_decode(codes):
+    """Centro (latitude, longitude) da célula de nível máximo de cada código."""
+    codes = np.asarray(codes, dtype=np.int64).astype(np.uint64)
+    rows = _compact1by1(codes >> np.uint64(1)).astype(np.float64)
+    cols = _compact1by1(codes).astype(np.float64)
+    latitudes = (rows + 0.5) / _GRID_SIZE * 180 - 90
+    longitudes = (cols + 0.5) / _GRID_SIZE * 360 - 180
+    return latitudes, longitudes
+
+
+def quadkey_to_morton_range(quadkey):
+    """Intervalo [início, fim) de códigos de Morton contidos no quadrante `quadkey`."""
+    shift = 2 * (MORTON_LEVELS - len(quadkey))
+    prefix = int(quadkey, 4) if quadkey else 0
+    return prefix << shift, (prefix + 1) << shift
+
+
+def morton_to_quadkey(code, level):
+    """Quadkey de nível `level` que contém o código de Morton dado."""
+    digits = []
+    for i in range(level):
+        shift = 2 * (MORTON_LEVELS - 1 - i)
+        digits.append(str((int(code) >> shift) & 3))
+    return ''.join(digits)
+
+
+def morton_quadkeys(codes, level):
+    """Quadkeys de nível `level` de um array de códigos (vetorizado).
+
+    Os quadkeys dos níveis inferiores são prefixos destes.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    shifts = 2 * (MORTON_LEVELS - 1 - np.arange(level, dtype=np.int64))
+    digits = ((codes[:, None] >> shifts[None, :]) & 3).astype(np.uint8) + ord('0')
+    return [key.decode('ascii') for key in np.ascontiguousarray(digits).view(f'S{level}').ravel()]
+
+
+def cell_quadkey(row, col, level):
+    """Quadkey da célula (linha, coluna) da grelha 2^level x 2^level."""
+    digits = []
+    for bit in range(level - 1, -1, -1):
+        digits.append(str((((row >> bit) & 1) << 1) | ((col >> bit) & 1)))
+    return ''.join(digits)
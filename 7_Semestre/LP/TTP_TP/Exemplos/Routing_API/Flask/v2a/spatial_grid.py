@@ -0,0 +1,171 @@
+import numpy as np
+
+from distance_engine import EARTH_RADIUS_KM
+
+KNN_BLOCK_PAIRS = 1_000_000  # Pares (ponto, candidato) comparados de cada vez em knn()
+
+
+def chord_to_km(chord):
+    # Converte a corda na esfera unitária em distância de grande círculo (km)
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2.0, 0.0, 1.0))
+
+
+def km_to_chord(distance_km):
+    return 2.0 * np.sin(np.minimum(np.asarray(distance_km, dtype=np.float64) / (2.0 * EARTH_RADIUS_KM), np.pi / 2))
+
+
+class UnitVectorGrid:
+    """Grelha uniforme 3D sobre os vetores unitários dos pontos.
+
+    Trabalhar em (x, y, z) evita os casos especiais dos polos e do
+    antimeridiano: a corda entre dois vetores é monótona com a distância de
+    grande círculo. Qualquer ponto a uma corda menor que `cell_size` de p
+    está numa das 27 células vizinhas da célula de p.
+    """
+
+    def __init__(self, vectors, cell_size):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float64)
+        self.cell_size = float(cell_size)
+
+        # A grelha cobre o cubo [-1, 1]³ inteiro, com uma célula de margem, para
+        # que qualquer vetor unitário (e as suas 26 células vizinhas) tenha chave válida
+        self._shift = int(np.floor(-1.0 / self.cell_size)) - 1
+        extent = int(np.floor(1.0 / self.cell_size)) - self._shift + 2
+        self._dims = np.array([extent, extent, extent], dtype=np.int64)
+        keys = self.cell_key(self.vectors)
+
+        self._order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[self._order]
+        self.cell_keys, self._starts, counts = np.unique(sorted_keys, return_index=True, return_counts=True)
+        self._ends = self._starts + counts
+        self.point_keys = keys
+
+    @classmethod
+    def for_neighbors(cls, vectors, k):
+        # Tamanho de célula para ~k vizinhos por célula numa distribuição uniforme
+        n = max(len(vectors), 1)
+        cell_size = min(2.0, 5.0 * np.sqrt(max(k, 1) / n))
+        return cls(vectors, cell_size)
+
+    def cell_key(self, vectors):
+        """Chave linear da célula de cada vetor (aceita um vetor ou um array (n, 3))."""
+        cells = np.floor(np.asarray(vectors, dtype=np.float64) / self.cell_size).astype(np.int64) - self._shift
+        dy, dz = self._dims[1], self._dims[2]
+        return (cells[..., 0] * dy + cells[..., 1]) * dz + cells[..., 2]
+
+    def _neighbor_keys(self, key, rings=1):
+        dy, dz = int(self._dims[1]), int(self._dims[2])
+        r = np.arange(-rings, rings + 1)
+        offsets = (r[:, None, None] * dy + r[None, :, None]) * dz + r[None, None, :]
+        return key + offsets.ravel()
+
+    def neighbor_cells(self, rings=1):
+        """Vizinhança de todas as células ocupadas de uma só vez.
+
+        Retorna (posições, existe), ambos com forma (células, (2·rings + 1)³):
+        a posição em `cell_keys` de cada célula vizinha e se ela está ocupada.
+        """
+        neighbor_keys = self.cell_keys[:, None] + self._neighbor_keys(0, rings)[None, :]
+        neighbor_positions = np.searchsorted(self.cell_keys, neighbor_keys)
+        np.minimum(neighbor_positions, len(self.cell_keys) - 1, out=neighbor_positions)
+        return neighbor_positions, self.cell_keys[neighbor_positions] == neighbor_keys
+
+    def members_at(self, position):
+        """Índices dos pontos da célula na posição `position` de `cell_keys`."""
+        return self._order[self._starts[position]:self._ends[position]]
+
+    def members_of(self, positions):
+        """Índices dos pontos de várias células (posições em `cell_keys`), concatenados."""
+        starts = self._starts[positions]
+        lengths = self._ends[positions] - starts
+        # Cada célula é uma fatia contígua de _order: índices = início da fatia + deslocamento
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return self._order[offsets + np.arange(len(offsets))]
+
+    def cell_sizes(self):
+        """Número de pontos de cada célula ocupada (pela ordem de `cell_keys`)."""
+        return self._ends - self._starts
+
+    def cell_members(self, key):
+        position = np.searchsorted(self.cell_keys, key)
+        if position == len(self.cell_keys) or self.cell_keys[position] != key:
+            return np.empty(0, dtype=np.int64)
+        return self._order[self._starts[position]:self._ends[position]]
+
+    def candidates_around(self, key, rings=1):
+        """Índices dos pontos nas células a até `rings` células de distância de `key`."""
+        keys = self._neighbor_keys(key, rings)
+        keys = keys[np.isin(keys, self.cell_keys, assume_unique=True)]
+        if len(keys) == 0:
+            return np.empty(0, dtype=np.int64)
+        positions = np.searchsorted(self.cell_keys, keys)
+        return np.concatenate([self._order[self._starts[p]:self._ends[p]] for p in positions])
+
+    def query_radius(self, vector, radius):
+        """Índices dos pontos a uma corda <= `radius` do vetor dado."""
+        key = int(self.cell_key(vector))
+        rings = max(1, int(np.ceil(radius / self.cell_size)))
+        candidates = self.candidates_around(key, rings)
+        if len(candidates) == 0:
+            return candidates
+        diff = self.vectors[candidates] - vector
+        return candidates[np.einsum('ij,ij->i', diff, diff) <= radius * radius]
+
+    def knn(self, k):
+        """k vizinhos mais próximos de cada ponto (excluindo o próprio).
+
+        Retorna (indices, cordas), ambos com forma (n, k'), k' = min(k, n - 1),
+        ordenados por distância crescente.
+        """
+        n = len(self.vectors)
+        k = min(k, n - 1)
+        neighbors = np.full((n, max(k, 0)), -1, dtype=np.int64)
+        chords = np.full((n, max(k, 0)), np.inf)
+        if k <= 0:
+            return neighbors, chords
+
+        neighbor_positions, neighbor_exists = self.neighbor_cells()
+
+        unresolved = []
+        for position in range(len(self.cell_keys)):
+            cell_members = self.members_at(position)
+            candidates = self.members_of(neighbor_positions[position][neighbor_exists[position]])
+            if len(candidates) - 1 < k:
+                unresolved.extend(cell_members.tolist())
+                continue
+            # Células muito densas (aglomerados) são tratadas em blocos de pontos para
+            # limitar a memória do array de diferenças a ~KNN_BLOCK_PAIRS x 3
+            block = max(1, KNN_BLOCK_PAIRS // len(candidates))
+            for start in range(0, len(cell_members), block):
+                unresolved.extend(self._knn_block(cell_members[start:start + block], candidates, k, neighbors, chords))
+
+        # Pontos isolados: força bruta vetorizada contra todos os pontos
+        for i in unresolved:
+            diff = self.vectors - self.vectors[i]
+            squared = np.einsum('ij,ij->i', diff, diff)
+            squared[i] = np.inf
+            nearest = np.argpartition(squared, k - 1)[:k]
+            nearest = nearest[np.argsort(squared[nearest])]
+            neighbors[i] = nearest
+            chords[i] = np.sqrt(squared[nearest])
+
+        return neighbors, chords
+
+    def _knn_block(self, members, candidates, k, neighbors, chords):
+        # k vizinhos de `members` entre `candidates`, escritos em neighbors/chords;
+        # retorna os pontos que as células vizinhas não chegam para resolver
+        diff = self.vectors[members][:, None, :] - self.vectors[candidates][None, :, :]
+        squared = np.einsum('ijk,ijk->ij', diff, diff)
+        squared[members[:, None] == candidates[None, :]] = np.inf
+
+        nearest = np.argpartition(squared, k - 1, axis=1)[:, :k]
+        nearest_sq = np.take_along_axis(squared, nearest, axis=1)
+        order = np.argsort(nearest_sq, axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearest_sq = np.take_along_axis(nearest_sq, order, axis=1)
+
+        # Só é exato se o k-ésimo vizinho estiver dentro do raio coberto pelas 27 células
+        exact = nearest_sq[:, -1] <= self.cell_size * self.cell_size
+        neighbors[members[exact]] = candidates[nearest[exact]]
+        chords[members[exact]] = np.sqrt(nearest_sq[exact])
+        return members[~exact].tolist()
@@ -0,0 +1,209 @@
+import math
+
+import numpy as np
+
+from distance_engine import EARTH_RADIUS_KM, haversine
+
+# Relação entre um quadrante (caixa lat/lon) e uma forma
+OUTSIDE, PARTIAL, INSIDE = 0, 1, 2
+
+MAX_POLYGON_VERTICES = 10000  # Vértices máximos (somando todos os anéis) de um polígono
+CONTAINS_BLOCK_PAIRS = 1_000_000  # Pares (ponto, aresta) avaliados de cada vez no ponto-em-polígono
+
+
+def _check_coordinates(latitudes, longitudes):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if not (np.isfinite(latitudes).all() and np.isfinite(longitudes).all()):
+        raise ValueError("Coordenadas inválidas")
+    if (np.abs(latitudes) > 90).any() or (np.abs(longitudes) > 180).any():
+        raise ValueError("Latitudes devem estar em [-90, 90] e longitudes em [-180, 180]")
+    return latitudes, longitudes
+
+
+class BoundingBox:
+    """Caixa lat/lon. Com min_lon > max_lon a caixa atravessa o antimeridiano
+    (por exemplo 170 -> -170) e é tratada como a união de duas caixas."""
+
+    def __init__(self, min_lat, max_lat, min_lon, max_lon):
+        self.min_lat, self.max_lat = float(min_lat), float(max_lat)
+        if min_lon <= max_lon:
+            self.lon_ranges = ((float(min_lon), float(max_lon)),)
+        else:
+            self.lon_ranges = ((float(min_lon), 180.0), (-180.0, float(max_lon)))
+
+    def classify(self, lat0, lat1, lon0, lon1):
+        if lat0 > self.max_lat or lat1 < self.min_lat:
+            return OUTSIDE
+        lat_inside = self.min_lat <= lat0 and lat1 <= self.max_lat
+        result = OUTSIDE
+        for min_lon, max_lon in self.lon_ranges:
+            if lon0 > max_lon or lon1 < min_lon:
+                continue
+            if lat_inside and min_lon <= lon0 and lon1 <= max_lon:
+                return INSIDE
+            result = PARTIAL
+        return result
+
+    def contains(self, latitudes, longitudes):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        mask = np.zeros(latitudes.shape, dtype=bool)
+        for min_lon, max_lon in self.lon_ranges:
+            mask |= (longitudes >= min_lon) & (longitudes <= max_lon)
+        return mask & (latitudes >= self.min_lat) & (latitudes <= self.max_lat)
+
+
+class Circle:
+    """Calote esférica: pontos a até `radius_km` (grande círculo) do centro."""
+
+    def __init__(self, latitude, longitude, radius_km):
+        _check_coordinates(latitude, longitude)
+        if not radius_km > 0:
+            raise ValueError("radius_km deve ser positivo")
+        self.latitude, self.longitude = float(latitude), float(longitude)
+        self.radius_km = float(radius_km)
+        self._angle = self.radius_km / EARTH_RADIUS_KM
+        self._lat = math.radians(self.latitude)
+        self._lon = math.radians(self.longitude)
+
+    def _angle_to(self, lat, lon):
+        # Ângulo central (radianos) entre o centro e (lat, lon) em radianos
+        a = math.sin((lat - self._lat) / 2) ** 2 + \
+            math.cos(self._lat) * math.cos(lat) * math.sin((lon - self._lon) / 2) ** 2
+        return 2 * math.asin(math.sqrt(min(1.0, a)))
+
+    def _min_angle(self, lat0, lat1, lon0, lon1):
+        # Distância mínima ao retângulo: ao longo do meridiano do centro se ele estiver na faixa
+        # de longitudes; caso contrário num dos meridianos das bordas (em cada paralelo a distância
+        # cresce com |Δλ|). Ao longo de um meridiano o mínimo está no ponto do grande círculo mais
+        # próximo do centro (se cair no segmento) ou numa das pontas do segmento
+        lat0, lat1 = math.radians(lat0), math.radians(lat1)
+        if lon0 <= self.longitude <= lon1:
+            return abs(self._lat - min(max(self._lat, lat0), lat1))
+        best = math.inf
+        for edge in (math.radians(lon0), math.radians(lon1)):
+            candidates = [lat0, lat1]
+            closest = math.atan2(math.sin(self._lat), math.cos(self._lat) * math.cos(self._lon - edge))
+            if lat0 < closest < lat1:
+                candidates.append(closest)
+            best = min(best, min(self._angle_to(lat, edge) for lat in candidates))
+        return best
+
+    def classify(self, lat0, lat1, lon0, lon1):
+        if self._min_angle(lat0, lat1, lon0, lon1) > self._angle:
+            return OUTSIDE
+        # Uma calote com raio < 90° é convexa: basta que os quatro cantos estejam dentro
+        if self._angle < math.pi / 2 and all(
+                self._angle_to(math.radians(lat), math.radians(lon)) <= self._angle
+                for lat in (lat0, lat1) for lon in (lon0, lon1)):
+            return INSIDE
+        return PARTIAL
+
+    def distances(self, latitudes, longitudes):
+        return haversine(self.latitude, self.longitude, latitudes, longitudes)
+
+    def contains(self, latitudes, longitudes):
+        return self.distances(latitudes, longitudes) <= self.radius_km
+
+
+class Polygon:
+    """Polígono (ou multipolígono) GeoJSON, com buracos, no plano longitude/latitude.
+
+    O interior segue a regra par-ímpar sobre todos os anéis, pelo que os
+    buracos e as partes de um MultiPolygon são tratados da mesma forma.
+    Como recomenda o RFC 7946, um polígono que atravesse o antimeridiano deve
+    vir cortado em duas partes (MultiPolygon).
+    """
+
+    def __init__(self, rings):
+        starts, ends = [], []
+        total = 0
+        for ring in rings:
+            try:
+                ring = np.asarray(ring, dtype=np.float64)
+            except (TypeError, ValueError):
+                ring = np.empty(0)
+            if ring.ndim != 2 or ring.shape[1] < 2 or len(ring) < 3:
+                raise ValueError("Cada anel precisa de pelo menos 3 posições [lon, lat]")
+            _check_coordinates(ring[:, 1], ring[:, 0])
+            if not np.array_equal(ring[0, :2], ring[-1, :2]):
+                ring = np.vstack([ring[:, :2], ring[:1, :2]])
+            total += len(ring)
+            starts.append(ring[:-1, :2])
+            ends.append(ring[1:, :2])
+        if not starts:
+            raise ValueError("O polígono não tem anéis")
+        if total > MAX_POLYGON_VERTICES:
+            raise ValueError(f"O polígono tem mais de {MAX_POLYGON_VERTICES} vértices")
+        starts, ends = np.vstack(starts), np.vstack(ends)
+        self.x1, self.y1 = starts[:, 0], starts[:, 1]
+        self.x2, self.y2 = ends[:, 0], ends[:, 1]
+        self.min_lon, self.max_lon = float(min(self.x1.min(), self.x2.min())), float(max(self.x1.max(), self.x2.max()))
+        self.min_lat, self.max_lat = float(min(self.y1.min(), self.y2.min())), float(max(self.y1.max(), self.y2.max()))
+
+    @classmethod
+    def from_geojson(cls, geometry):
+        if geometry.get('type') == 'Polygon':
+            return cls(geometry['coordinates'])
+        if geometry.get('type') == 'MultiPolygon':
+            return cls([ring for polygon in geometry['coordinates'] for ring in polygon])
+        raise ValueError("A geometria deve ser Polygon ou MultiPolygon")
+
+    def _edges_touch(self, lat0, lat1, lon0, lon1):
+        # Alguma aresta interseta o retângulo? (eixos separadores: x, y e a normal da aresta)
+        overlap = (np.maximum(self.x1, self.x2) >= lon0) & (np.minimum(self.x1, self.x2) <= lon1) & \
+                  (np.maximum(self.y1, self.y2) >= lat0) & (np.minimum(self.y1, self.y2) <= lat1)
+        if not overlap.any():
+            return False
+        x1, y1 = self.x1[overlap], self.y1[overlap]
+        dx, dy = self.x2[overlap] - x1, self.y2[overlap] - y1
+        sides = np.stack([dx * (lat - y1) - dy * (lon - x1) for lat in (lat0, lat1) for lon in (lon0, lon1)])
+        return bool((~((sides > 0).all(axis=0) | (sides < 0).all(axis=0))).any())
+
+    def classify(self, lat0, lat1, lon0, lon1):
+        if lat0 > self.max_lat or lat1 < self.min_lat or lon0 > self.max_lon or lon1 < self.min_lon:
+            return OUTSIDE
+        if self._edges_touch(lat0, lat1, lon0, lon1):
+            return PARTIAL
+        # Nenhuma aresta toca o retângulo: está todo dentro ou todo fora, como o seu centro
+        return INSIDE if self.contains([(lat0 + lat1) / 2], [(lon0 + lon1) / 2])[0] else OUTSIDE
+
+    def contains(self, latitudes, longitudes):
+        """Ponto-em-polígono vetorizado (raio horizontal, regra par-ímpar)."""
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        inside = np.zeros(len(latitudes), dtype=bool)
+        candidates = np.flatnonzero((latitudes >= self.min_lat) & (latitudes <= self.max_lat) &
+                                    (longitudes >= self.min_lon) & (longitudes <= self.max_lon))
+        block = max(1, CONTAINS_BLOCK_PAIRS // len(self.x1))
+        for start in range(0, len(candidates), block):
+            rows = candidates[start:start + block]
+            py, px = latitudes[rows, None], longitudes[rows, None]
+            crosses = (self.y1 > py) != (self.y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = self.x1 + (py - self.y1) * (self.x2 - self.x1) / (self.y2 - self.y1)
+            inside[rows] = np.count_nonzero(crosses & (px < x_cross), axis=1) % 2 == 1
+        return inside
+
+
+def from_geojson(geometry, radius_km=None):
+    """Forma a partir de uma geometria (ou Feature) GeoJSON.
+
+    Polygon/MultiPolygon dão um Polygon; um Point com `radius_km` (argumento
+    ou propriedade da Feature) dá um Circle.
+    """
+    if not isinstance(geometry, dict):
+        raise ValueError("geometry deve ser um objeto GeoJSON")
+    if geometry.get('type') == 'Feature':
+        radius_km = (geometry.get('properties') or {}).get('radius_km', radius_km)
+        geometry = geometry.get('geometry') or {}
+    try:
+        if geometry.get('type') == 'Point':
+            if radius_km is None:
+                raise ValueError("Um Point precisa de radius_km")
+            longitude, latitude = geometry['coordinates'][:2]
+            return Circle(latitude, longitude, float(radius_km))
+        return Polygon.from_geojson(geometry)
+    except (KeyError, TypeError, IndexError):
+        raise ValueError("Geometria GeoJSON mal formada")
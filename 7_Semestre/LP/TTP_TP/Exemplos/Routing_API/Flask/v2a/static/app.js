@@ -160,6 +160,7 @@ function init() {
     
     canvas.addEventListener('mouseup', () => {
         isDragging = false;
+        updateTileMarkers();
     });
     
     canvas.addEventListener('mouseleave', () => {
@@ -171,6 +172,7 @@ function init() {
         e.preventDefault();
         camera.position.z += e.deltaY * 0.001;
         camera.position.z = Math.max(1.5, Math.min(5, camera.position.z));
+        updateTileMarkers();
     });
     
     // Redimensionar ao alterar o tamanho da janela
@@ -182,6 +184,11 @@ function init() {
     
     // Carregar cidades
     loadCities();
+
+    // Marcadores por tile; a rotação automática muda os tiles visíveis
+    updateTileMarkers();
+    setInterval(updateTileMarkers, 1000);
+    setInterval(() => updateTileMarkers(true), TILE_REFRESH_MS);
     
     // Carregar países
     loadCountries();
@@ -230,17 +237,31 @@ function latLonToVector3(lat, lon, radius = 1) {
     return new THREE.Vector3(x, y, z);
 }
 
+// Lê todas as páginas de /cities. 'no-cache' faz o browser revalidar cada
+// página com o ETag guardado: sem alterações na tabela a resposta é um 304
+async function fetchAllCities(pageSize = 5000) {
+    const all = [];
+    let afterId = 0;
+    while (afterId !== null) {
+        const response = await fetch(`/api/routing/cities?after_id=${afterId}&limit=${pageSize}`, { cache: 'no-cache' });
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        const data = await response.json();
+        all.push(...data.cities);
+        afterId = data.next_after_id;
+    }
+    return all;
+}
+
 // Carregar cidades da API
 async function loadCities() {
     showLoading(true);
     try {
-        const response = await fetch('/api/routing/cities');
-        const data = await response.json();
-        cities = data.cities;
+        cities = await fetchAllCities();
         
         populateCitySelects();
         populateCityCheckboxes();
-        addCityMarkers();
         
         showLoading(false);
     } catch (error) {
@@ -298,18 +319,132 @@ function populateCityCheckboxes() {
     });
 }
 
-// Adicionar marcadores de cidades no globo
-function addCityMarkers() {
-    cities.forEach(city => {
-        const position = latLonToVector3(city.latitude, city.longitude, 1.01);
-        
-        const markerGeometry = new THREE.SphereGeometry(0.01, 16, 16);
-        const markerMaterial = new THREE.MeshBasicMaterial({ color: 0xff0000 });
-        const marker = new THREE.Mesh(markerGeometry, markerMaterial);
-        
-        marker.position.copy(position);
-        globe.add(marker);
+// Marcadores por tile: em vez de um marcador por cidade, pede-se a
+// /tiles/<nível>/<quadkey> só os tiles visíveis ao nível de zoom atual
+const MIN_TILE_LEVEL = 3;
+const MAX_TILE_LEVEL = 12;
+const TILE_REQUEST_DEPTH = 4; // Cada pedido traz no máximo 4^4 sub-tiles
+const TILE_REFRESH_MS = 30000; // Revalidação periódica dos tiles visíveis (304 se as cidades não mudaram)
+const tileMarkers = new Map(); // "nível/quadkey" -> marcador no globo
+let visibleTilesKey = '';
+
+// Nível dos tiles em função da distância da câmara (5 = longe, 1.5 = perto)
+function zoomToTileLevel() {
+    const closeness = (5 - camera.position.z) / 3.5;
+    return Math.round(MIN_TILE_LEVEL + closeness * (MAX_TILE_LEVEL - MIN_TILE_LEVEL));
+}
+
+// Limites do quadkey na grelha lat/lon usada pelo servidor (dígito = 2 * bit da latitude + bit da longitude)
+function quadkeyBounds(quadkey) {
+    let minLat = -90, maxLat = 90, minLon = -180, maxLon = 180;
+    for (const digit of quadkey) {
+        const d = Number(digit);
+        const midLat = (minLat + maxLat) / 2, midLon = (minLon + maxLon) / 2;
+        if (d & 2) minLat = midLat; else maxLat = midLat;
+        if (d & 1) minLon = midLon; else maxLon = midLon;
+    }
+    return { minLat, maxLat, minLon, maxLon };
+}
+
+// Um tile é visível se a calote vista pela câmara intersetar o círculo que o contém
+function isTileVisible(quadkey, viewDirection, viewAngle) {
+    if (quadkey.length < 2) {
+        return true;
+    }
+    const b = quadkeyBounds(quadkey);
+    const center = latLonToVector3((b.minLat + b.maxLat) / 2, (b.minLon + b.maxLon) / 2).normalize();
+    let radius = 0;
+    [[b.minLat, b.minLon], [b.minLat, b.maxLon], [b.maxLat, b.minLon], [b.maxLat, b.maxLon]].forEach(([lat, lon]) => {
+        radius = Math.max(radius, center.angleTo(latLonToVector3(lat, lon).normalize()));
     });
+    return center.angleTo(viewDirection) <= viewAngle + radius;
+}
+
+// Quadkeys de nível `level` visíveis, descendo a árvore só pelos ramos visíveis
+function visibleQuadkeys(level, viewDirection, viewAngle, prefix = '') {
+    if (!isTileVisible(prefix, viewDirection, viewAngle)) {
+        return [];
+    }
+    if (prefix.length === level) {
+        return [prefix];
+    }
+    return ['0', '1', '2', '3'].flatMap(digit => visibleQuadkeys(level, viewDirection, viewAngle, prefix + digit));
+}
+
+// Como em fetchAllCities, 'no-cache' faz o browser revalidar com o ETag guardado:
+// sem alterações nas cidades a resposta é um 304 e o corpo vem da cache HTTP
+async function fetchTiles(level, quadkey) {
+    const response = await fetch(`/api/routing/tiles/${level}/${quadkey}`, { cache: 'no-cache' });
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    return (await response.json()).tiles;
+}
+
+// Um marcador é recriado quando o agregado do seu tile muda
+function tileSignature(tile) {
+    return `${tile.count}:${tile.city ? tile.city.id : ''}:${tile.latitude}:${tile.longitude}`;
+}
+
+// Atualiza os marcadores para os tiles visíveis (chamado ao rodar/aproximar o globo);
+// com `refresh` pede de novo os tiles mesmo que a vista não tenha mudado
+async function updateTileMarkers(refresh = false) {
+    const level = zoomToTileLevel();
+    const requestLevel = Math.max(0, level - TILE_REQUEST_DEPTH);
+    // Direção da câmara nas coordenadas do globo e ângulo da calote visível
+    const viewDirection = globe.worldToLocal(camera.position.clone()).normalize();
+    const viewAngle = Math.acos(1 / camera.position.z);
+    const parents = visibleQuadkeys(requestLevel, viewDirection, viewAngle);
+    const key = `${level}:${parents.join(',')}`;
+    if (key === visibleTilesKey && !refresh) {
+        return;
+    }
+    visibleTilesKey = key;
+
+    try {
+        const batches = await Promise.all(parents.map(parent => fetchTiles(level, parent)));
+        if (key !== visibleTilesKey) {
+            return; // Entretanto a vista mudou
+        }
+        const wanted = new Map();
+        batches.flat().forEach(tile => wanted.set(`${level}/${tile.quadkey}`, tile));
+
+        tileMarkers.forEach((marker, id) => {
+            const tile = wanted.get(id);
+            if (!tile || marker.userData.signature !== tileSignature(tile)) {
+                globe.remove(marker);
+                marker.geometry.dispose();
+                marker.material.dispose();
+                tileMarkers.delete(id);
+            }
+        });
+        wanted.forEach((tile, id) => {
+            if (!tileMarkers.has(id)) {
+                const marker = createTileMarker(tile);
+                marker.userData.signature = tileSignature(tile);
+                tileMarkers.set(id, marker);
+            }
+        });
+    } catch (error) {
+        console.error('Erro ao carregar tiles:', error);
+    }
+}
+
+// Uma cidade isolada é um ponto vermelho; um agregado é laranja e cresce com o número de cidades
+function createTileMarker(tile) {
+    const single = tile.count === 1;
+    const size = single ? 0.01 : Math.min(0.04, 0.01 + 0.004 * Math.log2(tile.count));
+    const markerGeometry = new THREE.SphereGeometry(size, 16, 16);
+    const markerMaterial = new THREE.MeshBasicMaterial({ color: single ? 0xff0000 : 0xff9800 });
+    const marker = new THREE.Mesh(markerGeometry, markerMaterial);
+
+    const city = tile.city;
+    const position = single && city
+        ? latLonToVector3(city.latitude, city.longitude, 1.01)
+        : latLonToVector3(tile.latitude, tile.longitude, 1.01);
+    marker.position.copy(position);
+    globe.add(marker);
+    return marker;
 }
 
 // NOVO: Função auxiliar para desenhar um polígono (fronteira)
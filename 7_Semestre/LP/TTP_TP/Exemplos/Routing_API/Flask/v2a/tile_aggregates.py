@@ -0,0 +1,167 @@
+import os
+import threading
+
+import numpy as np
+
+from coordinate_store import CoordinateStore
+from distance_engine import unit_vectors_to_degrees
+from spatial_codes import MORTON_LEVELS, morton_encode, morton_quadkeys
+
+MAX_TILE_LEVEL = 12  # Nível mais fino agregado (células de ~0.04° x 0.09°)
+MAX_TILES_PER_REQUEST = 4096  # Agregados máximos devolvidos por pedido (4^6 filhos de um tile)
+
+
+class TileLevel:
+    """Agregados de um nível: um registo por quadkey com pelo menos uma cidade.
+
+    `prefixes` (ordenado) é o quadkey do tile como inteiro em base 4, o que
+    permite obter os tiles contidos num quadkey mais grosso com uma procura
+    binária.
+    """
+
+    __slots__ = ('level', 'prefixes', 'counts', 'latitudes', 'longitudes', 'representatives')
+
+    def __init__(self, level, prefixes, counts, latitudes, longitudes, representatives):
+        self.level = level
+        self.prefixes = prefixes
+        self.counts = counts
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.representatives = representatives  # Id da cidade representativa
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def within(self, quadkey):
+        """Fatia [início, fim) dos tiles deste nível contidos em `quadkey`."""
+        shift = 2 * (self.level - len(quadkey))
+        prefix = int(quadkey, 4) if quadkey else 0
+        start, end = np.searchsorted(self.prefixes, [prefix << shift, (prefix + 1) << shift])
+        return int(start), int(end)
+
+
+class TileAggregates:
+    """Contagem, centróide e cidade representativa por tile, para cada nível.
+
+    Os tiles são os quadrantes do quadkey de `quadtree_index` (o mesmo prefixo
+    do código de Morton), pelo que os agregados servem os dois modos de
+    índice. São calculados de uma só vez a partir das coordenadas em memória:
+    as cidades são ordenadas uma vez pelo código de Morton e, em cada nível,
+    os grupos são as mudanças de prefixo. O centróide é a média esférica
+    (soma dos vetores unitários) e a representativa é a cidade mais próxima
+    dele. Existe uma instância por base de dados, obtida com `for_db`, e os
+    agregados são recalculados quando o CoordinateStore muda.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, db_name, max_level=MAX_TILE_LEVEL):
+        self.db_name = db_name
+        self.max_level = max_level
+        self._lock = threading.Lock()
+        self._levels = None
+        self._generation = None
+
+    @classmethod
+    def for_db(cls, db_name):
+        key = os.path.abspath(db_name)
+        with cls._instances_lock:
+            tiles = cls._instances.get(key)
+            if tiles is None:
+                tiles = cls(key)
+                cls._instances[key] = tiles
+            return tiles
+
+    def build(self, store):
+        ids, latitudes, longitudes = store.ids, store.latitudes, store.longitudes
+        codes = np.asarray(morton_encode(latitudes, longitudes), dtype=np.int64).reshape(-1)
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        vectors = store.points().unit_vectors()[order]
+
+        levels = []
+        for level in range(self.max_level + 1):
+            prefixes = codes >> (2 * (MORTON_LEVELS - level))
+            starts = np.flatnonzero(np.diff(prefixes, prepend=-1))
+            counts = np.diff(np.append(starts, len(prefixes)))
+            if len(starts) == 0:
+                levels.append(TileLevel(level, prefixes, counts, np.empty(0), np.empty(0), np.empty(0, np.int64)))
+                continue
+            sums = np.add.reduceat(vectors, starts, axis=0)
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1), 1e-12)[:, None]
+            centroid_lat, centroid_lon = unit_vectors_to_degrees(centroids)
+
+            # Cidade mais próxima do centróide = maior produto interno no seu grupo
+            group = np.repeat(np.arange(len(starts)), counts)
+            dots = np.einsum('ij,ij->i', vectors, centroids[group])
+            best = np.maximum.reduceat(dots, starts)
+            candidates = np.flatnonzero(dots >= best[group])
+            _, first = np.unique(group[candidates], return_index=True)
+            levels.append(TileLevel(level, prefixes[starts], counts.astype(np.int64), centroid_lat, centroid_lon,
+                                    ids[order[candidates[first]]]))
+        return levels
+
+    def levels(self):
+        """Agregados de todos os níveis, recalculados se as cidades mudaram."""
+        store = CoordinateStore.for_db(self.db_name)
+        len(store)  # Garante que o store está carregado antes de ler a geração
+        with self._lock:
+            if self._levels is None or self._generation != store.generation:
+                generation = store.generation
+                self._levels = self.build(store)
+                self._generation = generation
+            return self._levels
+
+    def validate(self, level, quadkey):
+        """Lança ValueError se o pedido (nível, quadkey) não for válido."""
+        if not 0 <= level <= self.max_level:
+            raise ValueError(f"O nível deve estar entre 0 e {self.max_level}")
+        if len(quadkey) > level or any(digit not in '0123' for digit in quadkey):
+            raise ValueError(f"Quadkey inválido para o nível {level}: {quadkey!r}")
+        if 4 ** (level - len(quadkey)) > MAX_TILES_PER_REQUEST:
+            # Limite pelo número possível de filhos, não pelo número ocupado
+            raise ValueError(f"Pedido demasiado grande: no máximo {MAX_TILES_PER_REQUEST} tiles por pedido")
+
+    def tiles(self, level, quadkey=''):
+        """Agregados de nível `level` contidos em `quadkey` (um tile mais grosso ou o próprio).
+
+        Retorna uma lista de dicts com quadkey, count, latitude/longitude do
+        centróide e city_id da cidade representativa.
+        """
+        self.validate(level, quadkey)
+        tile_level = self.levels()[level]
+        start, end = tile_level.within(quadkey)
+        ids = tile_level.representatives[start:end].tolist()
+        codes = tile_level.prefixes[start:end] << (2 * (MORTON_LEVELS - level))
+        keys = morton_quadkeys(codes, level) if level else [''] * (end - start)
+        return [
+            {
+                'quadkey': key,
+                'count': count,
+                'latitude': latitude,
+                'longitude': longitude,
+                'city_id': city_id,
+            }
+            for key, count, latitude, longitude, city_id in zip(
+                keys, tile_level.counts[start:end].tolist(), tile_level.latitudes[start:end].tolist(),
+                tile_level.longitudes[start:end].tolist(), ids)
+        ]
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Calcula os agregados por tile das cidades")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'routing_system.db'))
+    args = parser.parse_args()
+
+    tiles = TileAggregates.for_db(args.db)
+    started = time.perf_counter()
+    levels = tiles.levels()
+    print(f"{len(CoordinateStore.for_db(args.db))} cidades agregadas em {time.perf_counter() - started:.3f}s")
+    for tile_level in levels:
+        print(f"  nível {tile_level.level:2d}: {len(tile_level):7d} tiles ocupados")
+    for tile in tiles.tiles(min(3, tiles.max_level)):
+        print(f"  {tile['quadkey']}: {tile['count']} cidades, representativa {tile['city_id']}")
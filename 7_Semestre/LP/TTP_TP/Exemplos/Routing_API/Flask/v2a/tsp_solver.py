@@ -0,0 +1,334 @@
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+import distance_engine
+from spatial_grid import UnitVectorGrid
+
+DEFAULT_TIME_BUDGET = 1.0  # Segundos de procura local por tour
+DEFAULT_CANDIDATES = 8  # Vizinhos candidatos por cidade nos movimentos 2-opt/Or-opt
+MATRIX_LIMIT = 2500  # Acima disto as distâncias são calculadas sob pedido (sem matriz n x n)
+OR_OPT_MAX_SEGMENT = 3  # Comprimento máximo dos segmentos deslocados pelo Or-opt
+HELD_KARP_MAX_CITIES = 16  # Até aqui o tour ótimo exato (Held-Karp) é usado automaticamente
+PROGRESS_INTERVAL = 256  # Iterações do vizinho mais próximo entre chamadas de `progress`
+CONSTRUCTION_SHARE = 0.2  # Fração do progresso de solve_tour atribuída ao tour guloso quando há melhoria
+_EPS = 1e-9
+
+
+class DistanceTable:
+    """Distâncias (km) entre as cidades de um tour e listas de vizinhos candidatos.
+
+    Até MATRIX_LIMIT cidades a matriz completa é pré-calculada (vetorizada) e
+    guardada em listas Python, mais rápidas de indexar no ciclo da procura
+    local. Acima disso as distâncias vêm da corda entre vetores unitários e os
+    candidatos da grelha k-NN.
+    """
+
+    def __init__(self, points, candidates=DEFAULT_CANDIDATES):
+        n = len(points)
+        self.n = n
+        k = max(min(candidates, n - 1), 0)
+        if n <= MATRIX_LIMIT:
+            matrix = distance_engine.distance_matrix(points, points)
+            rows = matrix.tolist()
+            self.distance = lambda a, b: rows[a][b]
+            np.fill_diagonal(matrix, np.inf)
+            if k == 0:
+                self.candidates = [[] for _ in range(n)]
+                return
+            nearest = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(matrix, nearest, axis=1), axis=1)
+            self.candidates = np.take_along_axis(nearest, order, axis=1).tolist()
+        else:
+            vectors = points.unit_vectors()
+            xs, ys, zs = (vectors[:, axis].tolist() for axis in range(3))
+            diameter = 2.0 * distance_engine.EARTH_RADIUS_KM
+
+            def distance(a, b):
+                dx, dy, dz = xs[a] - xs[b], ys[a] - ys[b], zs[a] - zs[b]
+                return diameter * math.asin(min(math.sqrt(dx * dx + dy * dy + dz * dz) * 0.5, 1.0))
+
+            self.distance = distance
+            knn, _ = UnitVectorGrid.for_neighbors(vectors, k).knn(k)
+            self.candidates = knn.tolist()
+
+    def tour_length(self, tour):
+        distance = self.distance
+        return sum(distance(tour[i - 1], tour[i]) for i in range(len(tour))) if len(tour) > 1 else 0.0
+
+
+class _LocalSearch:
+    # Tour circular em array (tour[i] = cidade, pos[cidade] = i)
+    def __init__(self, table, order):
+        self.table = table
+        self.distance = table.distance
+        self.candidates = table.candidates
+        self.tour = list(order)
+        self.n = len(self.tour)
+        self.pos = [0] * table.n
+        for i, city in enumerate(self.tour):
+            self.pos[city] = i
+
+    def succ(self, city):
+        return self.tour[(self.pos[city] + 1) % self.n]
+
+    def pred(self, city):
+        return self.tour[self.pos[city] - 1]
+
+    def _reverse(self, i, j):
+        # Inverte as posições i..j (no sentido do tour); inverte o complemento se for mais curto
+        n, tour, pos = self.n, self.tour, self.pos
+        length = (j - i) % n + 1
+        if 2 * length > n:
+            i, j = (j + 1) % n, (i - 1) % n
+            length = n - length
+        for _ in range(length // 2):
+            ci, cj = tour[i], tour[j]
+            tour[i], tour[j] = cj, ci
+            pos[cj], pos[ci] = i, j
+            i = (i + 1) % n
+            j = (j - 1) % n
+
+    def two_opt(self, a):
+        """Primeiro movimento 2-opt que melhora, com uma das arestas de `a`."""
+        distance, pos = self.distance, self.pos
+        for forward in (True, False):
+            b = self.succ(a) if forward else self.pred(a)
+            d_ab = distance(a, b)
+            for c in self.candidates[a]:
+                d_ac = distance(a, c)
+                if d_ac >= d_ab - _EPS:
+                    break  # Candidatos ordenados: nenhum seguinte pode melhorar
+                d = self.succ(c) if forward else self.pred(c)
+                if c == b or d == a:
+                    continue
+                if d_ac + distance(b, d) - d_ab - distance(c, d) < -_EPS:
+                    # a b ... c d -> a c ... b d  (ou, para trás, b a ... d c -> b d ... a c)
+                    if forward:
+                        self._reverse(pos[b], pos[c])
+                    else:
+                        self._reverse(pos[a], pos[d])
+                    return a, b, c, d
+        return None
+
+    def or_opt(self, a):
+        """Desloca um segmento de 1 a 3 cidades que começa ou acaba em `a`."""
+        n, tour, distance = self.n, self.tour, self.distance
+        for length in range(1, min(OR_OPT_MAX_SEGMENT, n - 3) + 1):
+            starts = {self.pos[a], (self.pos[a] - length + 1) % n}
+            for i in starts:
+                segment = [tour[(i + t) % n] for t in range(length)]
+                first, last = segment[0], segment[-1]
+                prev_city, next_city = tour[i - 1], tour[(i + length) % n]
+                removal_gain = distance(prev_city, first) + distance(last, next_city) - distance(prev_city, next_city)
+                if removal_gain <= _EPS:
+                    continue
+                in_segment = set(segment)
+                for end in (first, last):
+                    for c in self.candidates[end]:
+                        if distance(end, c) >= removal_gain:
+                            break
+                        if c in in_segment:
+                            continue
+                        # Inserir entre c e o seu sucessor, ou entre o antecessor e c
+                        for u, w in ((c, self.succ(c)), (self.pred(c), c)):
+                            if u == prev_city and w == first or u == last and w == next_city:
+                                continue
+                            forward_cost = distance(u, first) + distance(last, w)
+                            reverse_cost = distance(u, last) + distance(first, w)
+                            delta = min(forward_cost, reverse_cost) - distance(u, w) - removal_gain
+                            if delta < -_EPS:
+                                inserted = segment if forward_cost <= reverse_cost else segment[::-1]
+                                self._move_segment(i, length, u, inserted)
+                                return prev_city, next_city, first, last, u, w
+        return None
+
+    def _move_segment(self, i, length, after, inserted):
+        n = self.n
+        rest = [self.tour[(i + length + t) % n] for t in range(n - length)]
+        at = rest.index(after) + 1
+        self.tour[:] = rest[:at] + inserted + rest[at:]
+        for position, city in enumerate(self.tour):
+            self.pos[city] = position
+
+    def run(self, deadline=None, progress=None, time_budget=None):
+        # Fila de cidades "ativas" (don't-look bits): só se revisitam as tocadas por um movimento.
+        # `progress(fração)` é chamado nos mesmos pontos em que o prazo é verificado
+        queue = deque(self.tour)
+        queued = [False] * self.table.n
+        for city in self.tour:
+            queued[city] = True
+        steps = 0
+        while queue:
+            steps += 1
+            if steps & 63 == 0:
+                now = time.perf_counter()
+                if deadline is not None and now > deadline:
+                    return False
+                if progress is not None:
+                    progress(1.0 - (deadline - now) / time_budget if deadline is not None and time_budget else 0.0)
+            a = queue.popleft()
+            queued[a] = False
+            touched = self.two_opt(a) or self.or_opt(a)
+            if touched:
+                for city in touched:
+                    if not queued[city]:
+                        queued[city] = True
+                        queue.append(city)
+        return True
+
+
+def improve_tour(table, order, time_budget=DEFAULT_TIME_BUDGET, progress=None):
+    """Melhora um tour com 2-opt e Or-opt até um ótimo local ou até esgotar o tempo.
+
+    `order` é a sequência de índices do tour (sem repetir a cidade inicial).
+    `progress(fração do tempo gasto)`, se indicado, é chamado periodicamente
+    e pode interromper a procura lançando uma exceção. Retorna (ordem,
+    comprimento, convergiu), com a ordem a começar na mesma cidade que `order`.
+    """
+    if len(order) < 4:
+        return list(order), table.tour_length(order), True
+    search = _LocalSearch(table, order)
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    converged = search.run(deadline, progress, time_budget)
+    start = search.pos[order[0]]
+    tour = search.tour[start:] + search.tour[:start]
+    return tour, table.tour_length(tour), converged
+
+
+def held_karp(matrix):
+    """Tour ótimo exato por programação dinâmica sobre subconjuntos (Held-Karp).
+
+    `matrix` é a matriz (n, n) de distâncias; o tour começa e acaba no índice 0.
+    dp[mask, j] é o custo mínimo de sair de 0, visitar exatamente as cidades de
+    `mask` (bits 0..n-2 = cidades 1..n-1) e terminar em j. As camadas (número
+    de bits de `mask`) são calculadas de uma só vez em arrays: cada estado
+    "puxa" o mínimo de dp[mask sem j, i] + d(i, j) sobre todos os i. O custo é
+    O(2^n · n²) operações NumPy e O(2^n · n) memória. Retorna (ordem, comprimento).
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    n = len(matrix)
+    if n <= 3:
+        order = list(range(n))
+        return order, sum(float(matrix[order[i - 1], order[i]]) for i in range(n)) if n > 1 else 0.0
+
+    m = n - 1
+    inner = matrix[1:, 1:]
+    full = (1 << m) - 1
+    masks = np.arange(1 << m, dtype=np.int64)
+    bits = (masks[:, None] >> np.arange(m)) & 1
+    popcount = bits.sum(axis=1)
+
+    dp = np.full((1 << m, m), np.inf)
+    parent = np.full((1 << m, m), -1, dtype=np.int8)
+    singles = 1 << np.arange(m)
+    dp[singles, np.arange(m)] = matrix[0, 1:]
+
+    for size in range(2, m + 1):
+        layer = masks[popcount == size]
+        layer_bits = bits[layer].astype(bool)
+        for j in range(m):
+            states = layer[layer_bits[:, j]]
+            previous = states ^ (1 << j)
+            # Puxa de todos os finais i do subconjunto anterior (inf se i não pertence)
+            costs = dp[previous] + inner[:, j]
+            best = np.argmin(costs, axis=1)
+            dp[states, j] = costs[np.arange(len(states)), best]
+            parent[states, j] = best
+
+    closing = dp[full] + matrix[1:, 0]
+    last = int(np.argmin(closing))
+    length = float(closing[last])
+
+    order = []
+    mask = full
+    while last >= 0:
+        order.append(last + 1)
+        previous = int(parent[mask, last])
+        mask ^= 1 << last
+        last = previous
+    order.append(0)
+    order.reverse()
+    return order, length
+
+
+def nearest_neighbor_order(points, progress=None):
+    """Tour guloso do vizinho mais próximo a partir do índice 0: (ordem, comprimento do ciclo).
+
+    `progress(fração)` é chamado a cada PROGRESS_INTERVAL cidades.
+    """
+    visited = np.zeros(len(points), dtype=bool)
+    current = 0
+    visited[current] = True
+    order = [current]
+    total_distance = 0.0
+
+    for step in range(len(points) - 1):
+        if progress is not None and step % PROGRESS_INTERVAL == 0:
+            progress(step / (len(points) - 1))
+        # Distâncias da cidade atual a todas as outras numa só operação
+        distances = distance_engine.one_to_many(points, current)
+        distances[visited] = np.inf
+        nearest = int(np.argmin(distances))
+
+        order.append(nearest)
+        visited[nearest] = True
+        total_distance += float(distances[nearest])
+        current = nearest
+
+    if len(order) > 1:
+        total_distance += float(distance_engine.one_to_many(points, current, points.take([0]))[0])
+
+    return order, total_distance
+
+
+def _stage_progress(progress, stage, start, share):
+    # Converte a fração de uma etapa na fração total de solve_tour
+    if progress is None:
+        return None
+    return lambda fraction: progress(start + share * min(max(fraction, 0.0), 1.0), stage)
+
+
+def solve_tour(points, time_budget=DEFAULT_TIME_BUDGET, improve=True, exact=None, progress=None):
+    """Tour fechado sobre `points` a começar no índice 0.
+
+    Held-Karp até HELD_KARP_MAX_CITIES pontos (ou com `exact=True`); acima
+    disso o vizinho mais próximo melhorado com 2-opt/Or-opt. `progress(fração,
+    etapa)`, se indicado, é chamado durante o tour guloso e a procura local
+    (pode interromper o cálculo lançando uma exceção). Retorna (ordem,
+    comprimento, detalhes).
+    """
+    if exact is None:
+        exact = len(points) <= HELD_KARP_MAX_CITIES
+    elif exact and len(points) > HELD_KARP_MAX_CITIES:
+        raise ValueError(f"O TSP exato aceita no máximo {HELD_KARP_MAX_CITIES} cidades")
+
+    construction_share = CONSTRUCTION_SHARE if exact or improve else 1.0
+    order, initial_distance = nearest_neighbor_order(
+        points, _stage_progress(progress, 'nearest_neighbor', 0.0, construction_share))
+    details = {'method': 'nearest_neighbor', 'initial_distance': initial_distance, 'optimal': False}
+    total_distance = initial_distance
+
+    if exact:
+        started = time.perf_counter()
+        order, total_distance = held_karp(distance_engine.distance_matrix(points, points))
+        details.update({
+            'method': 'held_karp',
+            'optimal': True,
+            'solver_seconds': time.perf_counter() - started,
+        })
+    elif improve and len(order) > 3:
+        started = time.perf_counter()
+        table = DistanceTable(points)
+        order, total_distance, converged = improve_tour(
+            table, order, time_budget,
+            _stage_progress(progress, 'local_search', construction_share, 1.0 - construction_share))
+        details.update({
+            'method': 'nearest_neighbor+2opt+oropt',
+            'local_optimum': converged,
+            'solver_seconds': time.perf_counter() - started,
+        })
+
+    return order, total_distance, details
@@ -0,0 +1,313 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import clustering_engine
+import distance_engine
+import tsp_solver
+from distance_engine import PointSet
+
+DEFAULT_MAX_WORKERS = os.cpu_count() or 1
+CAPACITY_ITERATIONS = 10  # Rondas de atribuição capacitada + atualização dos centróides
+REBALANCE_ROUNDS = 3  # Rondas de deslocação de paragens entre rotas
+REBALANCE_CANDIDATE_ROUTES = 3  # Rotas mais próximas (por centróide) testadas para cada paragem
+POOL_MIN_STOPS = 200  # Cidades mínimas (somando as rotas grandes) para valer a pena usar o pool
+_EPS = 1e-9
+
+
+# --- Agrupamento com capacidade -------------------------------------------------------
+
+def capacitated_assignment(vectors, demands, centroids, capacities):
+    """Atribui cada paragem ao centróide mais próximo que ainda tenha capacidade.
+
+    As paragens com maior "arrependimento" (diferença entre o melhor e o
+    segundo melhor centróide) escolhem primeiro, e em empate as de maior
+    procura. Retorna os rótulos, ou None se alguma paragem não couber.
+    """
+    m = len(centroids)
+    dots = vectors @ centroids.T
+    preference = np.argsort(-dots, axis=1)
+    if m > 1:
+        top = np.take_along_axis(dots, preference[:, :2], axis=1)
+        regret = top[:, 0] - top[:, 1]
+    else:
+        regret = np.zeros(len(vectors))
+    order = np.lexsort((-demands, -regret))
+
+    remaining = np.asarray(capacities, dtype=np.float64).tolist()
+    labels = np.full(len(vectors), -1, dtype=np.int64)
+    demand_list = demands.tolist()
+    preference_list = preference.tolist()
+    for stop in order.tolist():
+        demand = demand_list[stop]
+        for cluster in preference_list[stop]:
+            if remaining[cluster] >= demand:
+                remaining[cluster] -= demand
+                labels[stop] = cluster
+                break
+        else:
+            return None
+    return labels
+
+
+def first_fit_decreasing(demands, capacities):
+    """Empacotamento só pela capacidade: cada paragem, da maior procura para a
+    menor, vai para o primeiro veículo (pela ordem de `capacities`) onde cabe.
+
+    Ignora a geografia (o reequilíbrio corrige-a depois); serve quando a
+    atribuição por proximidade não encontra solução numa instância apertada.
+    Retorna os rótulos, ou None se alguma paragem não couber.
+    """
+    remaining = np.asarray(capacities, dtype=np.float64).tolist()
+    labels = np.full(len(demands), -1, dtype=np.int64)
+    demand_list = demands.tolist()
+    for stop in np.argsort(-demands, kind='stable').tolist():
+        demand = demand_list[stop]
+        for vehicle, free in enumerate(remaining):
+            if free >= demand:
+                remaining[vehicle] -= demand
+                labels[stop] = vehicle
+                break
+        else:
+            return None
+    return labels
+
+
+def capacitated_clusters(vectors, demands, capacities, seed=None):
+    """Um cluster por veículo, respeitando `capacities` (mesma ordem).
+
+    Parte dos centróides do k-means esférico e alterna atribuição capacitada
+    e recálculo dos centróides até os rótulos estabilizarem. Retorna os
+    rótulos ou None se a atribuição gulosa não encontrar solução.
+    """
+    m = len(capacities)
+    k = min(m, len(vectors))
+    centroids = clustering_engine.spherical_kmeans(vectors, k, seed=seed).centroids
+    if k < m:
+        # Mais veículos que paragens: os veículos a mais ficam sem paragens
+        centroids = np.vstack([centroids, np.repeat(centroids[:1], m - k, axis=0)])
+
+    labels = None
+    for _ in range(CAPACITY_ITERATIONS):
+        new_labels = capacitated_assignment(vectors, demands, centroids, capacities)
+        if new_labels is None:
+            return labels
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+        occupied = norms > 1e-12
+        centroids[occupied] = sums[occupied] / norms[occupied, None]
+    return labels
+
+
+# --- Tours por rota (em processos de trabalho) -------------------------------------------
+
+def _solve_route(lat, lon, time_budget):
+    # Corre num processo do pool: recebe só as coordenadas (radianos), com o depósito primeiro
+    order, length, details = tsp_solver.solve_tour(PointSet(lat, lon), time_budget)
+    return order, length, details['method']
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # 'spawn': o servidor tem várias threads (ver job_queue)
+            _executor = ProcessPoolExecutor(max_workers=max_workers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+        return _executor
+
+
+def pooled_routes(routes, max_workers=DEFAULT_MAX_WORKERS):
+    """Índices das rotas que solve_routes envia para o pool de processos.
+
+    Rotas até HELD_KARP_MAX_CITIES cidades (Held-Karp, milissegundos) nunca
+    vão para o pool: o arranque dos processos e a serialização custam mais
+    do que o paralelismo poupa. As maiores só vão se forem pelo menos duas e
+    somarem POOL_MIN_STOPS cidades.
+    """
+    large = [i for i, route in enumerate(routes) if len(route) > tsp_solver.HELD_KARP_MAX_CITIES]
+    if max_workers <= 1 or len(large) < 2 or sum(len(routes[i]) for i in large) < POOL_MIN_STOPS:
+        return []
+    return large
+
+
+def solve_routes(points, routes, time_budget, max_workers=DEFAULT_MAX_WORKERS):
+    """Resolve o TSP de cada rota (lista de índices em `points`, depósito primeiro).
+
+    As rotas grandes (ver pooled_routes) são calculadas em paralelo no pool
+    de processos enquanto as restantes são resolvidas no próprio processo.
+    Retorna [(tour, comprimento, método)], com cada tour a começar no depósito.
+    """
+    jobs = [(points.lat[route], points.lon[route], time_budget) for route in routes]
+    futures = {}
+    pooled = pooled_routes(routes, max_workers)
+    if pooled:
+        executor = _get_executor(max_workers)
+        futures = {i: executor.submit(_solve_route, *jobs[i]) for i in pooled}
+    solved = [None if i in futures else _solve_route(*job) for i, job in enumerate(jobs)]
+    for i, future in futures.items():
+        solved[i] = future.result()
+    return [([route[i] for i in order], length, method)
+            for route, (order, length, method) in zip(routes, solved)]
+
+
+# --- Reequilíbrio entre rotas ----------------------------------------------------------
+
+def _edge_lengths(points, tour):
+    # edges[i] = comprimento da aresta tour[i] -> tour[i + 1] (a última fecha o ciclo)
+    return distance_engine.consecutive_distances(points.take(np.asarray(tour + tour[:1])))
+
+
+def rebalance(points, tours, loads, capacities, demands):
+    """Desloca paragens entre rotas enquanto isso encurtar a distância total.
+
+    Cada paragem é retirada do seu tour (ganho = arestas poupadas) e
+    inserida na posição mais barata de uma das REBALANCE_CANDIDATE_ROUTES
+    rotas de centróide mais próximo com capacidade livre. `tours` e `loads`
+    são alterados no lugar. Retorna (movimentos, índices das rotas tocadas).
+    """
+    vectors = points.unit_vectors()
+    sums = np.array([vectors[tour[1:]].sum(axis=0) if len(tour) > 1 else vectors[0] for tour in tours])
+    centroids = sums / np.maximum(np.linalg.norm(sums, axis=1), 1e-12)[:, None]
+    edges = [_edge_lengths(points, tour) for tour in tours]
+    candidates_per_stop = max(min(REBALANCE_CANDIDATE_ROUTES + 1, len(tours)), 1)
+
+    moves = 0
+    touched = set()
+    for a in range(len(tours)):
+        for stop in list(tours[a][1:]):
+            tour_a = tours[a]
+            position = tour_a.index(stop)
+            prev_node, next_node = tour_a[position - 1], tour_a[(position + 1) % len(tour_a)]
+            shortcut = float(distance_engine.one_to_many(points, prev_node, points.take([next_node]))[0])
+            removal_gain = float(edges[a][position - 1] + edges[a][position]) - shortcut
+            if removal_gain <= _EPS:
+                continue
+
+            nearest_routes = np.argsort(-(centroids @ vectors[stop]))[:candidates_per_stop]
+            for b in nearest_routes.tolist():
+                if b == a or loads[b] + demands[stop] > capacities[b]:
+                    continue
+                tour_b = tours[b]
+                to_stop = distance_engine.one_to_many(points, stop, points.take(np.asarray(tour_b)))
+                insertion = to_stop + np.roll(to_stop, -1) - edges[b]
+                slot = int(np.argmin(insertion))
+                if insertion[slot] < removal_gain - _EPS:
+                    tour_a.pop(position)
+                    tour_b.insert(slot + 1, stop)
+                    loads[a] -= demands[stop]
+                    loads[b] += demands[stop]
+                    edges[a] = _edge_lengths(points, tour_a)
+                    edges[b] = _edge_lengths(points, tour_b)
+                    moves += 1
+                    touched.update((a, b))
+                    break
+    return moves, touched
+
+
+# --- VRP -------------------------------------------------------------------------------
+
+def solve_vrp(points, demands, capacities, time_budget=tsp_solver.DEFAULT_TIME_BUDGET, seed=None,
+              max_workers=DEFAULT_MAX_WORKERS):
+    """Problema de rotas de veículos com capacidade (CVRP), por agrupar-e-resolver.
+
+    `points` tem o depósito no índice 0 e as paragens a seguir; `demands`
+    (uma por paragem) e `capacities` (uma por veículo) estão na mesma
+    unidade. Usa os veículos de maior capacidade estritamente necessários,
+    agrupa as paragens com capacidade (se a atribuição por proximidade falhar,
+    empacota-as por first-fit decreasing antes de recorrer a mais um
+    veículo), resolve o tour de cada veículo (as rotas grandes em paralelo)
+    e reequilibra as rotas deslocando paragens entre elas, resolvendo de
+    novo só as rotas alteradas. Retorna (rotas, detalhes), com
+    uma rota (tour a começar no depósito, comprimento, carga) por veículo;
+    veículos não usados têm o tour [0].
+    """
+    started = time.perf_counter()
+    demands = np.asarray(demands, dtype=np.float64)
+    capacities = np.asarray(capacities, dtype=np.float64)
+    if len(demands) != len(points) - 1:
+        raise ValueError("É preciso uma procura por paragem")
+    if len(capacities) == 0:
+        raise ValueError("É preciso pelo menos um veículo")
+    if (demands < 0).any() or (capacities <= 0).any():
+        raise ValueError("As procuras não podem ser negativas e as capacidades devem ser positivas")
+    if len(demands) and demands.max() > capacities.max():
+        raise ValueError("Há uma paragem com procura superior à capacidade de qualquer veículo")
+    if demands.sum() > capacities.sum():
+        raise ValueError(f"Procura total ({demands.sum():g}) superior à capacidade da frota ({capacities.sum():g})")
+
+    fleet = np.argsort(-capacities, kind='stable')
+    used = int(np.searchsorted(np.cumsum(capacities[fleet]), demands.sum() - _EPS)) + 1 if len(demands) else 0
+    vectors = points.unit_vectors()[1:]
+    labels = None
+    assignment = None
+    while len(demands) and labels is None:
+        if used > len(fleet):
+            raise ValueError("Não foi possível repartir as paragens pelos veículos sem exceder a capacidade")
+        assignment = 'clusters'
+        labels = capacitated_clusters(vectors, demands, capacities[fleet[:used]], seed=seed)
+        if labels is None:
+            # A atribuição por proximidade falhou: empacota só pela capacidade
+            assignment = 'first_fit_decreasing'
+            labels = first_fit_decreasing(demands, capacities[fleet[:used]])
+        if labels is None:
+            used += 1  # Nem o empacotamento coube: mais um veículo
+    clustering_seconds = time.perf_counter() - started
+
+    routes = [[0] + (np.flatnonzero(labels == cluster) + 1).tolist() for cluster in range(used)]
+    route_capacities = capacities[fleet[:used]].tolist()
+    loads = [float(demands[np.asarray(route[1:], dtype=np.int64) - 1].sum()) for route in routes]
+    stop_demands = np.concatenate([[0.0], demands]).tolist()
+
+    solved = solve_routes(points, routes, time_budget, max_workers)
+    tours = [tour for tour, _, _ in solved]
+    lengths = [length for _, length, _ in solved]
+    methods = [method for _, _, method in solved]
+    initial_distance = sum(lengths)
+
+    total_moves = 0
+    rounds = 0
+    for rounds in range(1, REBALANCE_ROUNDS + 1):
+        moves, touched = rebalance(points, tours, loads, route_capacities, stop_demands)
+        if not moves:
+            break
+        total_moves += moves
+        touched = sorted(touched)
+        resolved = solve_routes(points, [tours[i] for i in touched], time_budget, max_workers)
+        for i, (tour, length, method) in zip(touched, resolved):
+            # Fica com o melhor entre o tour reequilibrado e o novo tour resolvido de raiz
+            current = float(_edge_lengths(points, tours[i]).sum())
+            if length < current - _EPS:
+                tours[i], lengths[i], methods[i] = tour, length, method
+            else:
+                lengths[i] = current
+
+    result = [([0], 0.0, 0.0)] * len(capacities)
+    for route_index, vehicle in enumerate(fleet[:used].tolist()):
+        result[vehicle] = (tours[route_index], lengths[route_index], loads[route_index])
+
+    return result, {
+        'vehicles_used': used,
+        'assignment': assignment,
+        'initial_distance': initial_distance,
+        'rebalance_moves': total_moves,
+        'rebalance_rounds': rounds,
+        'methods': sorted(set(methods)),
+        'clustering_seconds': clustering_seconds,
+        'solver_seconds': time.perf_counter() - started,
+        'workers': min(max_workers, len(pooled_routes(routes, max_workers))) or 1,
+    }